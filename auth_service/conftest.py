@@ -1,17 +1,62 @@
 import uuid
+from http import HTTPStatus
 
+import httpx
 import pytest
+from common.api.deadlines import DeadlineMiddleware
+from common.api.exceptions.handlers import handle_managed_exception
+from common.api.exceptions.managed import ManagedException
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
 from service.api.router import router
-from service.handlers.credentials import ph
+from service.handlers.hashing import get_password_hasher
+from service.handlers.user_service import get_user_service_client
+
+USER_SERVICE_URL = "http://localhost:8001"
+
+
+class FakeUserService:
+    """Answers calls to the user service with canned responses, and records them."""
+
+    def __init__(self) -> None:
+        self.routes: dict[tuple[str, str], httpx.Response | Exception] = {}
+        self.requests: list[httpx.Request] = []
+        self.client = httpx.AsyncClient(
+            base_url=USER_SERVICE_URL,
+            transport=httpx.MockTransport(self.handle),
+        )
+
+    def add(
+        self,
+        method: str,
+        path: str,
+        response: httpx.Response | Exception,
+    ) -> None:
+        self.routes[method, path] = response
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        response = self.routes.get((request.method, request.url.path))
+        if response is None:
+            return httpx.Response(HTTPStatus.NOT_FOUND, json={"detail": "Not Found"})
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def user_service() -> FakeUserService:
+    return FakeUserService()
 
 
 @pytest.fixture
-def app() -> FastAPI:
+def app(user_service: FakeUserService) -> FastAPI:
     app = FastAPI()
+    app.add_exception_handler(ManagedException, handle_managed_exception)
+    app.add_middleware(DeadlineMiddleware)
     app.include_router(router)
+    app.dependency_overrides[get_user_service_client] = lambda: user_service.client
     return app
 
 
@@ -29,11 +74,11 @@ def valid_uuid() -> str:
 
 @pytest.fixture
 def valid_hashed_password() -> str:
-    return ph.hash("valid_password")
+    return get_password_hasher().hash("valid_password")
 
 
 @pytest.fixture(autouse=True)
 def mock_env_vars(monkeypatch: pytest.MonkeyPatch) -> None:
     monkeypatch.setenv("JWT_SECRET", "test_secret")
     monkeypatch.setenv("JWT_ALGORITHM", "HS256")
-    monkeypatch.setenv("USER_SERVICE_URL", "http://localhost:8001")
+    monkeypatch.setenv("USER_SERVICE_URL", USER_SERVICE_URL)
@@ -0,0 +1,16 @@
+import logging
+from http import HTTPStatus
+
+from fastapi import APIRouter
+
+from service.handlers.hashing import get_hashing_pool
+
+# Operational endpoints for this service's operators, not for other services.
+router = APIRouter(prefix="/internal")
+
+
+@router.get("/metrics/hashing", status_code=HTTPStatus.OK)
+async def get_hashing_metrics() -> dict:
+    """Report the password hashing pool's queue depth, refusals and hash latencies."""
+    logging.debug("Endpoint called: get_hashing_metrics")
+    return get_hashing_pool().snapshot()
@@ -0,0 +1,25 @@
+from http import HTTPStatus
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from service.api.admin import router
+from service.handlers import hashing
+from service.handlers.hashing import HashingPool
+
+
+def test_hashing_metrics_are_served(monkeypatch: pytest.MonkeyPatch) -> None:
+    pool = HashingPool(workers=2, max_queue=8)
+    monkeypatch.setattr(hashing, "_pool", pool)
+    app = FastAPI()
+    app.include_router(router)
+
+    response = TestClient(app).get("/internal/metrics/hashing")
+    data = response.json()
+    pool.shutdown()
+
+    assert response.status_code == HTTPStatus.OK
+    assert data["workers"] == 2  # noqa: PLR2004
+    assert data["queued"] == 0
+    assert data["hash_seconds"]["count"] == 0
@@ -1,19 +1,25 @@
 from datetime import timedelta
 from http import HTTPStatus
 
+from common.api.encoding import NegotiatedResponse, NegotiatedRoute
 from common.api.schemas.user import AuthToken, InternalUserIdentity, UserCredentials
 from common.api.exceptions.user import UserAlreadyExistsError
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends
 from fastapi.exceptions import HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from requests.exceptions import HTTPError
+from httpx import AsyncClient, HTTPStatusError
 
 from service.config import JWTConfig, ServiceConfig, get_jwt_config, get_service_config
 from service.handlers.credentials import create_user, get_authenticated_uuid
 from service.handlers.tokens import create_token, get_identity
+from service.handlers.user_service import get_user_service_client
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-router = APIRouter()
+# The gateway may ask for identities as MessagePack rather than JSON.
+router = APIRouter(
+    route_class=NegotiatedRoute,
+    default_response_class=NegotiatedResponse,
+)
 
 
 @router.get("/user-identity", response_model=InternalUserIdentity)
@@ -26,19 +32,23 @@ def get_user_identity(
 
 
 @router.post("/token", response_model=AuthToken)
-def login(
+async def login(
+    background_tasks: BackgroundTasks,
     form_data: OAuth2PasswordRequestForm = Depends(),
     jwt_config: JWTConfig = Depends(get_jwt_config),
     service_config: ServiceConfig = Depends(get_service_config),
+    client: AsyncClient = Depends(get_user_service_client),
 ) -> AuthToken:
     """Expects a username and password responds with a JWT if they're valid."""
     try:
-        uuid = get_authenticated_uuid(
+        uuid = await get_authenticated_uuid(
             username=form_data.username,
             unhashed_password=form_data.password,
-            service_url=service_config.user_service_url,
+            client=client,
+            background_tasks=background_tasks,
+            use_msgpack=service_config.user_service_msgpack,
         )
-    except HTTPError as exc:
+    except HTTPStatusError as exc:
         if exc.response.status_code == HTTPStatus.NOT_FOUND:
             raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED) from None
         raise
@@ -47,18 +57,20 @@ def login(
 
 
 @router.post("/register", status_code=HTTPStatus.CREATED)
-def register(
+async def register(
     user_in: UserCredentials,
     service_config: ServiceConfig = Depends(get_service_config),
+    client: AsyncClient = Depends(get_user_service_client),
 ) -> None:
     """Expects a username and password, then creates a user."""
     try:
-        create_user(
+        await create_user(
             username=user_in.username,
             unhashed_password=user_in.unhashed_password,
-            service_url=service_config.user_service_url,
+            client=client,
+            use_msgpack=service_config.user_service_msgpack,
         )
-    except HTTPError as exc:
+    except HTTPStatusError as exc:
         if exc.response.status_code == HTTPStatus.CONFLICT:
             raise HTTPException(status_code=HTTPStatus.CONFLICT) from None
 
@@ -1,13 +1,18 @@
-import json
 import uuid
 from http import HTTPStatus
 
+import httpx
 import jwt
 import pytest
-import responses
+from argon2 import PasswordHasher
+from common.api.deadlines import TIMEOUT_HEADER
 from common.api.schemas.user import InternalUserIdentity, UserCredentials
 from fastapi.testclient import TestClient
 
+from conftest import FakeUserService
+from service.handlers import credentials
+from service.handlers.hashing import HashingPool
+
 
 def test_valid_token_provides_user_identity(
     client: TestClient,
@@ -36,9 +41,9 @@ def test_invalid_token_results_in_unauthorized_status(client: TestClient) -> Non
     assert response.status_code == HTTPStatus.UNAUTHORIZED
 
 
-@responses.activate
 def test_successful_login_with_correct_credentials(
     client: TestClient,
+    user_service: FakeUserService,
     valid_uuid: str,
     valid_hashed_password: str,
 ) -> None:
@@ -47,12 +52,41 @@ def test_successful_login_with_correct_credentials(
         "uuid": valid_uuid,
     }
 
-    responses.add(
-        responses.GET,
-        "http://localhost:8001/auth/valid_username",
-        body=json.dumps(user_auth_data),
-        status=HTTPStatus.OK,
-        content_type="application/json",
+    user_service.add(
+        "GET",
+        "/auth/valid_username/",
+        httpx.Response(HTTPStatus.OK, json=user_auth_data),
+    )
+
+    response = client.post(
+        "/token",
+        data={"username": "valid_username", "password": "valid_password"},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+
+
+def test_login_replaces_an_outdated_hash_after_answering(
+    client: TestClient,
+    user_service: FakeUserService,
+    valid_uuid: str,
+) -> None:
+    outdated = PasswordHasher(time_cost=1, memory_cost=8, parallelism=1)
+    user_service.add(
+        "GET",
+        "/auth/valid_username/",
+        httpx.Response(
+            HTTPStatus.OK,
+            json={
+                "hashed_password": outdated.hash("valid_password"),
+                "uuid": valid_uuid,
+            },
+        ),
+    )
+    user_service.add(
+        "PUT",
+        f"/users/{valid_uuid}/password",
+        httpx.Response(HTTPStatus.NO_CONTENT),
     )
 
     response = client.post(
@@ -61,11 +95,12 @@ def test_successful_login_with_correct_credentials(
     )
 
     assert response.status_code == HTTPStatus.OK
+    assert [request.method for request in user_service.requests] == ["GET", "PUT"]
 
 
-@responses.activate
 def test_invalid_credentials_result_in_unauthorized_status(
     client: TestClient,
+    user_service: FakeUserService,
     valid_hashed_password: str,
 ) -> None:
     user_auth_data = {
@@ -73,12 +108,10 @@ def test_invalid_credentials_result_in_unauthorized_status(
         "uuid": "valid_uuid",
     }
 
-    responses.add(
-        responses.GET,
-        "http://localhost:8001/auth/invalid_username",
-        body=json.dumps(user_auth_data),
-        status=HTTPStatus.NOT_FOUND,
-        content_type="application/json",
+    user_service.add(
+        "GET",
+        "/auth/invalid_username/",
+        httpx.Response(HTTPStatus.NOT_FOUND, json=user_auth_data),
     )
 
     response = client.post(
@@ -89,9 +122,9 @@ def test_invalid_credentials_result_in_unauthorized_status(
     assert response.status_code == HTTPStatus.UNAUTHORIZED
 
 
-@responses.activate
 def test_missing_credentials_result_in_unprocessable_status(
     client: TestClient,
+    user_service: FakeUserService,
     valid_hashed_password: str,
 ) -> None:
     user_auth_data = {
@@ -99,12 +132,10 @@ def test_missing_credentials_result_in_unprocessable_status(
         "uuid": "valid_uuid",
     }
 
-    responses.add(
-        responses.GET,
-        "http://localhost:8001/auth/username_without_password",
-        body=json.dumps(user_auth_data),
-        status=HTTPStatus.UNPROCESSABLE_ENTITY,
-        content_type="application/json",
+    user_service.add(
+        "GET",
+        "/auth/username_without_password/",
+        httpx.Response(HTTPStatus.UNPROCESSABLE_ENTITY, json=user_auth_data),
     )
 
     response = client.post(
@@ -115,21 +146,16 @@ def test_missing_credentials_result_in_unprocessable_status(
     assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
 
 
-@responses.activate
 def test_successful_registration_with_valid_credentials(
     client: TestClient,
+    user_service: FakeUserService,
 ) -> None:
     user = UserCredentials(
         username="valid_username",
         unhashed_password="valid_password",  # noqa: S106
     )
 
-    responses.add(
-        responses.POST,
-        "http://localhost:8001/users",
-        status=HTTPStatus.CREATED,
-        content_type="application/json",
-    )
+    user_service.add("POST", "/users", httpx.Response(HTTPStatus.CREATED))
 
     response = client.post(
         "/register",
@@ -139,21 +165,16 @@ def test_successful_registration_with_valid_credentials(
     assert response.status_code == HTTPStatus.CREATED
 
 
-@responses.activate
 def test_registration_fails_when_user_already_exists(
     client: TestClient,
+    user_service: FakeUserService,
 ) -> None:
     user = UserCredentials(
         username="existing_username",
         unhashed_password="valid_password",  # noqa: S106
     )
 
-    responses.add(
-        responses.POST,
-        "http://localhost:8001/users",
-        status=HTTPStatus.CONFLICT,
-        content_type="application/json",
-    )
+    user_service.add("POST", "/users", httpx.Response(HTTPStatus.CONFLICT))
 
     response = client.post(
         "/register",
@@ -171,19 +192,14 @@ def test_registration_fails_when_user_already_exists(
         ("", "", HTTPStatus.UNPROCESSABLE_ENTITY),
     ],
 )
-@responses.activate
 def test_registration_fails_for_invalid_inputs(
     client: TestClient,
+    user_service: FakeUserService,
     username: str,
     password: str,
     expected_status: HTTPStatus,
 ) -> None:
-    responses.add(
-        responses.POST,
-        "http://localhost:8001/users",
-        status=expected_status,
-        content_type="application/json",
-    )
+    user_service.add("POST", "/users", httpx.Response(expected_status))
 
     response = client.post(
         "/register",
@@ -191,3 +207,65 @@ def test_registration_fails_for_invalid_inputs(
     )
 
     assert response.status_code == expected_status
+
+
+def test_login_times_out_with_the_user_service(
+    client: TestClient,
+    user_service: FakeUserService,
+) -> None:
+    user_service.add(
+        "GET",
+        "/auth/valid_username/",
+        httpx.Response(HTTPStatus.GATEWAY_TIMEOUT),
+    )
+
+    response = client.post(
+        "/token",
+        data={"username": "valid_username", "password": "valid_password"},
+    )
+
+    assert response.status_code == HTTPStatus.GATEWAY_TIMEOUT
+
+
+def test_login_past_its_deadline_does_not_reach_the_user_service(
+    client: TestClient,
+    user_service: FakeUserService,
+) -> None:
+    response = client.post(
+        "/token",
+        data={"username": "valid_username", "password": "valid_password"},
+        headers={TIMEOUT_HEADER: "0"},
+    )
+
+    assert response.status_code == HTTPStatus.GATEWAY_TIMEOUT
+    assert len(user_service.requests) == 0
+
+
+def test_login_is_refused_while_hashing_is_overloaded(
+    client: TestClient,
+    user_service: FakeUserService,
+    valid_uuid: str,
+    valid_hashed_password: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    user_service.add(
+        "GET",
+        "/auth/valid_username/",
+        httpx.Response(
+            HTTPStatus.OK,
+            json={"hashed_password": valid_hashed_password, "uuid": valid_uuid},
+        ),
+    )
+    # Every worker is busy and nothing more may wait for one.
+    pool = HashingPool(workers=1, max_queue=0, retry_after=3)
+    pool.admitted = pool.workers
+    monkeypatch.setattr(credentials, "get_hashing_pool", lambda: pool)
+
+    response = client.post(
+        "/token",
+        data={"username": "valid_username", "password": "valid_password"},
+    )
+    pool.shutdown()
+
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "3"
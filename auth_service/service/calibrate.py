@@ -0,0 +1,186 @@
+import argparse
+import logging
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from argon2 import PasswordHasher
+from common.service_logging import configure_logging
+from dotenv import load_dotenv
+
+from service.config import get_argon2_config
+from service.handlers.hashing import default_workers
+
+DEFAULT_TARGET_MS = 250
+DEFAULT_MAX_MEMORY_MIB = 64
+# The least memory that OWASP recommends for Argon2id.
+DEFAULT_MIN_MEMORY_MIB = 19
+DEFAULT_SAMPLES = 5
+
+# Verified against, but never stored.
+_CALIBRATION_PASSWORD = "calibration password"  # noqa: S105
+
+
+@dataclass
+class Calibration:
+    time_cost: int
+    memory_cost: int
+    parallelism: int
+    verify_seconds: float
+
+    def hasher(self) -> PasswordHasher:
+        return PasswordHasher(
+            time_cost=self.time_cost,
+            memory_cost=self.memory_cost,
+            parallelism=self.parallelism,
+        )
+
+    def to_env(self) -> str:
+        return (
+            f"ARGON2_TIME_COST={self.time_cost}\n"
+            f"ARGON2_MEMORY_COST={self.memory_cost}\n"
+            f"ARGON2_PARALLELISM={self.parallelism}\n"
+        )
+
+
+def measure_verify(hasher: PasswordHasher, samples: int = DEFAULT_SAMPLES) -> float:
+    """Return the median number of seconds it takes `hasher` to verify a password."""
+    hashed = hasher.hash(_CALIBRATION_PASSWORD)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.verify(hashed, _CALIBRATION_PASSWORD)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def calibrate(
+    target_seconds: float,
+    max_memory_cost: int,
+    min_memory_cost: int,
+    parallelism: int,
+    measure: Callable[[PasswordHasher], float] = measure_verify,
+) -> Calibration:
+    """Pick the costliest parameters whose verifications take at most the target.
+
+    Memory is what makes a hash expensive to crack on GPUs and ASICs, so as much of it
+    as the target allows is used first, halving from `max_memory_cost` down to
+    `min_memory_cost`, and only then are passes added over it. If even a single pass
+    over the least memory takes longer than the target, that is what is picked.
+    """
+    min_memory_cost = max(min_memory_cost, 8 * parallelism)
+
+    def candidate(time_cost: int, memory_cost: int) -> Calibration:
+        calibration = Calibration(time_cost, memory_cost, parallelism, 0)
+        calibration.verify_seconds = measure(calibration.hasher())
+        logging.info(
+            "time_cost=%s memory_cost=%s parallelism=%s verifies in %.1f ms",
+            time_cost,
+            memory_cost,
+            parallelism,
+            calibration.verify_seconds * 1000,
+        )
+        return calibration
+
+    best = candidate(1, max(max_memory_cost, min_memory_cost))
+    while best.verify_seconds > target_seconds and best.memory_cost > min_memory_cost:
+        best = candidate(1, max(best.memory_cost // 2, min_memory_cost))
+    if best.verify_seconds > target_seconds:
+        logging.warning(
+            "No parameters verify within %.1f ms on this host",
+            target_seconds * 1000,
+        )
+        return best
+
+    # Each pass takes about as long as the first, so the estimate from it is rarely
+    # more than a pass off. Too slow, it is lowered until it fits; otherwise passes
+    # are added for as long as they fit.
+    time_cost = max(1, int(target_seconds / best.verify_seconds))
+    too_slow = False
+    while time_cost > best.time_cost:
+        estimated = candidate(time_cost, best.memory_cost)
+        if estimated.verify_seconds <= target_seconds:
+            best = estimated
+            break
+        too_slow = True
+        time_cost -= 1
+    if not too_slow:
+        while (
+            following := candidate(best.time_cost + 1, best.memory_cost)
+        ).verify_seconds <= target_seconds:
+            best = following
+    return best
+
+
+def _parse_args(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark Argon2 on this host and print the parameters that verify a "
+            "password within the target time, as ARGON2_* variables."
+        ),
+    )
+    parser.add_argument(
+        "--target-ms",
+        type=float,
+        default=DEFAULT_TARGET_MS,
+        help="longest a password may take to verify",
+    )
+    parser.add_argument(
+        "--max-memory-mib",
+        type=int,
+        default=DEFAULT_MAX_MEMORY_MIB,
+        help="most memory a single hash may use",
+    )
+    parser.add_argument(
+        "--min-memory-mib",
+        type=int,
+        default=DEFAULT_MIN_MEMORY_MIB,
+        help="least memory a single hash may use, whatever the target",
+    )
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        help="threads per hash (defaults to ARGON2_PARALLELISM)",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=DEFAULT_SAMPLES,
+        help="verifications timed per candidate",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    load_dotenv()
+    configure_logging()
+    args = _parse_args(argv)
+
+    config = get_argon2_config()
+    calibration = calibrate(
+        args.target_ms / 1000,
+        args.max_memory_mib * 1024,
+        args.min_memory_mib * 1024,
+        args.parallelism or config.argon2_parallelism,
+        measure=lambda hasher: measure_verify(hasher, args.samples),
+    )
+
+    workers = config.argon2_workers or default_workers(
+        calibration.hasher(),
+        config.argon2_memory_budget_mib,
+    )
+    logging.info(
+        "Calibrated to verify in %.1f ms, so %s workers can verify about %.0f "
+        "passwords a second",
+        calibration.verify_seconds * 1000,
+        workers,
+        workers / calibration.verify_seconds,
+    )
+    # Only the variables go to stdout, so they can be appended to the .env file.
+    sys.stdout.write(calibration.to_env())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+from collections.abc import Callable
+
+from argon2 import PasswordHasher
+
+from service.calibrate import calibrate, measure_verify
+
+MIB = 1024
+
+
+def cost_model(
+    seconds: Callable[[int, int], float],
+) -> Callable[[PasswordHasher], float]:
+    """Time verifications by the given function of time cost and MiB of memory."""
+    return lambda hasher: seconds(hasher.time_cost, hasher.memory_cost // MIB)
+
+
+def test_passes_are_added_over_the_most_memory_within_the_target() -> None:
+    calibration = calibrate(
+        0.25,
+        64 * MIB,
+        19 * MIB,
+        parallelism=2,
+        measure=cost_model(lambda t, m: 0.03 + 0.04 * t * m / 64),
+    )
+
+    assert calibration.memory_cost == 64 * MIB
+    assert calibration.time_cost == 5  # noqa: PLR2004
+    assert calibration.parallelism == 2  # noqa: PLR2004
+    assert calibration.verify_seconds <= 0.25  # noqa: PLR2004
+
+
+def test_overestimated_passes_are_taken_back() -> None:
+    calibration = calibrate(
+        0.25,
+        64 * MIB,
+        19 * MIB,
+        parallelism=1,
+        measure=cost_model(lambda t, _: 0.05 * t**2),
+    )
+
+    assert calibration.time_cost == 2  # noqa: PLR2004
+
+
+def test_memory_is_halved_until_a_pass_fits_the_target() -> None:
+    calibration = calibrate(
+        0.25,
+        64 * MIB,
+        19 * MIB,
+        parallelism=1,
+        measure=cost_model(lambda t, m: 0.4 * t * m / 64),
+    )
+
+    assert calibration.memory_cost == 32 * MIB
+    assert calibration.time_cost == 1
+
+
+def test_the_cheapest_parameters_are_picked_when_none_fit() -> None:
+    calibration = calibrate(
+        0.25,
+        64 * MIB,
+        19 * MIB,
+        parallelism=1,
+        measure=cost_model(lambda *_: 1.0),
+    )
+
+    assert calibration.memory_cost == 19 * MIB
+    assert calibration.time_cost == 1
+    assert calibration.to_env() == (
+        "ARGON2_TIME_COST=1\nARGON2_MEMORY_COST=19456\nARGON2_PARALLELISM=1\n"
+    )
+
+
+def test_verifications_are_timed_with_the_given_parameters() -> None:
+    hasher = PasswordHasher(time_cost=1, memory_cost=8, parallelism=1)
+
+    assert measure_verify(hasher, samples=3) > 0
@@ -1,12 +1,25 @@
 # flake8: noqa: N805
 
 import jwt
-from pydantic import field_validator
+from pydantic import ValidationInfo, field_validator
 from pydantic_settings import BaseSettings
 
 
 class ServiceConfig(BaseSettings):
     user_service_url: str
+    # Exchange MessagePack rather than JSON with the user service, which is smaller
+    # and cheaper to encode and decode on both sides.
+    user_service_msgpack: bool = False
+    # Seconds a request may take, calls to the user service included. Callers may
+    # ask for less with the X-Request-Timeout header, but not for more.
+    request_timeout: float = 5
+    # Calls to the user service share a pool of keep-alive connections to it. Seconds
+    # a call may take are capped by the request's deadline, if it has less left.
+    user_service_timeout: float = 5
+    user_service_connect_timeout: float = 1
+    user_service_max_connections: int = 100
+    user_service_max_keepalive_connections: int = 20
+    user_service_keepalive_expiry: float = 30
 
     @field_validator("user_service_url")
     def validate_service_url(cls, v: str) -> str:
@@ -15,6 +28,32 @@ class ServiceConfig(BaseSettings):
             raise ValueError(msg)
         return v
 
+    @field_validator("request_timeout")
+    def validate_request_timeout(cls, v: float) -> float:
+        if v <= 0:
+            msg = "REQUEST_TIMEOUT must be positive."
+            raise ValueError(msg)
+        return v
+
+    @field_validator(
+        "user_service_timeout",
+        "user_service_connect_timeout",
+        "user_service_max_connections",
+        "user_service_keepalive_expiry",
+    )
+    def validate_user_service_pool(cls, v: float, info: ValidationInfo) -> float:
+        if v <= 0:
+            msg = f"{info.field_name.upper()} must be positive."
+            raise ValueError(msg)
+        return v
+
+    @field_validator("user_service_max_keepalive_connections")
+    def validate_max_keepalive_connections(cls, v: int) -> int:
+        if v < 0:
+            msg = "USER_SERVICE_MAX_KEEPALIVE_CONNECTIONS must not be negative."
+            raise ValueError(msg)
+        return v
+
 
 class JWTConfig(BaseSettings):
     jwt_secret: str
@@ -37,6 +76,59 @@ class JWTConfig(BaseSettings):
         return v
 
 
+class Argon2Config(BaseSettings):
+    # Password hashes run on a pool of their own, so that a burst of logins cannot
+    # take the threads serving everything else. Unset, the pool is sized to the CPUs
+    # and to how many hashes fit in the memory budget at once.
+    argon2_workers: int | None = None
+    argon2_memory_budget_mib: int = 1024
+    # Hashes waiting for a worker beyond this many are refused with a 503, which
+    # tells the client to retry after `ARGON2_RETRY_AFTER` seconds.
+    argon2_max_queue: int = 64
+    argon2_retry_after: int = 1
+    # The cost of each hash, as picked for the host by `calibrate`. Users whose hashes
+    # were made with other parameters are rehashed with these when they log in.
+    argon2_time_cost: int = 3
+    argon2_parallelism: int = 4
+    # KiB per hash.
+    argon2_memory_cost: int = 65536
+
+    @field_validator("argon2_workers")
+    def validate_workers(cls, v: int | None) -> int | None:
+        if v is not None and v < 1:
+            msg = "ARGON2_WORKERS must be at least 1."
+            raise ValueError(msg)
+        return v
+
+    @field_validator(
+        "argon2_memory_budget_mib",
+        "argon2_retry_after",
+        "argon2_time_cost",
+        "argon2_parallelism",
+    )
+    def validate_positive(cls, v: int, info: ValidationInfo) -> int:
+        if v <= 0:
+            msg = f"{info.field_name.upper()} must be positive."
+            raise ValueError(msg)
+        return v
+
+    @field_validator("argon2_max_queue")
+    def validate_max_queue(cls, v: int) -> int:
+        if v < 0:
+            msg = "ARGON2_MAX_QUEUE must not be negative."
+            raise ValueError(msg)
+        return v
+
+    @field_validator("argon2_memory_cost")
+    def validate_memory_cost(cls, v: int, info: ValidationInfo) -> int:
+        # Argon2 needs at least 8 KiB for each lane.
+        parallelism = info.data.get("argon2_parallelism", 1)
+        if v < 8 * parallelism:
+            msg = "ARGON2_MEMORY_COST must be at least 8 KiB per ARGON2_PARALLELISM."
+            raise ValueError(msg)
+        return v
+
+
 # These mostly exist so that they can be mocked in fastapi route tests
 def get_jwt_config() -> JWTConfig:
     return JWTConfig()
@@ -44,3 +136,7 @@ def get_jwt_config() -> JWTConfig:
 
 def get_service_config() -> ServiceConfig:
     return ServiceConfig()
+
+
+def get_argon2_config() -> Argon2Config:
+    return Argon2Config()
@@ -1,6 +1,12 @@
 import pytest
 
-from service.config import JWTConfig, ServiceConfig, get_jwt_config, get_service_config
+from service.config import (
+    Argon2Config,
+    JWTConfig,
+    ServiceConfig,
+    get_jwt_config,
+    get_service_config,
+)
 
 
 def test_valid_config_object_created_when_jwt_secret_is_provided(
@@ -47,3 +53,44 @@ def test_exception_raised_when_service_url_is_not_provided(
 
     with pytest.raises(ValueError):
         get_service_config()
+
+
+@pytest.mark.parametrize(
+    ("name", "value"),
+    [
+        ("USER_SERVICE_TIMEOUT", "0"),
+        ("USER_SERVICE_CONNECT_TIMEOUT", "-1"),
+        ("USER_SERVICE_MAX_CONNECTIONS", "0"),
+        ("USER_SERVICE_MAX_KEEPALIVE_CONNECTIONS", "-1"),
+        ("USER_SERVICE_KEEPALIVE_EXPIRY", "0"),
+    ],
+)
+def test_exception_raised_when_user_service_pool_is_invalid(
+    monkeypatch: pytest.MonkeyPatch,
+    name: str,
+    value: str,
+) -> None:
+    monkeypatch.setenv("USER_SERVICE_URL", "https://test.url")
+    monkeypatch.setenv(name, value)
+
+    with pytest.raises(ValueError, match=name):
+        get_service_config()
+
+
+@pytest.mark.parametrize(
+    ("name", "value"),
+    [
+        ("ARGON2_TIME_COST", "0"),
+        ("ARGON2_PARALLELISM", "0"),
+        ("ARGON2_MEMORY_COST", "31"),
+    ],
+)
+def test_exception_raised_when_argon2_parameters_are_invalid(
+    monkeypatch: pytest.MonkeyPatch,
+    name: str,
+    value: str,
+) -> None:
+    monkeypatch.setenv(name, value)
+
+    with pytest.raises(ValueError, match=name):
+        Argon2Config()
@@ -1,53 +1,191 @@
-import requests
-from argon2 import PasswordHasher
-from common.api.schemas.user import CreateUserRequest, UserAuthData
+import logging
+from http import HTTPStatus
+from typing import Any
 
-ph = PasswordHasher()
+import httpx
+from common.api.deadlines import no_deadline, outgoing_timeout, timeout_headers
+from common.api.encoding import JSON, MSGPACK, decode, encode_msgpack
+from common.api.exceptions.general import DeadlineExceededError
+from common.api.schemas.user import (
+    CreateUserRequest,
+    UpdatePasswordHashRequest,
+    UserAuthData,
+)
+from fastapi import BackgroundTasks
 
+from service.handlers.hashing import get_hashing_pool, get_password_hasher
 
-def retrieve_hashed_password(
+
+def _timeout(client: httpx.AsyncClient) -> httpx.Timeout:
+    """Return the client's timeouts, cut short to finish within the deadline."""
+    left = outgoing_timeout(default=client.timeout.read)
+    return httpx.Timeout(
+        left,
+        connect=min(client.timeout.connect, left),
+        pool=left,
+    )
+
+
+async def _call_user_service(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    headers: dict[str, str] | None = None,
+    **kwargs: Any,  # noqa: ANN401
+) -> httpx.Response:
+    """Call the user service with whatever is left of the request's deadline.
+
+    The user service is told how long that is, so that it stops working on the call
+    when the caller stops waiting for it.
+
+    Raises:
+        DeadlineExceededError: If the deadline passes before the call returns.
+    """
+    try:
+        response = await client.request(
+            method,
+            url,
+            headers={**(headers or {}), **timeout_headers()},
+            timeout=_timeout(client),
+            **kwargs,
+        )
+    except httpx.TimeoutException:
+        raise DeadlineExceededError from None
+    if response.status_code == HTTPStatus.GATEWAY_TIMEOUT:
+        raise DeadlineExceededError
+    return response
+
+
+def _body(
+    request: CreateUserRequest | UpdatePasswordHashRequest,
+    *,
+    use_msgpack: bool,
+) -> dict[str, Any]:
+    """Return the arguments that send `request` as the body of a call."""
+    if use_msgpack:
+        return {
+            "content": encode_msgpack(request),
+            "headers": {"Content-Type": MSGPACK, "Accept": MSGPACK},
+        }
+    return {
+        "content": request.model_dump_json(),
+        "headers": {"Content-Type": JSON},
+    }
+
+
+async def retrieve_hashed_password(
     username: str,
-    service_url: str,
+    client: httpx.AsyncClient,
+    *,
+    use_msgpack: bool = False,
 ) -> UserAuthData:
-    response = None
-
-    response = requests.get(
-        f"{service_url}/auth/{username}",
-        timeout=5,
+    response = await _call_user_service(
+        client,
+        "GET",
+        f"/auth/{username}/",
+        headers={"Accept": MSGPACK if use_msgpack else JSON},
     )
     response.raise_for_status()
-    data = response.json()
-    return UserAuthData(**data)
+    # JSON bodies are validated straight from their bytes, without an intermediate
+    # dict.
+    return decode(
+        response.content,
+        response.headers.get("Content-Type"),
+        UserAuthData,
+    )
 
 
 def verify_password(password: str, hashed_password: str) -> None:
-    ph.verify(hashed_password, password)
+    get_password_hasher().verify(hashed_password, password)
+
 
+async def _rehash_password(
+    user: UserAuthData,
+    unhashed_password: str,
+    client: httpx.AsyncClient,
+    *,
+    use_msgpack: bool = False,
+) -> None:
+    """Replace the user's password hash with one made with the current parameters.
 
-def get_authenticated_uuid(
+    This runs once the login has been answered, so it is bound by the client's
+    timeouts rather than the login's deadline. If it fails, the user keeps their old
+    hash until they next log in.
+    """
+    try:
+        with no_deadline():
+            hashed_password = await get_hashing_pool().run(
+                get_password_hasher().hash,
+                unhashed_password,
+            )
+            request = UpdatePasswordHashRequest(
+                hashed_password=hashed_password,
+                previous_hashed_password=user.hashed_password,
+            )
+            response = await _call_user_service(
+                client,
+                "PUT",
+                f"/users/{user.uuid}/password",
+                **_body(request, use_msgpack=use_msgpack),
+            )
+            response.raise_for_status()
+    except Exception:
+        logging.exception("Could not rehash password of user %s", user.uuid)
+    else:
+        logging.info("Rehashed password of user %s", user.uuid)
+
+
+async def get_authenticated_uuid(
     username: str,
     unhashed_password: str,
-    service_url: str,
+    client: httpx.AsyncClient,
+    background_tasks: BackgroundTasks,
+    *,
+    use_msgpack: bool = False,
 ) -> str:
-    user = retrieve_hashed_password(
+    user = await retrieve_hashed_password(
         username,
-        service_url,
+        client,
+        use_msgpack=use_msgpack,
     )
-    verify_password(unhashed_password, user.hashed_password)
+    # Hashes take tens of milliseconds of CPU, so they run on a pool of their own
+    # rather than on the event loop or the threads shared with other routes.
+    await get_hashing_pool().run(
+        verify_password,
+        unhashed_password,
+        user.hashed_password,
+    )
+    # The password is only ever at hand when the user logs in, so that is when hashes
+    # made with other parameters, such as those before a calibration, are replaced,
+    # after the token has been sent.
+    if get_password_hasher().check_needs_rehash(user.hashed_password):
+        background_tasks.add_task(
+            _rehash_password,
+            user,
+            unhashed_password,
+            client,
+            use_msgpack=use_msgpack,
+        )
     return user.uuid
 
 
-def create_user(
+async def create_user(
     username: str,
     unhashed_password: str,
-    service_url: str,
+    client: httpx.AsyncClient,
+    *,
+    use_msgpack: bool = False,
 ) -> None:
-    hashed_password = ph.hash(unhashed_password)
+    hashed_password = await get_hashing_pool().run(
+        get_password_hasher().hash,
+        unhashed_password,
+    )
 
     request = CreateUserRequest(username=username, hashed_password=hashed_password)
-    response = requests.post(
-        f"{service_url}/users",
-        json=request.model_dump(),
-        timeout=5,
+    response = await _call_user_service(
+        client,
+        "POST",
+        "/users",
+        **_body(request, use_msgpack=use_msgpack),
     )
     response.raise_for_status()
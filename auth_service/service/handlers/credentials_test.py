@@ -3,60 +3,75 @@
 import uuid
 from http import HTTPStatus
 
+import httpx
 import pytest
-import responses
+from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
-from requests.exceptions import HTTPError
+from common.api.deadlines import TIMEOUT_HEADER, deadline
+from common.api.encoding import MSGPACK, decode_msgpack, encode_msgpack
+from common.api.exceptions.general import DeadlineExceededError
+from common.api.schemas.user import (
+    CreateUserRequest,
+    UpdatePasswordHashRequest,
+    UserAuthData,
+)
+from conftest import FakeUserService
+from fastapi import BackgroundTasks
+from httpx import HTTPStatusError
 
+from service.config import ServiceConfig
+from service.handlers import credentials
 from service.handlers.credentials import (
     create_user,
     get_authenticated_uuid,
-    ph,
     retrieve_hashed_password,
     verify_password,
 )
+from service.handlers.hashing import get_password_hasher
+from service.handlers.user_service import create_user_service_client
 
 
 def mock_user_identity_endpoint(
+    user_service: FakeUserService,
     username: str,
     hashed_password: str | None = None,
 ) -> None:
-    test_url = f"http://localhost:8001/auth/{username}"
     if hashed_password is None:
-        json_response = {"detail": "Not Found"}
-        status = HTTPStatus.NOT_FOUND
+        response = httpx.Response(HTTPStatus.NOT_FOUND, json={"detail": "Not Found"})
     else:
-        json_response = {"hashed_password": hashed_password, "uuid": str(uuid.uuid4())}
-        status = HTTPStatus.OK
+        response = httpx.Response(
+            HTTPStatus.OK,
+            json={"hashed_password": hashed_password, "uuid": str(uuid.uuid4())},
+        )
 
-    responses.add(responses.GET, test_url, json=json_response, status=status)
+    user_service.add("GET", f"/auth/{username}/", response)
 
 
 def mock_user_creation_endpoint(
-    _: str,
-    __: str,
-    conflict: bool = False,  # noqa: FBT001, FBT002
+    user_service: FakeUserService,
+    *,
+    conflict: bool = False,
 ) -> None:
-    test_url = "http://localhost:8001/users"
     if conflict:
-        json_response = {"detail": "User already exists"}
-        status = HTTPStatus.CONFLICT
+        response = httpx.Response(
+            HTTPStatus.CONFLICT,
+            json={"detail": "User already exists"},
+        )
     else:
-        json_response = {"uuid": str(uuid.uuid4())}
-        status = HTTPStatus.CREATED
-
-    responses.add(responses.POST, test_url, json=json_response, status=status)
+        response = httpx.Response(HTTPStatus.CREATED, json={"uuid": str(uuid.uuid4())})
 
+    user_service.add("POST", "/users", response)
 
-@responses.activate
-def test_hashed_password_is_recieved_for_valid_user() -> None:
-    mock_user_identity_endpoint("test_username", "hashed_password")
 
-    service_url = "http://localhost:8001"
+@pytest.mark.asyncio
+async def test_hashed_password_is_recieved_for_valid_user(
+    user_service: FakeUserService,
+) -> None:
+    mock_user_identity_endpoint(user_service, "test_username", "hashed_password")
 
-    data = retrieve_hashed_password("test_username", service_url)
+    data = await retrieve_hashed_password("test_username", user_service.client)
 
-    assert len(responses.calls) == 1
+    assert len(user_service.requests) == 1
     assert data.hashed_password == "hashed_password"
 
 
@@ -67,81 +82,196 @@ def test_hashed_password_is_recieved_for_valid_user() -> None:
         ("", HTTPStatus.BAD_REQUEST),
     ],
 )
-@responses.activate
-def test_hashed_password_retrieval_fails_for_invalid_user(
+@pytest.mark.asyncio
+async def test_hashed_password_retrieval_fails_for_invalid_user(
+    user_service: FakeUserService,
     username: str,
     expected_status: HTTPStatus,
 ) -> None:
-    mock_user_identity_endpoint(username)
-
-    service_url: str = "http://localhost:8001"
+    mock_user_identity_endpoint(user_service, username)
 
-    with pytest.raises(HTTPError) as excinfo:
-        retrieve_hashed_password(username, service_url)
+    with pytest.raises(HTTPStatusError) as excinfo:
+        await retrieve_hashed_password(username, user_service.client)
         assert excinfo.value.response.status_code == expected_status
 
 
 def test_correct_password_verifies_successfully() -> None:
-    hashed_password = ph.hash("test_password")
+    hashed_password = get_password_hasher().hash("test_password")
     verify_password("test_password", hashed_password)
 
 
 def test_incorrect_password_fails_verification() -> None:
-    hashed_password = ph.hash("test_password")
+    hashed_password = get_password_hasher().hash("test_password")
     with pytest.raises(VerifyMismatchError):
         verify_password("wrong_password", hashed_password)
 
 
-@responses.activate
-def test_valid_user_is_successfully_authenticated() -> None:
-    hashed_password = ph.hash("test_password")
-    mock_user_identity_endpoint("test_username", hashed_password)
+@pytest.mark.asyncio
+async def test_valid_user_is_successfully_authenticated(
+    user_service: FakeUserService,
+) -> None:
+    hashed_password = get_password_hasher().hash("test_password")
+    mock_user_identity_endpoint(user_service, "test_username", hashed_password)
 
     username = "test_username"
     unhashed_password = "test_password"
-    service_url = "http://localhost:8001"
 
-    uuid = get_authenticated_uuid(username, unhashed_password, service_url)
+    uuid = await get_authenticated_uuid(
+        username,
+        unhashed_password,
+        user_service.client,
+        BackgroundTasks(),
+    )
 
     assert uuid is not None
 
 
-@responses.activate
-def test_authentication_fails_for_invalid_user() -> None:
-    hashed_password = ph.hash("test_password")
-    mock_user_identity_endpoint("test_username", hashed_password)
+@pytest.mark.asyncio
+async def test_authentication_fails_for_invalid_user(
+    user_service: FakeUserService,
+) -> None:
+    hashed_password = get_password_hasher().hash("test_password")
+    mock_user_identity_endpoint(user_service, "test_username", hashed_password)
 
     username = "test_username"
     wrong_unhashed_password = "wrong_password"
-    service_url = "http://localhost:8001"
 
     with pytest.raises(VerifyMismatchError):
-        get_authenticated_uuid(username, wrong_unhashed_password, service_url)
+        await get_authenticated_uuid(
+            username,
+            wrong_unhashed_password,
+            user_service.client,
+            BackgroundTasks(),
+        )
+
+
+def mock_rehash_endpoints(
+    user_service: FakeUserService,
+    hashed_password: str,
+    rehash_response: httpx.Response,
+) -> str:
+    user_uuid = str(uuid.uuid4())
+    user_service.add(
+        "GET",
+        "/auth/test_username/",
+        httpx.Response(
+            HTTPStatus.OK,
+            json={"hashed_password": hashed_password, "uuid": user_uuid},
+        ),
+    )
+    user_service.add("PUT", f"/users/{user_uuid}/password", rehash_response)
+    return user_uuid
 
 
-@responses.activate
-def test_user_is_successfully_created() -> None:
-    mock_user_creation_endpoint("test_username", ph.hash("test_password"))
+@pytest.mark.asyncio
+async def test_outdated_hashes_are_replaced_on_login(
+    user_service: FakeUserService,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    outdated = PasswordHasher(time_cost=1, memory_cost=8, parallelism=1)
+    current = PasswordHasher(time_cost=2, memory_cost=16, parallelism=1)
+    monkeypatch.setattr(credentials, "get_password_hasher", lambda: current)
+    hashed_password = outdated.hash("test_password")
+    user_uuid = mock_rehash_endpoints(
+        user_service,
+        hashed_password,
+        httpx.Response(HTTPStatus.NO_CONTENT),
+    )
 
-    service_url = "http://localhost:8001"
+    background_tasks = BackgroundTasks()
 
-    create_user("test_username", "test_password", service_url)
+    authenticated = await get_authenticated_uuid(
+        "test_username",
+        "test_password",
+        user_service.client,
+        background_tasks,
+    )
 
-    assert len(responses.calls) == 1
+    # The hash is only replaced once the login has been answered.
+    assert len(user_service.requests) == 1
+    with deadline(0):
+        await background_tasks()
+    _, rehash = user_service.requests
+    update = UpdatePasswordHashRequest.model_validate_json(rehash.content)
+    assert authenticated == user_uuid
+    assert TIMEOUT_HEADER not in rehash.headers
+    assert update.previous_hashed_password == hashed_password
+    assert current.verify(update.hashed_password, "test_password")
+    assert not current.check_needs_rehash(update.hashed_password)
+
+
+@pytest.mark.asyncio
+async def test_current_hashes_are_not_replaced_on_login(
+    user_service: FakeUserService,
+) -> None:
+    hashed_password = get_password_hasher().hash("test_password")
+    mock_user_identity_endpoint(user_service, "test_username", hashed_password)
 
+    background_tasks = BackgroundTasks()
 
-@responses.activate
-def test_user_creation_fails_when_user_already_exists() -> None:
-    mock_user_creation_endpoint(
+    await get_authenticated_uuid(
         "test_username",
-        ph.hash("test_password"),
-        conflict=True,
+        "test_password",
+        user_service.client,
+        background_tasks,
     )
 
-    service_url = "http://localhost:8001"
+    assert not background_tasks.tasks
+    assert len(user_service.requests) == 1
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        httpx.Response(HTTPStatus.CONFLICT),
+        httpx.ConnectError("Connection refused"),
+    ],
+)
+@pytest.mark.asyncio
+async def test_hashes_that_cannot_be_replaced_are_logged(
+    user_service: FakeUserService,
+    response: httpx.Response | Exception,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    outdated = PasswordHasher(time_cost=1, memory_cost=8, parallelism=1)
+    hashed_password = outdated.hash("test_password")
+    user_uuid = mock_rehash_endpoints(user_service, hashed_password, response)
+    background_tasks = BackgroundTasks()
+
+    authenticated = await get_authenticated_uuid(
+        "test_username",
+        "test_password",
+        user_service.client,
+        background_tasks,
+    )
+    await background_tasks()
+
+    assert authenticated == user_uuid
+    assert len(user_service.requests) == 2
+    assert f"Could not rehash password of user {user_uuid}" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_user_is_successfully_created(user_service: FakeUserService) -> None:
+    mock_user_creation_endpoint(user_service)
+
+    await create_user("test_username", "test_password", user_service.client)
+
+    [request] = user_service.requests
+    created = CreateUserRequest.model_validate_json(request.content)
+    assert request.headers["Content-Type"] == "application/json"
+    assert created.username == "test_username"
+    verify_password("test_password", created.hashed_password)
+
 
-    with pytest.raises(HTTPError) as excinfo:
-        create_user("test_username", "test_password", service_url)
+@pytest.mark.asyncio
+async def test_user_creation_fails_when_user_already_exists(
+    user_service: FakeUserService,
+) -> None:
+    mock_user_creation_endpoint(user_service, conflict=True)
+
+    with pytest.raises(HTTPStatusError) as excinfo:
+        await create_user("test_username", "test_password", user_service.client)
 
     assert excinfo.value.response.status_code == HTTPStatus.CONFLICT
 
@@ -154,21 +284,110 @@ def test_user_creation_fails_when_user_already_exists() -> None:
         ("", "", HTTPStatus.BAD_REQUEST),
     ],
 )
-@responses.activate
-def test_user_creation_fails_for_invalid_inputs(
+@pytest.mark.asyncio
+async def test_user_creation_fails_for_invalid_inputs(
+    user_service: FakeUserService,
     username: str,
     password: str,
     expected_status: HTTPStatus,
 ) -> None:
-    service_url: str = "http://localhost:8001"
+    user_service.add("POST", "/users", httpx.Response(expected_status))
+
+    with pytest.raises(HTTPStatusError) as excinfo:
+        await create_user(username, password, user_service.client)
+
+    assert excinfo.value.response.status_code == expected_status
+
 
-    responses.add(
-        responses.POST,
-        f"{service_url}/users",
-        status=expected_status,
+@pytest.mark.asyncio
+async def test_user_service_can_be_called_with_msgpack(
+    user_service: FakeUserService,
+) -> None:
+    auth_data = UserAuthData(uuid=str(uuid.uuid4()), hashed_password="hashed")
+    user_service.add(
+        "GET",
+        "/auth/test_username/",
+        httpx.Response(
+            HTTPStatus.OK,
+            content=encode_msgpack(auth_data),
+            headers={"Content-Type": MSGPACK},
+        ),
     )
+    user_service.add("POST", "/users", httpx.Response(HTTPStatus.CREATED))
 
-    with pytest.raises(HTTPError) as excinfo:
-        create_user(username, password, service_url)
+    retrieved = await retrieve_hashed_password(
+        "test_username",
+        user_service.client,
+        use_msgpack=True,
+    )
+    await create_user(
+        "test_username",
+        "test_password",
+        user_service.client,
+        use_msgpack=True,
+    )
 
-    assert excinfo.value.response.status_code == expected_status
+    assert retrieved == auth_data
+    lookup, creation = user_service.requests
+    assert lookup.headers["Accept"] == MSGPACK
+    assert creation.headers["Content-Type"] == MSGPACK
+    created = decode_msgpack(creation.content, CreateUserRequest)
+    assert created.username == "test_username"
+    verify_password("test_password", created.hashed_password)
+
+
+@pytest.mark.asyncio
+async def test_user_service_is_told_the_time_left_until_the_deadline(
+    user_service: FakeUserService,
+) -> None:
+    mock_user_identity_endpoint(user_service, "test_username", "hashed_password")
+    mock_user_creation_endpoint(user_service)
+
+    with deadline(2):
+        await retrieve_hashed_password("test_username", user_service.client)
+        await create_user("test_username", "test_password", user_service.client)
+
+    for request in user_service.requests:
+        assert 0 < int(request.headers[TIMEOUT_HEADER]) <= 2000
+        assert 0 < request.extensions["timeout"]["read"] <= 2
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        httpx.ReadTimeout("Timed out"),
+        httpx.Response(HTTPStatus.GATEWAY_TIMEOUT),
+    ],
+)
+@pytest.mark.asyncio
+async def test_user_service_timeouts_exceed_the_deadline(
+    user_service: FakeUserService,
+    response: httpx.Response | Exception,
+) -> None:
+    user_service.add("GET", "/auth/test_username/", response)
+
+    with pytest.raises(DeadlineExceededError):
+        await retrieve_hashed_password("test_username", user_service.client)
+
+
+@pytest.mark.asyncio
+async def test_user_service_client_pools_connections_as_configured() -> None:
+    config = ServiceConfig(
+        user_service_url="http://users:8001",
+        user_service_max_connections=7,
+        user_service_max_keepalive_connections=3,
+        user_service_keepalive_expiry=11,
+        user_service_timeout=4,
+        user_service_connect_timeout=0.5,
+    )
+
+    client = create_user_service_client(config)
+    try:
+        pool = client._transport._pool
+        assert client.base_url == "http://users:8001"
+        assert pool._max_connections == 7
+        assert pool._max_keepalive_connections == 3
+        assert pool._keepalive_expiry == 11
+        assert client.timeout == httpx.Timeout(4, connect=0.5)
+    finally:
+        await client.aclose()
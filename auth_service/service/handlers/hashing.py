@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from argon2 import PasswordHasher
+from common.api import deadlines
+from common.api.exceptions.general import ServiceOverloadedError
+from common.metrics import Histogram
+
+from service.config import Argon2Config, get_argon2_config
+
+ResultT = TypeVar("ResultT")
+
+
+def create_password_hasher(config: Argon2Config) -> PasswordHasher:
+    return PasswordHasher(
+        time_cost=config.argon2_time_cost,
+        memory_cost=config.argon2_memory_cost,
+        parallelism=config.argon2_parallelism,
+    )
+
+
+def default_workers(
+    hasher: PasswordHasher,
+    memory_budget_mib: int,
+    cpus: int | None = None,
+) -> int:
+    """Return how many hashes can run at once without oversubscribing the host.
+
+    Each hash keeps `hasher.parallelism` threads busy and holds `hasher.memory_cost`
+    KiB until it is done, so the workers are bounded by both the CPUs and the memory
+    budget. There is always at least one.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    by_cpu = cpus // hasher.parallelism
+    by_memory = memory_budget_mib * 1024 // hasher.memory_cost
+    return max(1, min(by_cpu, by_memory))
+
+
+class HashingPool:
+    """Runs password hashes on dedicated threads, with a bounded queue in front.
+
+    Hashes beyond the workers wait in the queue, and once that is full any more are
+    refused straight away with `ServiceOverloadedError`, rather than piling up
+    behind the others until they time out.
+    """
+
+    def __init__(self, workers: int, max_queue: int, retry_after: int = 1) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.admitted = 0
+        self.running = 0
+        self.peak_queued = 0
+        self.rejected = 0
+        self.queue_wait = Histogram()
+        self.hash_time = Histogram()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="argon2",
+        )
+
+    @property
+    def queued(self) -> int:
+        return self.admitted - self.running
+
+    async def run(
+        self,
+        fn: Callable[..., ResultT],
+        *args: Any,  # noqa: ANN401
+    ) -> ResultT:
+        """Run `fn(*args)` on one of the pool's workers, and return its result.
+
+        Raises:
+            ServiceOverloadedError: If the queue is full.
+            DeadlineExceededError: If the request's deadline passed while it waited.
+        """
+        with self._lock:
+            if self.admitted >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise ServiceOverloadedError(retry_after=self.retry_after)
+            self.admitted += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+        # The work runs in a copy of the request's context, so that it can tell
+        # whether the request's deadline has passed.
+        future = self._executor.submit(
+            contextvars.copy_context().run,
+            self._work,
+            time.perf_counter(),
+            fn,
+            *args,
+        )
+        # A hash is only done with once its future is, which includes it being
+        # cancelled before it started.
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _work(
+        self,
+        enqueued: float,
+        fn: Callable[..., ResultT],
+        *args: Any,  # noqa: ANN401
+    ) -> ResultT:
+        started = time.perf_counter()
+        with self._lock:
+            self.running += 1
+            self.queue_wait.observe(started - enqueued)
+        try:
+            # Nobody is waiting for the hash of a request that ran out of time in the
+            # queue.
+            deadlines.check()
+            result = fn(*args)
+            with self._lock:
+                self.hash_time.observe(time.perf_counter() - started)
+            return result
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _release(self, _: Future) -> None:
+        with self._lock:
+            self.admitted -= 1
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "queued": self.queued,
+                "peak_queued": self.peak_queued,
+                "rejected": self.rejected,
+                "queue_wait_seconds": self.queue_wait.snapshot(),
+                "hash_seconds": self.hash_time.snapshot(),
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_hashing_pool(config: Argon2Config) -> HashingPool:
+    workers = config.argon2_workers or default_workers(
+        create_password_hasher(config),
+        config.argon2_memory_budget_mib,
+    )
+    logging.info(
+        "Hashing passwords on %s workers, with up to %s waiting",
+        workers,
+        config.argon2_max_queue,
+    )
+    return HashingPool(workers, config.argon2_max_queue, config.argon2_retry_after)
+
+
+_hasher: PasswordHasher | None = None
+_pool: HashingPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Return the hasher with the configured parameters, creating it on first use."""
+    global _hasher  # noqa: PLW0603
+
+    if _hasher is None:
+        with _pool_lock:
+            if _hasher is None:
+                _hasher = create_password_hasher(get_argon2_config())
+    return _hasher
+
+
+def get_hashing_pool() -> HashingPool:
+    """Return the process-wide hashing pool, creating it on first use."""
+    global _pool  # noqa: PLW0603
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = create_hashing_pool(get_argon2_config())
+    return _pool
+
+
+def close_hashing_pool() -> None:
+    """Stop the shared pool's workers at shutdown."""
+    global _pool
+
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+
+import pytest
+from argon2 import PasswordHasher
+from common.api.deadlines import deadline
+from common.api.exceptions.general import DeadlineExceededError, ServiceOverloadedError
+
+from service.config import Argon2Config
+from service.handlers.hashing import (
+    HashingPool,
+    create_password_hasher,
+    default_workers,
+)
+
+
+def test_workers_are_bounded_by_cpus_and_memory() -> None:
+    hasher = PasswordHasher(memory_cost=65536, parallelism=2)
+
+    assert default_workers(hasher, memory_budget_mib=1024, cpus=8) == 4  # noqa: PLR2004
+    assert default_workers(hasher, memory_budget_mib=128, cpus=8) == 2  # noqa: PLR2004
+    assert default_workers(hasher, memory_budget_mib=32, cpus=1) == 1
+
+
+def test_hashes_are_made_with_the_configured_parameters() -> None:
+    config = Argon2Config(
+        argon2_time_cost=2,
+        argon2_memory_cost=1024,
+        argon2_parallelism=1,
+    )
+    hasher = create_password_hasher(config)
+
+    hashed = hasher.hash("password")
+
+    assert hashed.startswith("$argon2id$v=19$m=1024,t=2,p=1$")
+    assert create_password_hasher(Argon2Config()).check_needs_rehash(hashed)
+
+
+@pytest.mark.asyncio
+async def test_hashes_run_on_the_pool_and_are_timed() -> None:
+    pool = HashingPool(workers=1, max_queue=0)
+    try:
+        thread = await pool.run(lambda: threading.current_thread().name)
+    finally:
+        pool.shutdown()
+
+    snapshot = pool.snapshot()
+    assert thread.startswith("argon2")
+    assert snapshot["hash_seconds"]["count"] == 1
+    assert snapshot["queued"] == snapshot["running"] == 0
+
+
+@pytest.mark.asyncio
+async def test_hashes_beyond_the_queue_are_refused() -> None:
+    pool = HashingPool(workers=1, max_queue=1, retry_after=3)
+    release = threading.Event()
+    try:
+        running = asyncio.ensure_future(pool.run(release.wait))
+        queued = asyncio.ensure_future(pool.run(lambda: "queued"))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(ServiceOverloadedError) as excinfo:
+            await pool.run(lambda: "refused")
+        snapshot = pool.snapshot()
+        release.set()
+        assert await queued == "queued"
+        await running
+    finally:
+        release.set()
+        pool.shutdown()
+
+    assert excinfo.value.headers == {"Retry-After": "3"}
+    assert snapshot["running"] == snapshot["queued"] == 1
+    assert snapshot["rejected"] == 1
+    assert pool.snapshot()["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_hashes_whose_deadline_passed_in_the_queue_are_skipped() -> None:
+    pool = HashingPool(workers=1, max_queue=1)
+    release = threading.Event()
+    hashed = []
+    try:
+        running = asyncio.ensure_future(pool.run(release.wait))
+        with deadline(0.05):
+            queued = asyncio.ensure_future(pool.run(hashed.append, "late"))
+        await asyncio.sleep(0.1)
+        release.set()
+
+        with pytest.raises(DeadlineExceededError):
+            await queued
+        await running
+    finally:
+        release.set()
+        pool.shutdown()
+
+    assert hashed == []
+
+
+@pytest.mark.asyncio
+async def test_cancelled_hashes_give_up_their_place_in_the_queue() -> None:
+    pool = HashingPool(workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        running = asyncio.ensure_future(pool.run(release.wait))
+        queued = asyncio.ensure_future(pool.run(lambda: "cancelled"))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        await asyncio.sleep(0.05)
+
+        replacement = asyncio.ensure_future(pool.run(lambda: "replacement"))
+        release.set()
+        assert await replacement == "replacement"
+        await running
+    finally:
+        release.set()
+        pool.shutdown()
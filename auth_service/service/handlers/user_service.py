@@ -0,0 +1,48 @@
+import threading
+
+import httpx
+
+from service.config import ServiceConfig, get_service_config
+
+_client: httpx.AsyncClient | None = None
+_client_lock = threading.Lock()
+
+
+def create_user_service_client(config: ServiceConfig) -> httpx.AsyncClient:
+    """Create a client for the user service, which keeps its connections alive.
+
+    All of the client's calls go to the one host, so its limits on the pool are the
+    limits on connections to the user service.
+    """
+    return httpx.AsyncClient(
+        base_url=config.user_service_url,
+        limits=httpx.Limits(
+            max_connections=config.user_service_max_connections,
+            max_keepalive_connections=config.user_service_max_keepalive_connections,
+            keepalive_expiry=config.user_service_keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(
+            config.user_service_timeout,
+            connect=config.user_service_connect_timeout,
+        ),
+    )
+
+
+def get_user_service_client() -> httpx.AsyncClient:
+    """Return the process-wide client for the user service, creating it on first use."""
+    global _client  # noqa: PLW0603
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_user_service_client(get_service_config())
+    return _client
+
+
+async def close_user_service_client() -> None:
+    """Close the shared client and its pooled connections at shutdown."""
+    global _client
+
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
@@ -1,23 +1,54 @@
 import logging
 import os
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
 import uvicorn
+from common.api.deadlines import DeadlineMiddleware
+from common.api.exceptions.handlers import handle_managed_exception
+from common.api.exceptions.managed import ManagedException
 from common.service_logging import configure_logging, LOGGING_CONFIG
 from dotenv import load_dotenv
 from fastapi import FastAPI
 
+from service.api.admin import router as admin_router
 from service.api.router import router
+from service.config import get_service_config
+from service.handlers.hashing import close_hashing_pool, get_hashing_pool
+from service.handlers.user_service import (
+    close_user_service_client,
+    get_user_service_client,
+)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    # Logins and registrations share the client's pool of connections to the user
+    # service, instead of connecting anew for every call, and hash passwords on a
+    # pool of workers of their own.
+    get_user_service_client()
+    get_hashing_pool()
+    yield
+    close_hashing_pool()
+    await close_user_service_client()
 
 
 def main() -> None:
     load_dotenv()
 
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
+    app.add_exception_handler(ManagedException, handle_managed_exception)
+    # Every request has a deadline, which calls to the user service are held to.
+    app.add_middleware(
+        DeadlineMiddleware,
+        timeout=get_service_config().request_timeout,
+    )
     host = os.getenv("HOST_IP")
     port = int(os.getenv("HOST_PORT"))
 
     configure_logging()
     app.include_router(router)
+    app.include_router(admin_router)
 
     logging.info("Starting service at http://%s:%s", host, port)
 
@@ -0,0 +1,155 @@
+"""Request deadlines, passed along from service to service.
+
+A caller sends the time it is still prepared to wait for a response in the
+`X-Request-Timeout` header, in milliseconds. Being relative, it does not depend on
+the services' clocks agreeing. `DeadlineMiddleware` turns the header into a deadline
+for the request, which work done on its behalf (such as calls to other services, or
+database statements) checks with `remaining`, and passes on with `timeout_headers`.
+
+**Serving requests with deadlines:**
+```python
+app = FastAPI()
+app.add_middleware(DeadlineMiddleware, timeout=5)
+```
+
+**Calling another service within the deadline:**
+```python
+response = requests.get(
+    url,
+    headers=timeout_headers(),
+    timeout=outgoing_timeout(default=5),
+)
+```
+"""
+import contextlib
+import time
+from collections.abc import Iterator
+from contextvars import ContextVar
+from http import HTTPStatus
+
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from common.api.exceptions.general import DeadlineExceededError
+
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+# The `time.monotonic` time by which the current request must be answered.
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+
+def parse_timeout(value: str | None) -> float | None:
+    """Return the seconds given by a timeout header, or `None` if it is not valid."""
+    if value is None:
+        return None
+    try:
+        milliseconds = int(value)
+    except ValueError:
+        return None
+    return milliseconds / 1000
+
+
+def remaining() -> float | None:
+    """Return the seconds left until the current deadline, or `None` if there is none.
+
+    The result is negative once the deadline has passed.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check() -> None:
+    """Raise `DeadlineExceededError` if the current deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceededError
+
+
+def outgoing_timeout(default: float) -> float:
+    """Return how long a call made now may take, to finish within the deadline.
+
+    Raises:
+        DeadlineExceededError: If the deadline has already passed.
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceededError
+    return left
+
+
+def timeout_headers() -> dict[str, str]:
+    """Return the headers that pass the current deadline on to another service."""
+    left = remaining()
+    if left is None:
+        return {}
+    return {TIMEOUT_HEADER: str(max(int(left * 1000), 0))}
+
+
+@contextlib.contextmanager
+def deadline(timeout: float | None) -> Iterator[None]:
+    """Run the enclosed code with a deadline `timeout` seconds from now.
+
+    An earlier deadline already in place is kept, so that nested work cannot extend
+    it. A `timeout` of `None` leaves the current deadline as it is.
+    """
+    current = _deadline.get()
+    if timeout is not None:
+        new = time.monotonic() + timeout
+        if current is None or new < current:
+            current = new
+    token = _deadline.set(current)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextlib.contextmanager
+def no_deadline() -> Iterator[None]:
+    """Run the enclosed code without a deadline, for work shared by several requests."""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class DeadlineMiddleware:
+    """Give each request the deadline its caller set, and reject those already past.
+
+    Requests without a timeout header get `timeout` seconds, if it is set, and none
+    get longer.
+    """
+
+    def __init__(self, app: ASGIApp, timeout: float | None = None) -> None:
+        self.app = app
+        self.timeout = timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timeout = None
+        for name, value in scope["headers"]:
+            if name.decode("latin-1").lower() == TIMEOUT_HEADER.lower():
+                timeout = parse_timeout(value.decode("latin-1"))
+                break
+        if self.timeout is not None and (timeout is None or timeout > self.timeout):
+            timeout = self.timeout
+
+        if timeout is not None and timeout <= 0:
+            # The caller has given up already, so no work is done for it.
+            response = JSONResponse(
+                status_code=HTTPStatus.GATEWAY_TIMEOUT,
+                content={"detail": DeadlineExceededError.detail},
+            )
+            await response(scope, receive, send)
+            return
+
+        with deadline(timeout):
+            await self.app(scope, receive, send)
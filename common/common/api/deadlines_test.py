@@ -0,0 +1,109 @@
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from common.api import deadlines
+from common.api.deadlines import (
+    TIMEOUT_HEADER,
+    DeadlineMiddleware,
+    check,
+    deadline,
+    no_deadline,
+    outgoing_timeout,
+    parse_timeout,
+    remaining,
+    timeout_headers,
+)
+from common.api.exceptions.general import DeadlineExceededError
+
+
+@pytest.mark.parametrize(
+    ("value", "seconds"),
+    [(None, None), ("1500", 1.5), ("0", 0), ("-20", -0.02), ("soon", None)],
+)
+def test_timeout_headers_are_parsed_as_milliseconds(
+    value: str | None,
+    seconds: float | None,
+) -> None:
+    assert parse_timeout(value) == seconds
+
+
+def test_there_is_no_deadline_by_default() -> None:
+    assert remaining() is None
+    assert timeout_headers() == {}
+    assert outgoing_timeout(default=5) == 5  # noqa: PLR2004
+    check()
+
+
+def test_nested_deadlines_cannot_extend_the_outer_one() -> None:
+    with deadline(1):
+        with deadline(10):
+            assert remaining() <= 1
+            with no_deadline():
+                assert remaining() is None
+        with deadline(None):
+            assert remaining() <= 1
+        with deadline(0.5):
+            assert remaining() <= 0.5  # noqa: PLR2004
+    assert remaining() is None
+
+
+def test_deadline_is_passed_on_with_the_time_remaining() -> None:
+    with deadline(2):
+        milliseconds = int(timeout_headers()[TIMEOUT_HEADER])
+        assert 1900 < milliseconds <= 2000  # noqa: PLR2004
+        assert 1.9 < outgoing_timeout(default=5) <= 2  # noqa: PLR2004
+
+
+def test_passed_deadline_raises(monkeypatch: pytest.MonkeyPatch) -> None:
+    with deadline(1):
+        now = time.monotonic()
+        monkeypatch.setattr(deadlines.time, "monotonic", lambda: now + 2)
+        with pytest.raises(DeadlineExceededError):
+            check()
+        with pytest.raises(DeadlineExceededError):
+            outgoing_timeout(default=5)
+        assert timeout_headers() == {TIMEOUT_HEADER: "0"}
+
+
+def _client(timeout: float | None = None) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(DeadlineMiddleware, timeout=timeout)
+
+    @app.get("/remaining")
+    def get_remaining() -> float | None:
+        return remaining()
+
+    @app.get("/remaining-async")
+    async def get_remaining_async() -> float | None:
+        return remaining()
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("path", ["/remaining", "/remaining-async"])
+def test_middleware_sets_the_deadline_from_the_header(path: str) -> None:
+    client = _client()
+
+    assert client.get(path).json() is None
+    left = client.get(path, headers={TIMEOUT_HEADER: "300"}).json()
+    assert 0 < left <= 0.3  # noqa: PLR2004
+
+
+def test_middleware_caps_deadlines_at_its_timeout() -> None:
+    client = _client(timeout=1)
+
+    assert 0 < client.get("/remaining").json() <= 1
+    assert client.get("/remaining", headers={TIMEOUT_HEADER: "60000"}).json() <= 1
+    left = client.get("/remaining", headers={TIMEOUT_HEADER: "200"}).json()
+    assert left <= 0.2  # noqa: PLR2004
+
+
+@pytest.mark.parametrize("timeout", ["0", "-5"])
+def test_middleware_rejects_requests_whose_deadline_has_passed(timeout: str) -> None:
+    response = _client().get("/remaining", headers={TIMEOUT_HEADER: timeout})
+
+    assert response.status_code == DeadlineExceededError.status_code
+    assert response.json() == {"detail": DeadlineExceededError.detail}
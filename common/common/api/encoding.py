@@ -0,0 +1,182 @@
+"""MessagePack encoding of the API schemas, negotiated alongside JSON.
+
+Internal routes accept `Content-Type: application/msgpack` request bodies and answer
+`Accept: application/msgpack` with MessagePack, which is smaller and cheaper to encode
+and decode than JSON. JSON stays the default for everything else.
+
+**Serving both encodings from a router:**
+```python
+router = APIRouter(
+    route_class=NegotiatedRoute,
+    default_response_class=NegotiatedResponse,
+)
+```
+
+**Calling such a route:**
+```python
+response = requests.post(
+    url,
+    data=encode_msgpack(request),
+    headers={"Content-Type": MSGPACK, "Accept": MSGPACK},
+)
+user = decode(response.content, response.headers["Content-Type"], UserAuthData)
+```
+"""
+import threading
+from collections.abc import Callable, Coroutine
+from contextvars import ContextVar
+from email.message import Message
+from typing import Any, TypeVar
+
+import msgpack
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+# `msgpack.packb` allocates a new 256 KiB buffer on every call, so each thread reuses
+# a packer of its own instead.
+_packers = threading.local()
+
+
+def _packb(content: Any) -> bytes:  # noqa: ANN401
+    packer = getattr(_packers, "packer", None)
+    if packer is None:
+        packer = _packers.packer = msgpack.Packer()
+    return packer.pack(content)
+
+
+def encode_msgpack(model: BaseModel) -> bytes:
+    """Encode a model as MessagePack, with the same values as its JSON form."""
+    return _packb(model.model_dump(mode="json"))
+
+
+def decode_msgpack(data: bytes, model: type[ModelT]) -> ModelT:
+    return model.model_validate(msgpack.unpackb(data))
+
+
+def is_msgpack(content_type: str | None) -> bool:
+    if not content_type:
+        return False
+    message = Message()
+    message["content-type"] = content_type
+    return message.get_content_type() == MSGPACK
+
+
+def decode(data: bytes, content_type: str | None, model: type[ModelT]) -> ModelT:
+    """Decode a body of either encoding, according to its content type."""
+    if is_msgpack(content_type):
+        return decode_msgpack(data, model)
+    return model.model_validate_json(data)
+
+
+def _quality(accept: str, media_type: str) -> float:
+    """Return the quality the `Accept` header gives `media_type`, or 0 if none.
+
+    The most specific matching range wins, as in `application/*;q=0.5, */*;q=0.1`.
+    """
+    kind = media_type.split("/")[0]
+    best, best_specificity = 0.0, -1
+    for media_range in accept.split(","):
+        name, *params = (part.strip() for part in media_range.split(";"))
+        specificity = {media_type: 2, f"{kind}/*": 1, "*/*": 0}.get(name.lower())
+        if specificity is None or specificity < best_specificity:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        best, best_specificity = quality, specificity
+    return best
+
+
+def preferred_media_type(accept: str | None) -> str:
+    """Choose the encoding of a response from the request's `Accept` header.
+
+    MessagePack is only chosen if the caller prefers it to JSON, so callers that do
+    not ask for it, or accept anything, get JSON.
+    """
+    if not accept or _quality(accept, MSGPACK) <= _quality(accept, JSON):
+        return JSON
+    return MSGPACK
+
+
+_response_media_type: ContextVar[str] = ContextVar("response_media_type", default=JSON)
+
+
+def response_media_type() -> str:
+    """Return the encoding negotiated for the response to the current request.
+
+    Representations of a resource in each encoding differ, so this must be part of
+    anything that identifies them, such as an ETag.
+    """
+    return _response_media_type.get()
+
+
+class NegotiatedResponse(JSONResponse):
+    """A response encoded as negotiated by the `NegotiatedRoute` that returned it."""
+
+    def render(self, content: Any) -> bytes:  # noqa: ANN401
+        if _response_media_type.get() == MSGPACK:
+            self.media_type = MSGPACK
+            return _packb(content)
+        return super().render(content)
+
+
+class _MsgPackRequest(Request):
+    """A request whose MessagePack body FastAPI parses as it would a JSON one.
+
+    FastAPI only reads bodies whose content type is JSON, so the request claims to
+    be JSON and decodes MessagePack in its place.
+    """
+
+    def __init__(self, request: Request) -> None:
+        scope = dict(request.scope)
+        scope["headers"] = [
+            (name, JSON.encode() if name == b"content-type" else value)
+            for name, value in request.scope["headers"]
+        ]
+        super().__init__(scope, request.receive)
+
+    async def json(self) -> Any:  # noqa: ANN401
+        if not hasattr(self, "_json"):
+            self._json = msgpack.unpackb(await self.body())
+        return self._json
+
+
+class NegotiatedRoute(APIRoute):
+    """A route that reads and writes MessagePack bodies as well as JSON ones.
+
+    The route's response class must be `NegotiatedResponse` for its responses to be
+    negotiated; responses returned directly by the endpoint are left as they are, but
+    may use `response_media_type` to follow the negotiation.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request) -> Response:
+            token = _response_media_type.set(
+                preferred_media_type(request.headers.get("accept")),
+            )
+            try:
+                if is_msgpack(request.headers.get("content-type")):
+                    request = _MsgPackRequest(request)
+                response = await handler(request)
+            finally:
+                _response_media_type.reset(token)
+            # Caches must not answer a request for one encoding with the other.
+            response.headers.append("Vary", "Accept")
+            return response
+
+        return negotiated_handler
@@ -0,0 +1,86 @@
+import msgpack
+import pytest
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from common.api.encoding import (
+    JSON,
+    MSGPACK,
+    NegotiatedResponse,
+    NegotiatedRoute,
+    decode,
+    encode_msgpack,
+    is_msgpack,
+    preferred_media_type,
+)
+from common.api.schemas.user import CreateUserRequest, UserAuthData
+
+
+@pytest.mark.parametrize(
+    ("accept", "media_type"),
+    [
+        (None, JSON),
+        ("*/*", JSON),
+        ("application/json", JSON),
+        ("application/msgpack, application/json", JSON),
+        ("application/msgpack", MSGPACK),
+        ("application/json;q=0.5, application/msgpack", MSGPACK),
+        ("application/msgpack, application/*;q=0.9", MSGPACK),
+        ("application/msgpack;q=0, */*", JSON),
+    ],
+)
+def test_json_is_chosen_unless_msgpack_is_preferred(
+    accept: str | None,
+    media_type: str,
+) -> None:
+    assert preferred_media_type(accept) == media_type
+
+
+def test_models_round_trip_through_either_encoding() -> None:
+    auth_data = UserAuthData(
+        uuid="8a3f2c4e-0c1b-4e8b-9b1e-2f7d6c5b4a39",
+        hashed_password="hash",  # noqa: S106
+    )
+
+    assert is_msgpack("application/msgpack; charset=binary")
+    assert not is_msgpack(JSON)
+    assert decode(encode_msgpack(auth_data), MSGPACK, UserAuthData) == auth_data
+    assert decode(auth_data.model_dump_json().encode(), JSON, UserAuthData) == auth_data
+
+
+@pytest.fixture
+def client(app: FastAPI) -> TestClient:
+    router = APIRouter(
+        route_class=NegotiatedRoute,
+        default_response_class=NegotiatedResponse,
+    )
+
+    @router.post("/users")
+    async def create_user(payload: CreateUserRequest) -> CreateUserRequest:
+        return payload
+
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_routes_read_and_write_the_negotiated_encoding(client: TestClient) -> None:
+    payload = CreateUserRequest(username="alice", hashed_password="hash")  # noqa: S106
+
+    as_msgpack = client.post(
+        "/users",
+        content=encode_msgpack(payload),
+        headers={"Content-Type": MSGPACK, "Accept": MSGPACK},
+    )
+    as_json = client.post("/users", json=payload.model_dump())
+
+    assert as_msgpack.headers["content-type"] == MSGPACK
+    assert as_msgpack.headers["vary"] == "Accept"
+    assert msgpack.unpackb(as_msgpack.content) == payload.model_dump()
+    assert as_json.headers["content-type"] == JSON
+    assert as_json.json() == payload.model_dump()
+
+
+def test_malformed_msgpack_bodies_are_rejected(client: TestClient) -> None:
+    response = client.post("/users", content=b"\xc1", headers={"Content-Type": MSGPACK})
+
+    assert response.status_code == 400  # noqa: PLR2004
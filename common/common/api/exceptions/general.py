@@ -17,3 +17,27 @@ class EmptyFieldError(ManagedException):
 
     status_code = HTTPStatus.BAD_REQUEST
     detail = "Required field is empty"
+
+
+class InvalidCursorError(ManagedException):
+    """Raised when a pagination cursor cannot be decoded"""
+
+    status_code = HTTPStatus.BAD_REQUEST
+    detail = "Invalid pagination cursor"
+
+
+class DeadlineExceededError(ManagedException):
+    """Raised when a request's deadline passes before it could be answered"""
+
+    status_code = HTTPStatus.GATEWAY_TIMEOUT
+    detail = "Request deadline exceeded"
+
+
+class ServiceOverloadedError(ManagedException):
+    """Raised when a request is turned away because the service is at capacity"""
+
+    status_code = HTTPStatus.SERVICE_UNAVAILABLE
+    detail = "Service overloaded, try again later"
+
+    def __init__(self, *, retry_after: int = 1) -> None:
+        super().__init__(headers={"Retry-After": str(retry_after)})
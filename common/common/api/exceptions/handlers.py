@@ -13,4 +13,5 @@ async def handle_managed_exception(
     return JSONResponse(
         status_code=exc.status_code,
         content={"detail": exc.detail},
+        headers=exc.headers,
     )
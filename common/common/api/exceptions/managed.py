@@ -42,14 +42,19 @@ class ManagedException(Exception):  # noqa: N818
 
     status_code: int = HTTPStatus.BAD_REQUEST
     detail: str = "An error occurred"
+    # Headers to send with the error response, such as `Retry-After`.
+    headers: dict[str, str] | None = None
 
     def __init__(
         self,
         *,
         status_code: int | None = None,
         detail: str | None = None,
+        headers: dict[str, str] | None = None,
     ) -> None:
         if status_code is not None:
             self.status_code = status_code
         if detail is not None:
             self.detail = detail
+        if headers is not None:
+            self.headers = headers
@@ -38,3 +38,10 @@ class PasswordNotHashedError(ManagedException):
 
     status_code = HTTPStatus.BAD_REQUEST
     detail = "Password not hashed"
+
+
+class PasswordHashChangedError(ManagedException):
+    """Raised when a user's password hash changed before it could be replaced"""
+
+    status_code = HTTPStatus.CONFLICT
+    detail = "Password hash has changed"
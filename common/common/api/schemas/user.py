@@ -1,7 +1,21 @@
 import uuid
+from datetime import datetime
 
 from pydantic import BaseModel, Field, field_validator
 
+# Upper bound on the number of users that can be resolved in a single batch request.
+MAX_USERNAME_BATCH_SIZE = 500
+
+# Upper bound on the number of users returned by a single page of the user listing.
+MAX_USER_PAGE_SIZE = 1000
+
+# Upper bound on the number of usernames returned by a single username search.
+MAX_USERNAME_SEARCH_RESULTS = 20
+
+# Types of `UserEvent`, which are also the routing keys they are published with.
+USER_CREATED = "user.created"
+USER_UPDATED = "user.updated"
+
 
 def uuid_validator(value: str) -> str:
     """Ensure that the UUID is a valid UUID."""
@@ -65,6 +79,23 @@ class CreateUserRequest(BaseModel):
     hashed_password: str
 
 
+class UpdatePasswordHashRequest(BaseModel):
+    """
+    Represents a new hash of a user's password, such as one computed with stronger
+    parameters when the user logs in.
+
+    The user's hash is only replaced if it is still `previous_hashed_password`, the
+    one that the password was verified against, so that a password changed in the
+    meantime is not overwritten.
+
+    Example flow:
+    Auth Service > User Service
+    """
+
+    hashed_password: str = Field(..., min_length=1)
+    previous_hashed_password: str = Field(..., min_length=1)
+
+
 class UserIdentityRequest(BaseModel):
     """
     Represents a request to retrieve user data from the user service.
@@ -89,6 +120,132 @@ class InternalUserIdentity(BaseModel):
         return uuid_validator(value)
 
 
+class UsernameBatchRequest(BaseModel):
+    """
+    Represents a request to resolve the usernames of several users at once.
+
+    Example flow:
+    Gateway > User Service
+    """
+
+    uuids: list[str] = Field(..., min_length=1, max_length=MAX_USERNAME_BATCH_SIZE)
+
+    @field_validator("uuids")
+    def validate_uuids(cls, value: list[str]) -> list[str]:  # noqa: N805
+        return [uuid_validator(v) for v in value]
+
+
+class UsernameBatchResponse(BaseModel):
+    """
+    Represents the usernames resolved for a `UsernameBatchRequest`.
+
+    UUIDs that do not belong to any user are listed in `missing` rather than being
+    silently dropped.
+
+    Example flow:
+    User Service > Gateway
+    """
+
+    usernames: dict[str, str]
+    missing: list[str]
+
+
+class UsernameAvailability(BaseModel):
+    """
+    Represents whether a username can still be registered.
+
+    Example flow:
+    User Service > Gateway > Frontend (registration form)
+    """
+
+    username: str
+    available: bool
+
+
+class UsernameSearchResult(BaseModel):
+    """
+    Represents the usernames that start with a prefix, in code point order.
+
+    Example flow:
+    User Service > Gateway > Frontend (mention autocomplete)
+    """
+
+    prefix: str
+    usernames: list[str]
+
+
+class UserSummary(BaseModel):
+    """Represents the public fields of a user, as listed by the user service."""
+
+    uuid: str
+    username: str
+    created_at: datetime
+
+
+class UserPage(BaseModel):
+    """
+    Represents one page of users, ordered by creation time.
+
+    `next_cursor` is passed back to fetch the following page, and is `None` on the
+    last page.
+
+    Example flow:
+    User Service > Indexing and analytics jobs
+    """
+
+    users: list[UserSummary]
+    next_cursor: str | None = None
+
+
+class UserChange(BaseModel):
+    """Represents the current state of a user that was created or changed."""
+
+    uuid: str
+    username: str
+    version: datetime
+
+
+class UserChangesPage(BaseModel):
+    """
+    Represents one page of the user change feed, in the order the changes were made.
+
+    `next_cursor` is passed back as `since` to fetch the changes made after this page,
+    and is returned even when there are none yet, so that consumers can poll with it.
+    A user changed again later reappears with its new `version`.
+
+    Example flow:
+    User Service > Caches of usernames in other services
+    """
+
+    changes: list[UserChange]
+    next_cursor: str
+    has_more: bool
+
+
+class UserEvent(BaseModel):
+    """
+    Represents a change to a user, published by the user service once committed.
+
+    `event_type` is `user.created` for a new user, or `user.updated` when a user's
+    username changes. Events are delivered at least once, and not necessarily in
+    order, so consumers keeping a copy of usernames should only apply an event whose
+    `version` is later than that of their copy.
+
+    Example flow:
+    User Service > RabbitMQ > Gateway, Post Service
+    """
+
+    event_id: int
+    event_type: str
+    uuid: str
+    username: str
+    version: datetime
+
+    @field_validator("uuid", mode="before")
+    def validate_uuid(cls, value: str) -> str:  # noqa: N805
+        return uuid_validator(value)
+
+
 class AuthToken(BaseModel):
     """
     Represents the client's JWT so it can be used to authenticate the client.
@@ -0,0 +1,46 @@
+"""In-process metrics, reported as JSON by each service's internal endpoints."""
+import bisect
+from collections.abc import Sequence
+from typing import Any
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+class Histogram:
+    """A fixed-bucket histogram, cheap enough to update on every call it measures."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return the cumulative count of observations at or below each bucket."""
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts, strict=True):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
@@ -0,0 +1,12 @@
+from common.metrics import Histogram
+
+
+def test_histogram_buckets_are_cumulative() -> None:
+    histogram = Histogram(buckets=(0.1, 1))
+
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 4  # noqa: PLR2004
+    assert snapshot["buckets"] == {"0.1": 2, "1": 3, "+Inf": 4}
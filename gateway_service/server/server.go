@@ -1,13 +1,13 @@
 package server
 
 import (
+	"bytes"
 	"encoding/json"
-	"io"
+	"fmt"
 	"log"
 	"net/http"
 	"os"
 	"service/rabbitmq"
-	"strings"
 
 	"github.com/gin-gonic/gin"
 )
@@ -53,38 +53,67 @@ func handleAuth(c *gin.Context) {
 	proxyRequest(c, os.Getenv("AUTH_SERVICE_HOST"), os.Getenv("AUTH_SERVICE_PORT"))
 }
 
-func getUsername(serviceHost string, servicePort string, uuid string) (string, error) {
-	type UsernameIn struct {
-		Username string `json:"username"`
-	}
+// usernameBatchSize matches the maximum batch size accepted by the user service.
+const usernameBatchSize = 500
+
+type UsernameBatchRequest struct {
+	UUIDs []string `json:"uuids"`
+}
 
+type UsernameBatchResponse struct {
+	Usernames map[string]string `json:"usernames"`
+	Missing   []string          `json:"missing"`
+}
+
+func getUsernames(serviceHost string, servicePort string, uuids []string) (map[string]string, error) {
 	client := &http.Client{}
-	url := "http://" + serviceHost + ":" + servicePort + "/users/" + uuid
-	req, err := http.NewRequest("GET", url, nil)
-	if err != nil {
-		return "", err
-	}
+	url := "http://" + serviceHost + ":" + servicePort + "/users/usernames"
+	usernames := make(map[string]string, len(uuids))
 
-	log.Println("URL: ", url)
-	log.Println("UUID: ", uuid)
+	for start := 0; start < len(uuids); start += usernameBatchSize {
+		end := start + usernameBatchSize
+		if end > len(uuids) {
+			end = len(uuids)
+		}
 
-	resp, err := client.Do(req)
-	if err != nil {
-		return "", err
-	}
-	defer resp.Body.Close()
+		body, err := json.Marshal(UsernameBatchRequest{UUIDs: uuids[start:end]})
+		if err != nil {
+			return nil, err
+		}
 
-	bodyBytes, _ := io.ReadAll(resp.Body)
-	bodyString := string(bodyBytes)
-	log.Println("Response Body: ", bodyString)
+		req, err := http.NewRequest("POST", url, bytes.NewReader(body))
+		if err != nil {
+			return nil, err
+		}
+		req.Header.Set("Content-Type", "application/json")
 
-	var user UsernameIn
-	err = json.NewDecoder(strings.NewReader(bodyString)).Decode(&user)
-	if err != nil {
-		return "", err
+		resp, err := client.Do(req)
+		if err != nil {
+			return nil, err
+		}
+
+		if resp.StatusCode != http.StatusOK {
+			resp.Body.Close()
+			return nil, fmt.Errorf("user service responded with status %d", resp.StatusCode)
+		}
+
+		var batch UsernameBatchResponse
+		err = json.NewDecoder(resp.Body).Decode(&batch)
+		resp.Body.Close()
+		if err != nil {
+			return nil, err
+		}
+
+		if len(batch.Missing) > 0 {
+			log.Println("Unknown post creators: ", batch.Missing)
+		}
+
+		for uuid, username := range batch.Usernames {
+			usernames[uuid] = username
+		}
 	}
 
-	return user.Username, nil
+	return usernames, nil
 }
 
 func getPosts(postServiceHost string, postServicePort string, userServiceHost string, userServicePort string) ([]PostOut, error) {
@@ -115,17 +144,26 @@ func getPosts(postServiceHost string, postServicePort string, userServiceHost st
 		return nil, err
 	}
 
-	var posts []PostOut
+	// resolve every creator with a single batch request instead of one per post
+	seen := make(map[string]bool)
+	var creatorUUIDs []string
 	for _, postResponse := range postResponses {
-		// sub-optimal, because a request is made for each post
-		username, err := getUsername(userServiceHost, userServicePort, postResponse.CreatorUUID)
-		if err != nil {
-			return nil, err
+		if !seen[postResponse.CreatorUUID] {
+			seen[postResponse.CreatorUUID] = true
+			creatorUUIDs = append(creatorUUIDs, postResponse.CreatorUUID)
 		}
+	}
+
+	usernames, err := getUsernames(userServiceHost, userServicePort, creatorUUIDs)
+	if err != nil {
+		return nil, err
+	}
 
+	var posts []PostOut
+	for _, postResponse := range postResponses {
 		post := PostOut{
 			PostUUID:  postResponse.PostUUID,
-			Author:    username,
+			Author:    usernames[postResponse.CreatorUUID],
 			VoteCount: postResponse.VoteCount,
 			Title:     postResponse.Title,
 			URL:       postResponse.URL,
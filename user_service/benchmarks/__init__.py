@@ -0,0 +1 @@
+"""Benchmarks of the user service's database paths, run against a local database."""
@@ -0,0 +1,98 @@
+"""Compare the payload size and CPU cost of JSON and MessagePack responses.
+
+Each response is encoded as the user service encodes it, and decoded and validated
+as its caller does. No database is needed:
+
+    python -m benchmarks.encoding --iterations 20000
+"""
+import argparse
+import json
+import uuid
+from datetime import UTC, datetime
+
+from common.api.encoding import decode_msgpack, encode_msgpack
+from common.api.schemas.user import (
+    UserAuthData,
+    UsernameBatchResponse,
+    UserPage,
+    UserSummary,
+)
+from pydantic import BaseModel
+
+from benchmarks.harness import configure_logging, logger, measure, report
+
+
+def _payloads() -> dict[str, BaseModel]:
+    uuids = [str(uuid.uuid4()) for _ in range(500)]
+    return {
+        "auth data": UserAuthData(uuid=uuids[0], hashed_password="x" * 97),
+        "500 usernames": UsernameBatchResponse(
+            usernames={uuid: f"user{i}" for i, uuid in enumerate(uuids)},
+            missing=[],
+        ),
+        "page of 100 users": UserPage(
+            users=[
+                UserSummary(
+                    uuid=uuid,
+                    username=f"user{i}",
+                    created_at=datetime.now(tz=UTC),
+                )
+                for i, uuid in enumerate(uuids[:100])
+            ],
+            next_cursor="x" * 40,
+        ),
+    }
+
+
+def _encode_json(model: BaseModel) -> bytes:
+    # As `JSONResponse` renders the serialised model.
+    return json.dumps(
+        model.model_dump(mode="json"),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode()
+
+
+def main() -> None:
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+
+    for name, payload in _payloads().items():
+        as_json = _encode_json(payload)
+        as_msgpack = encode_msgpack(payload)
+        model = type(payload)
+        logger.info(
+            "%s: %s B as JSON, %s B as MessagePack (%.2fx)",
+            name,
+            len(as_json),
+            len(as_msgpack),
+            len(as_msgpack) / len(as_json),
+        )
+        report(
+            measure("encode JSON", lambda p=payload: _encode_json(p), args.iterations),
+            measure(
+                "encode MessagePack",
+                lambda p=payload: encode_msgpack(p),
+                args.iterations,
+            ),
+        )
+        report(
+            measure(
+                "decode JSON",
+                lambda m=model, b=as_json: m.model_validate_json(b),
+                args.iterations,
+            ),
+            measure(
+                "decode MessagePack",
+                lambda m=model, b=as_msgpack: decode_msgpack(b, m),
+                args.iterations,
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
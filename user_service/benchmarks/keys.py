@@ -0,0 +1,109 @@
+"""Compare insert throughput and index size of version 4 and version 7 user keys.
+
+Each version fills a scratch copy of the users table, so the real one is untouched.
+Run against a disposable local database, configured through the usual `DB_*`
+settings:
+
+    python -m benchmarks.keys --rows 5000000 --batch-size 10000
+"""
+import argparse
+import time
+import uuid
+from collections.abc import Callable
+
+from dotenv import load_dotenv
+from sqlalchemy import Connection, Engine, MetaData, Table, create_engine, text
+
+from benchmarks.harness import configure_logging, logger
+from service.config import get_database_config
+from service.database.models import User, uuid7
+
+_GENERATORS: dict[int, Callable[[], uuid.UUID]] = {4: uuid.uuid4, 7: uuid7}
+
+# Throughput is also reported for the last tenth of the rows, by which point a random
+# key's page of the index is rarely still cached.
+_TAIL_FRACTION = 0.1
+
+
+def _scratch_table(version: int) -> Table:
+    return User.__table__.to_metadata(
+        MetaData(),
+        name=f"benchmark_users_v{version}",
+    )
+
+
+def _relation_size(connection: Connection, relation: str) -> int:
+    return connection.execute(
+        text("SELECT pg_relation_size(CAST(:relation AS regclass))"),
+        {"relation": relation},
+    ).scalar()
+
+
+def _fill(engine: Engine, version: int, rows: int, batch_size: int) -> None:
+    table = _scratch_table(version)
+    generate = _GENERATORS[version]
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+
+    tail_from = rows - int(rows * _TAIL_FRACTION)
+    tail_started = None
+    started = time.perf_counter()
+    try:
+        with engine.connect() as connection:
+            for offset in range(0, rows, batch_size):
+                if tail_started is None and offset >= tail_from:
+                    tail_started = time.perf_counter()
+                count = min(batch_size, rows - offset)
+                connection.execute(
+                    table.insert(),
+                    [
+                        {
+                            "uuid": generate(),
+                            "username": f"user{offset + i}",
+                            "hashed_password": "x" * 97,
+                        }
+                        for i in range(count)
+                    ],
+                )
+                connection.commit()
+            finished = time.perf_counter()
+
+            # VACUUM cannot run inside a transaction block.
+            connection.execution_options(isolation_level="AUTOCOMMIT").execute(
+                text(f"VACUUM ANALYZE {table.name}"),
+            )
+            primary_key = _relation_size(connection, f"{table.name}_pkey")
+            heap = _relation_size(connection, table.name)
+    finally:
+        table.drop(engine)
+
+    tail_rows = rows - tail_from
+    logger.info(
+        "v%s: %9.0f rows/s overall, %9.0f rows/s over the last %s rows, "
+        "primary key %7.1f MiB, table %7.1f MiB",
+        version,
+        rows / (finished - started),
+        tail_rows / (finished - tail_started),
+        tail_rows,
+        primary_key / 1024**2,
+        heap / 1024**2,
+    )
+
+
+def main() -> None:
+    load_dotenv()
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args()
+
+    engine = create_engine(get_database_config().url)
+    logger.info("Inserting %s rows in batches of %s", args.rows, args.batch_size)
+    for version in sorted(_GENERATORS):
+        _fill(engine, version, args.rows, args.batch_size)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
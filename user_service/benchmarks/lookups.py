@@ -0,0 +1,105 @@
+"""Compare the ORM and column-projected paths of the hot user lookups.
+
+Run against a disposable local database, configured through the usual `DB_*`
+settings:
+
+    python -m benchmarks.lookups --users 1000 --iterations 5000
+"""
+import argparse
+import random
+from collections.abc import Callable
+
+from common.api.schemas.user import UserAuthData
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy.orm import Session
+
+from benchmarks.harness import configure_logging, logger, measure, report
+from service.config import get_database_config
+from service.database.models import User
+from service.database.session import Base
+from service.database.user_handler import UserHandler
+
+_PREFIX = "benchmark-lookups-"
+
+
+def _orm_auth_data(db: Session, username: str) -> UserAuthData | None:
+    user = db.execute(select(User).where(User.username == username).limit(1))
+    user = user.scalars().first()
+    return None if user is None else user.to_auth_data()
+
+
+def _orm_username(db: Session, uuid: str) -> str | None:
+    user = db.execute(select(User).where(User.uuid == uuid).limit(1))
+    user = user.scalars().first()
+    return None if user is None else user.username
+
+
+def main() -> None:
+    load_dotenv()
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    engine = create_engine(get_database_config().url)
+    Base.metadata.create_all(engine)
+    rng = random.Random(0)
+
+    with Session(engine) as db:
+        users = [
+            User(username=f"{_PREFIX}{i}", hashed_password="x" * 97)
+            for i in range(args.users)
+        ]
+        db.add_all(users)
+        db.commit()
+        pairs = [(str(user.uuid), user.username) for user in users]
+
+        # Each call runs in its own transaction and starts with an empty identity
+        # map, as it would in a request.
+        def run(lookup: Callable[[str], object], index: int) -> Callable[[], None]:
+            def call() -> None:
+                lookup(pairs[rng.randrange(len(pairs))][index])
+                db.rollback()
+
+            return call
+
+        handler = UserHandler(db)
+        try:
+            logger.info("auth data by username (%s calls)", args.iterations)
+            report(
+                measure(
+                    "ORM entity + to_auth_data",
+                    run(lambda username: _orm_auth_data(db, username), 1),
+                    args.iterations,
+                ),
+                measure(
+                    "projected columns",
+                    run(handler.get_auth_data_and_version, 1),
+                    args.iterations,
+                ),
+            )
+
+            logger.info("username by UUID (%s calls)", args.iterations)
+            report(
+                measure(
+                    "ORM entity",
+                    run(lambda uuid: _orm_username(db, uuid), 0),
+                    args.iterations,
+                ),
+                measure(
+                    "projected columns",
+                    run(handler.get_username_and_version, 0),
+                    args.iterations,
+                ),
+            )
+        finally:
+            db.execute(delete(User).where(User.username.startswith(_PREFIX)))
+            db.commit()
+
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
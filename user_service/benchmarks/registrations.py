@@ -0,0 +1,101 @@
+"""Compare registration throughput with and without group commit.
+
+Concurrent registrations are simulated by a pool of threads, each creating users
+through its own `UserHandler` and session, as the request threadpool would. Run
+against a disposable local database, configured through the usual `DB_*` settings:
+
+    python -m benchmarks.registrations --users 20000 --concurrency 64
+"""
+import argparse
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.api.schemas.user import CreateUserRequest
+from dotenv import load_dotenv
+from sqlalchemy import Engine, create_engine, delete
+from sqlalchemy.orm import Session
+
+from benchmarks.harness import configure_logging, logger
+from service.config import GroupCommitConfig, get_database_config
+from service.database.group_commit import GroupCommitter
+from service.database.models import User
+from service.database.session import Base
+from service.database.user_handler import UserHandler
+
+_PREFIX = "benchmark-registrations-"
+
+
+def _register(
+    engine: Engine,
+    committer: GroupCommitter | None,
+    name: str,
+    users: int,
+    concurrency: int,
+) -> None:
+    counter = itertools.count()
+
+    def register(_: int) -> None:
+        with Session(engine) as db:
+            UserHandler(db, committer=committer).create_user(
+                CreateUserRequest(
+                    username=f"{_PREFIX}{name}-{next(counter)}",
+                    hashed_password="x" * 97,
+                ),
+            )
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in executor.map(register, range(users)):
+            pass
+    elapsed = time.perf_counter() - started
+    logger.info("%-40s %9.0f registrations/s", name, users / elapsed)
+
+
+def main() -> None:
+    load_dotenv()
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--max-batch-size", type=int, default=100)
+    parser.add_argument("--max-delay", type=float, default=0.005)
+    args = parser.parse_args()
+
+    # Enough connections for every thread, so that only commits are contended.
+    engine = create_engine(
+        get_database_config().url,
+        pool_size=args.concurrency,
+        max_overflow=0,
+    )
+    Base.metadata.create_all(engine)
+    committer = GroupCommitter(
+        engine,
+        config=GroupCommitConfig(
+            group_commit_max_batch_size=args.max_batch_size,
+            group_commit_max_delay=args.max_delay,
+        ),
+    )
+
+    logger.info(
+        "Registering %s users from %s threads",
+        args.users,
+        args.concurrency,
+    )
+    try:
+        _register(engine, None, "one commit per user", args.users, args.concurrency)
+        _register(
+            engine,
+            committer,
+            f"group commit (<= {args.max_batch_size} users, {args.max_delay}s)",
+            args.users,
+            args.concurrency,
+        )
+    finally:
+        with engine.begin() as connection:
+            connection.execute(delete(User).where(User.username.startswith(_PREFIX)))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Compare the latency of username prefix searches with and without their index.
+
+The users table is filled with random usernames, which are removed again afterwards.
+Run against a disposable local database, configured through the usual `DB_*`
+settings:
+
+    python -m benchmarks.search --users 5000000 --searches 2000
+"""
+import argparse
+import random
+import statistics
+import string
+import time
+from collections.abc import Callable
+
+from dotenv import load_dotenv
+from sqlalchemy import Engine, create_engine, delete, select, text
+from sqlalchemy.orm import Session
+
+from benchmarks.harness import configure_logging, logger
+from service.config import CacheConfig, get_database_config
+from service.database.cache import UserCache
+from service.database.models import User
+from service.database.session import Base
+from service.database.user_handler import UserHandler
+
+_PREFIX = "benchmark-search-"
+_LIMIT = 10
+
+
+def _fill(engine: Engine, users: int, batch_size: int) -> None:
+    rng = random.Random(0)
+    with engine.connect() as connection:
+        for offset in range(0, users, batch_size):
+            connection.execute(
+                User.__table__.insert(),
+                [
+                    {
+                        "username": _PREFIX
+                        + "".join(rng.choices(string.ascii_lowercase, k=8))
+                        + str(offset + i),
+                        "hashed_password": "x" * 97,
+                    }
+                    for i in range(min(batch_size, users - offset))
+                ],
+            )
+            connection.commit()
+        connection.execution_options(isolation_level="AUTOCOMMIT").execute(
+            text("VACUUM ANALYZE users"),
+        )
+
+
+def _time(name: str, search: Callable[[str], list], prefixes: list[str]) -> None:
+    latencies = []
+    for prefix in prefixes:
+        started = time.perf_counter()
+        search(prefix)
+        latencies.append((time.perf_counter() - started) * 1000)
+    percentiles = statistics.quantiles(latencies, n=100)
+    logger.info(
+        "%-36s p50 %8.3f ms  p99 %8.3f ms",
+        name,
+        percentiles[49],
+        percentiles[98],
+    )
+
+
+def main() -> None:
+    load_dotenv()
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--searches", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args()
+
+    engine = create_engine(get_database_config().url)
+    Base.metadata.create_all(engine)
+    # An existing users table may predate the prefix index.
+    for index in User.__table__.indexes:
+        index.create(engine, checkfirst=True)
+    logger.info("Inserting %s users", args.users)
+    _fill(engine, args.users, args.batch_size)
+
+    rng = random.Random(1)
+    # Prefixes as typed into a mention box: one to three characters of a username.
+    prefixes = [
+        _PREFIX + "".join(rng.choices(string.ascii_lowercase, k=rng.randint(1, 3)))
+        for _ in range(args.searches)
+    ]
+    # Autocomplete traffic is skewed towards a few popular prefixes.
+    hot_prefixes = rng.choices(prefixes[:50], k=args.searches)
+
+    def without_index(db: Session) -> Callable[[str], list]:
+        # What a search costs without a usable index, as in a database whose default
+        # collation is linguistic (as most are) when the username index is the only one.
+        db.execute(text("SET LOCAL enable_indexscan = off"))
+        db.execute(text("SET LOCAL enable_bitmapscan = off"))
+        return lambda prefix: db.execute(
+            select(User.username)
+            .where(User.username.like(f"{prefix}%"))
+            .order_by(User.username)
+            .limit(_LIMIT),
+        ).all()
+
+    try:
+        with Session(engine) as db:
+            _time(
+                "LIKE 'prefix%', no usable index",
+                without_index(db),
+                # Every one of these is a sequential scan, so fewer are enough.
+                prefixes[: max(args.searches // 20, 2)],
+            )
+            db.rollback()
+            handler = UserHandler(db)
+            cached = UserHandler(db, UserCache(CacheConfig()))
+            _time(
+                "index range scan",
+                lambda prefix: handler.search_usernames(prefix, _LIMIT),
+                prefixes,
+            )
+            _time(
+                "index range scan, hot prefixes",
+                lambda prefix: handler.search_usernames(prefix, _LIMIT),
+                hot_prefixes,
+            )
+            _time(
+                "cached, hot prefixes",
+                lambda prefix: cached.search_usernames(prefix, _LIMIT),
+                hot_prefixes,
+            )
+    finally:
+        with engine.begin() as connection:
+            connection.execute(delete(User).where(User.username.startswith(_PREFIX)))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
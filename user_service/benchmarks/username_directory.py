@@ -0,0 +1,80 @@
+"""Compare the memory and lookup cost of the username directory and the LRU cache.
+
+Both are filled with the same random users; no database is needed:
+
+    python -m benchmarks.username_directory --users 1000000
+"""
+import argparse
+import itertools
+import random
+import tempfile
+import tracemalloc
+import uuid
+from collections.abc import Callable
+from pathlib import Path
+
+from benchmarks.harness import configure_logging, logger, measure, report
+from service.config import CacheConfig
+from service.database.cache import LRUCache
+from service.database.username_directory import UsernameDirectory, write_directory
+
+
+def _allocated(fn: Callable[[], object]) -> tuple[object, int]:
+    tracemalloc.start()
+    try:
+        result = fn()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def main() -> None:
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    users = sorted((uuid.uuid4(), f"user{i}") for i in range(args.users))
+    keys = [str(key) for key, _ in random.Random(0).choices(users, k=1000)]
+
+    def fill_cache() -> LRUCache:
+        config = CacheConfig()
+        cache = LRUCache(args.users, config.user_cache_ttl)
+        for key, username in users:
+            cache.put(str(key), username)
+        return cache
+
+    cache, cache_bytes = _allocated(fill_cache)
+
+    with tempfile.TemporaryDirectory() as directory_path:
+        path = Path(directory_path) / "usernames"
+        write_directory(str(path), ((key.bytes, name) for key, name in users), None)
+        directory, directory_bytes = _allocated(lambda: UsernameDirectory(str(path)))
+
+        logger.info(
+            "%s users: LRU cache %.1f MiB per worker, directory %.1f MiB shared "
+            "(%.1f MiB of Python objects per worker)",
+            args.users,
+            cache_bytes / 2**20,
+            path.stat().st_size / 2**20,
+            directory_bytes / 2**20,
+        )
+        lookups = itertools.cycle(keys)
+        report(
+            measure(
+                "LRU cache lookup",
+                lambda: cache.get(next(lookups)),
+                args.iterations,
+            ),
+            measure(
+                "directory lookup",
+                lambda: directory.get(next(lookups)),
+                args.iterations,
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
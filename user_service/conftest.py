@@ -1,18 +1,25 @@
-from collections.abc import Generator
+from collections.abc import AsyncGenerator, Generator
 from typing import Any
 
 import pytest
+import pytest_asyncio
 from common.api.exceptions.handlers import handle_managed_exception
 from common.api.exceptions.managed import ManagedException
 from common.api.schemas.user import CreateUserRequest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from pytest_postgresql import factories
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
 
 from service.api.router import router
 from service.database.session import Base
-from service.database.user_handler import UserHandler, get_user_handler
+from service.database.user_handler import (
+    ThreadedUserHandler,
+    UserHandler,
+    get_user_handler,
+)
 
 
 @pytest.fixture
@@ -28,7 +35,9 @@ def app(db: Session) -> FastAPI:
     app = FastAPI()
     app.include_router(router)
     app.add_exception_handler(ManagedException, handle_managed_exception)
-    app.dependency_overrides[get_user_handler] = lambda: UserHandler(db)
+    app.dependency_overrides[get_user_handler] = lambda: ThreadedUserHandler(
+        UserHandler(db),
+    )
     return app
 
 
@@ -39,12 +48,28 @@ def client(
     return TestClient(app)
 
 
+def _sqlalchemy_dsn(postgresql: Any, driver: str = "postgresql") -> str:  # noqa: ANN401
+    dsn = postgresql.info.dsn
+    dsn_dict = dict(s.split("=") for s in dsn.split())
+    return f"{driver}://{dsn_dict['user']}@{dsn_dict['host']}:{dsn_dict['port']}/{dsn_dict['dbname']}"
+
+
+# A second database on the same server, for tests that spread users over shards.
+second_shard = factories.postgresql("postgresql_proc", dbname="second_shard")
+
+
+@pytest.fixture
+def shard_urls(
+    postgresql: Any,  # noqa: ANN401
+    second_shard: Any,  # noqa: ANN401
+) -> list[str]:
+    return [_sqlalchemy_dsn(postgresql), _sqlalchemy_dsn(second_shard)]
+
+
 @pytest.fixture
 def db(postgresql: Any) -> Generator[Session, None, None]:  # noqa: ANN401
     session = sessionmaker(autocommit=False, autoflush=False)
-    dsn = postgresql.info.dsn
-    dsn_dict = dict(s.split("=") for s in dsn.split())
-    sqlalchemy_dsn = f"postgresql://{dsn_dict['user']}@{dsn_dict['host']}:{dsn_dict['port']}/{dsn_dict['dbname']}"
+    sqlalchemy_dsn = _sqlalchemy_dsn(postgresql)
 
     engine = create_engine(sqlalchemy_dsn)
     Base.metadata.create_all(bind=engine)
@@ -53,3 +78,20 @@ def db(postgresql: Any) -> Generator[Session, None, None]:  # noqa: ANN401
     yield s
     s.close()
     Base.metadata.drop_all(bind=engine)
+
+
+@pytest_asyncio.fixture
+async def async_db(
+    postgresql: Any,  # noqa: ANN401
+) -> AsyncGenerator[AsyncSession, None]:
+    engine = create_async_engine(_sqlalchemy_dsn(postgresql, "postgresql+asyncpg"))
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+    session = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    async with session() as s:
+        yield s
+
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
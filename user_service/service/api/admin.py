@@ -0,0 +1,29 @@
+import logging
+from http import HTTPStatus
+
+from fastapi import APIRouter
+
+from service.database.cache import get_user_cache
+from service.database.session import get_database_connector
+
+# Operational endpoints for this service's operators, not for other services.
+router = APIRouter(prefix="/internal")
+
+
+@router.get("/metrics/database", status_code=HTTPStatus.OK)
+async def get_database_metrics() -> dict:
+    """Report query latencies, connection pool usage and user cache statistics."""
+    logging.debug("Endpoint called: get_database_metrics")
+    cache = get_user_cache()
+
+    return {
+        "engines": get_database_connector().metrics.snapshot(),
+        "cache": None if cache is None else cache.stats(),
+    }
+
+
+@router.get("/slow-queries", status_code=HTTPStatus.OK)
+async def get_slow_queries() -> list[dict]:
+    """List the most recent slow queries, with their plans when one was captured."""
+    logging.debug("Endpoint called: get_slow_queries")
+    return get_database_connector().slow_queries.entries()
@@ -0,0 +1,57 @@
+from http import HTTPStatus
+from typing import Any
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from service.api.admin import router
+from service.config import DatabaseConfig
+from service.database import cache as cache_module
+from service.database import session as session_module
+from service.database.session import SQLAlchemyConnector
+
+
+def test_database_metrics_are_served(
+    postgresql: Any,  # noqa: ANN401
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    info = postgresql.info
+    connector = SQLAlchemyConnector(
+        f"postgresql://{info.user}@{info.host}:{info.port}/{info.dbname}",
+        DatabaseConfig(),
+    )
+    connector.create_schema()
+    monkeypatch.setattr(session_module, "_connector", connector)
+    monkeypatch.setattr(cache_module, "_user_cache", None)
+    app = FastAPI()
+    app.include_router(router)
+
+    response = TestClient(app).get("/internal/metrics/database")
+    data = response.json()
+
+    assert response.status_code == HTTPStatus.OK
+    assert data["engines"]["primary"]["pool"]["connects"] >= 1
+    assert data["cache"] is None
+    connector.dispose()
+
+
+def test_slow_queries_are_served(
+    postgresql: Any,  # noqa: ANN401
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    info = postgresql.info
+    connector = SQLAlchemyConnector(
+        f"postgresql://{info.user}@{info.host}:{info.port}/{info.dbname}",
+        DatabaseConfig(db_slow_query_threshold=1e-9),
+    )
+    connector.create_schema()
+    monkeypatch.setattr(session_module, "_connector", connector)
+    app = FastAPI()
+    app.include_router(router)
+
+    response = TestClient(app).get("/internal/slow-queries")
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()[0]["engine"] == "primary"
+    connector.dispose()
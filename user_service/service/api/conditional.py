@@ -0,0 +1,40 @@
+import hashlib
+from datetime import datetime
+from http import HTTPStatus
+
+from fastapi import Request, Response
+
+
+def make_etag(key: str, version: datetime, media_type: str) -> str:
+    """Return a strong ETag for the representation of `key` at `version`.
+
+    The key is part of the tag, so that a user recreated under the same name, or a tag
+    sent to the wrong resource, never matches. So is the media type, since JSON and
+    MessagePack representations differ byte for byte.
+    """
+    digest = hashlib.blake2b(
+        f"{key}\0{version.isoformat()}\0{media_type}".encode(),
+        digest_size=12,
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so weak tags match their strong ones.
+    tags = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return any(tag in ("*", etag) for tag in tags)
+
+
+def cache_headers(etag: str, max_age: int) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": f"max-age={max_age}"}
+
+
+def not_modified(request: Request, etag: str, max_age: int) -> Response | None:
+    """Return a 304 response if the caller's copy, per `If-None-Match`, is current."""
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is None or not _matches(if_none_match, etag):
+        return None
+    return Response(
+        status_code=HTTPStatus.NOT_MODIFIED,
+        headers=cache_headers(etag, max_age),
+    )
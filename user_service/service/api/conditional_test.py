@@ -0,0 +1,37 @@
+from datetime import UTC, datetime
+
+import pytest
+from common.api.encoding import JSON, MSGPACK
+
+from service.api.conditional import _matches, make_etag
+
+_VERSION = datetime(2024, 1, 1, tzinfo=UTC)
+
+
+def test_etags_change_with_the_key_version_and_encoding() -> None:
+    etag = make_etag("alice", _VERSION, JSON)
+
+    assert etag.startswith('"')
+    assert etag.endswith('"')
+    assert etag == make_etag("alice", _VERSION, JSON)
+    assert etag != make_etag("bob", _VERSION, JSON)
+    assert etag != make_etag("alice", _VERSION.replace(microsecond=1), JSON)
+    assert etag != make_etag("alice", _VERSION, MSGPACK)
+
+
+@pytest.mark.parametrize(
+    ("if_none_match", "matches"),
+    [
+        ('"tag"', True),
+        ('W/"tag"', True),
+        ('"other", "tag"', True),
+        ("*", True),
+        ('"other"', False),
+        ("tag", False),
+    ],
+)
+def test_if_none_match_is_compared_weakly(
+    if_none_match: str,
+    matches: bool,  # noqa: FBT001
+) -> None:
+    assert _matches(if_none_match, '"tag"') is matches
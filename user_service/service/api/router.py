@@ -1,58 +1,336 @@
+import json
 import logging
+import uuid as uuid_lib
+from collections.abc import AsyncIterable, AsyncIterator, Iterable, Sequence
 from http import HTTPStatus
 
+from common.api.encoding import (
+    NegotiatedResponse,
+    NegotiatedRoute,
+    response_media_type,
+)
 from common.api.exceptions.user import (
+    PasswordHashChangedError,
     UserDoesNotExistError,
 )
 from common.api.schemas.user import (
+    MAX_USER_PAGE_SIZE,
+    MAX_USERNAME_SEARCH_RESULTS,
     CreateUserRequest,
     InternalUserIdentity,
+    UpdatePasswordHashRequest,
     UserAuthData,
+    UserChange,
+    UserChangesPage,
+    UsernameAvailability,
+    UsernameBatchRequest,
+    UsernameBatchResponse,
+    UsernameSearchResult,
+    UserPage,
+    UserSummary,
+)
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Row
+
+from service.api.conditional import cache_headers, make_etag, not_modified
+from service.config import get_http_cache_config
+from service.database.pagination import (
+    ChangeCursor,
+    advance_change_cursor,
+    decode_change_cursor,
+    decode_cursor,
+    encode_change_cursor,
+    encode_cursor,
+)
+from service.database.user_handler import (
+    AsyncUserHandler,
+    ThreadedUserHandler,
+    get_user_handler,
 )
-from fastapi import APIRouter, Depends
 
-from service.database.user_handler import UserHandler, get_user_handler
+# Internal callers may exchange MessagePack instead of JSON with any of these routes.
+router = APIRouter(
+    route_class=NegotiatedRoute,
+    default_response_class=NegotiatedResponse,
+)
+
+# Rows fetched from the database per chunk of a user export.
+EXPORT_BATCH_SIZE = 1000
+
 
-router = APIRouter()
+def _to_ndjson(rows: Sequence[Row]) -> str:
+    return "".join(
+        json.dumps(
+            {
+                "uuid": str(row.uuid),
+                "username": row.username,
+                "created_at": row.created_at.isoformat(),
+            },
+        )
+        + "\n"
+        for row in rows
+    )
+
+
+async def _to_ndjson_async(
+    partitions: AsyncIterable[Sequence[Row]],
+) -> AsyncIterator[str]:
+    async for rows in partitions:
+        yield _to_ndjson(rows)
+
+
+def _to_changes(rows: Sequence[Row]) -> list[UserChange]:
+    return [
+        UserChange(uuid=str(row.uuid), username=row.username, version=row.version)
+        for row in rows
+    ]
+
+
+async def _stream_changes(
+    user_handler: AsyncUserHandler | ThreadedUserHandler,
+    after: ChangeCursor | None,
+    rows: Sequence[Row],
+) -> AsyncIterator[str]:
+    while True:
+        after = advance_change_cursor(after, rows)
+        yield "".join(change.model_dump_json() + "\n" for change in _to_changes(rows))
+        if len(rows) < EXPORT_BATCH_SIZE:
+            break
+        rows = await user_handler.list_changes(EXPORT_BATCH_SIZE, after)
+    yield json.dumps({"next_cursor": encode_change_cursor(after)}) + "\n"
 
 
 @router.post("/users", status_code=HTTPStatus.CREATED)
-def create_user(
+async def create_user(
     payload: CreateUserRequest,
-    user_handler: UserHandler = Depends(get_user_handler),
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
 ) -> InternalUserIdentity:
     """Create a new user in the database and return the created user's identity."""
     logging.info("Endpoint called: create_user for user %s", payload.username)
-    user = user_handler.create_user(payload)
+    user = await user_handler.create_user(payload)
 
     return user.to_identity()
 
 
+@router.get("/users", status_code=HTTPStatus.OK)
+async def list_users(
+    limit: int = Query(100, ge=1, le=MAX_USER_PAGE_SIZE),
+    cursor: str | None = None,
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
+) -> UserPage:
+    """List users in creation order, one page at a time.
+
+    Pass the returned `next_cursor` as `cursor` to fetch the following page.
+    """
+    logging.info("Endpoint called: list_users")
+    after = None if cursor is None else decode_cursor(cursor)
+    # Fetching one extra row tells us whether there is a next page.
+    rows = await user_handler.list_users(limit + 1, after)
+
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(page[-1].created_at, page[-1].uuid)
+
+    return UserPage(
+        users=[
+            UserSummary(
+                uuid=str(row.uuid),
+                username=row.username,
+                created_at=row.created_at,
+            )
+            for row in page
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+@router.get("/users/export", status_code=HTTPStatus.OK)
+async def export_users(
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
+) -> StreamingResponse:
+    """Stream every user in creation order as newline-delimited JSON."""
+    logging.info("Endpoint called: export_users")
+    partitions = await user_handler.export_users(EXPORT_BATCH_SIZE)
+
+    if isinstance(partitions, Iterable):
+        content = (_to_ndjson(rows) for rows in partitions)
+    else:
+        content = _to_ndjson_async(partitions)
+    return StreamingResponse(content, media_type="application/x-ndjson")
+
+
+@router.get("/users/changes", status_code=HTTPStatus.OK)
+async def list_user_changes(
+    since: str | None = None,
+    limit: int = Query(100, ge=1, le=MAX_USER_PAGE_SIZE),
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
+) -> UserChangesPage:
+    """List the users created or changed since a cursor, in the order of their changes.
+
+    Pass the returned `next_cursor` as `since` to fetch the changes that follow, or
+    omit `since` to start from the beginning. Changes are only listed once every
+    transaction that was running before them has finished, which usually takes
+    milliseconds.
+    """
+    logging.info("Endpoint called: list_user_changes")
+    after = None if since is None else decode_change_cursor(since)
+    # Fetching one extra row tells us whether more changes are waiting.
+    rows = await user_handler.list_changes(limit + 1, after)
+
+    page = rows[:limit]
+    return UserChangesPage(
+        changes=_to_changes(page),
+        next_cursor=encode_change_cursor(advance_change_cursor(after, page)),
+        has_more=len(rows) > limit,
+    )
+
+
+@router.get("/users/changes/stream", status_code=HTTPStatus.OK)
+async def stream_user_changes(
+    since: str | None = None,
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
+) -> StreamingResponse:
+    """Stream every change since a cursor as newline-delimited JSON.
+
+    The last line holds the `next_cursor` to pass as `since` on the next call.
+    """
+    logging.info("Endpoint called: stream_user_changes")
+    after = None if since is None else decode_change_cursor(since)
+    # The first batch is read before the response starts, so that a cursor the
+    # handler rejects is answered with an error rather than a truncated stream.
+    rows = await user_handler.list_changes(EXPORT_BATCH_SIZE, after)
+
+    return StreamingResponse(
+        _stream_changes(user_handler, after, rows),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.get("/users/search", status_code=HTTPStatus.OK)
+async def search_usernames(
+    prefix: str = Query(min_length=1),
+    limit: int = Query(10, ge=1, le=MAX_USERNAME_SEARCH_RESULTS),
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
+) -> UsernameSearchResult:
+    """Suggest usernames starting with a prefix, e.g. to autocomplete a mention.
+
+    The search is case-sensitive, and users created in the last few seconds may not be
+    suggested yet.
+    """
+    logging.info("Endpoint called: search_usernames for %s", prefix)
+    usernames = await user_handler.search_usernames(prefix, limit)
+
+    return UsernameSearchResult(prefix=prefix, usernames=usernames)
+
+
+@router.post("/users/usernames", status_code=HTTPStatus.OK)
+async def get_user_usernames(
+    payload: UsernameBatchRequest,
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
+) -> UsernameBatchResponse:
+    """Resolve the usernames of several users, reporting UUIDs that were not found."""
+    logging.info("Endpoint called: get_user_usernames for %s users", len(payload.uuids))
+    usernames = await user_handler.get_usernames_by_uuids(payload.uuids)
+
+    found = {}
+    missing = []
+    for uuid in payload.uuids:
+        username = usernames.get(str(uuid_lib.UUID(uuid)))
+        if username is None:
+            missing.append(uuid)
+        else:
+            found[uuid] = username
+
+    return UsernameBatchResponse(usernames=found, missing=missing)
+
+
 @router.get("/users/{uuid}/", status_code=HTTPStatus.OK)
-def get_user_username(
+async def get_user_username(
     uuid: str,
-    user_handler: UserHandler = Depends(get_user_handler),
+    request: Request,
+    response: Response,
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
 ) -> dict:
-    """Retrieve the username of a user from their uuid."""
-    logging.info("Endpoint called: get_user_username for user %s", uuid)
-    user = user_handler.get_by_uuid(uuid)
+    """Retrieve the username of a user from their uuid.
 
-    if user is None:
+    The response carries an ETag; send it back in `If-None-Match` to get a 304 if the
+    user has not changed since.
+    """
+    logging.info("Endpoint called: get_user_username for user %s", uuid)
+    username_and_version = await user_handler.get_username_and_version(uuid)
+    if username_and_version is None:
         raise UserDoesNotExistError
+    username, version = username_and_version
+
+    etag = make_etag(uuid, version, response_media_type())
+    max_age = get_http_cache_config().http_cache_user_max_age
+    if (unchanged := not_modified(request, etag, max_age)) is not None:
+        return unchanged
 
-    return user.to_username()
+    response.headers.update(cache_headers(etag, max_age))
+    return {"username": username}
+
+
+@router.put("/users/{uuid}/password", status_code=HTTPStatus.NO_CONTENT)
+async def replace_password_hash(
+    uuid: str,
+    payload: UpdatePasswordHashRequest,
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
+) -> Response:
+    """Replace a user's password hash with a new hash of the same password.
+
+    The hash is only replaced if it is still `previous_hashed_password`; if it is
+    not, the password has changed since and the response is a 409.
+    """
+    logging.info("Endpoint called: replace_password_hash for user %s", uuid)
+    if not await user_handler.replace_password_hash(uuid, payload):
+        if await user_handler.get_version_by_uuid(uuid) is None:
+            raise UserDoesNotExistError
+        raise PasswordHashChangedError
+
+    return Response(status_code=HTTPStatus.NO_CONTENT)
+
+
+@router.get("/usernames/{username}/availability", status_code=HTTPStatus.OK)
+async def get_username_availability(
+    username: str,
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
+) -> UsernameAvailability:
+    """Check whether a username is still free, e.g. while a registration form is filled.
+
+    The answer is advisory: a username can be taken between this check and the
+    registration itself.
+    """
+    logging.info("Endpoint called: get_username_availability for %s", username)
+    available = await user_handler.is_username_available(username)
+
+    return UsernameAvailability(username=username, available=available)
 
 
 @router.get("/auth/{username}/", status_code=HTTPStatus.OK)
-def get_user_auth_data(
+async def get_user_auth_data(
     username: str,
-    user_handler: UserHandler = Depends(get_user_handler),
+    request: Request,
+    response: Response,
+    user_handler: AsyncUserHandler | ThreadedUserHandler = Depends(get_user_handler),
 ) -> UserAuthData:
-    """Retrieve the data required to authenticate a user."""
-    logging.info("Endpoint called: get_user_auth_data for user %s", username)
-    user = user_handler.get_by_username(username)
+    """Retrieve the data required to authenticate a user.
 
-    if user is None:
+    The response carries an ETag; send it back in `If-None-Match` to get a 304 if the
+    user has not changed since.
+    """
+    logging.info("Endpoint called: get_user_auth_data for user %s", username)
+    auth_data_and_version = await user_handler.get_auth_data_and_version(username)
+    if auth_data_and_version is None:
         raise UserDoesNotExistError
+    auth_data, version = auth_data_and_version
+
+    etag = make_etag(username, version, response_media_type())
+    max_age = get_http_cache_config().http_cache_auth_max_age
+    if (unchanged := not_modified(request, etag, max_age)) is not None:
+        return unchanged
 
-    return user.to_auth_data()
+    response.headers.update(cache_headers(etag, max_age))
+    return auth_data
@@ -1,11 +1,26 @@
+import json
 import uuid
 from http import HTTPStatus
 
+import pytest
+from common.api.encoding import MSGPACK, decode, encode_msgpack
 from common.api.exceptions import user as ex
-from common.api.schemas.user import CreateUserRequest
+from common.api.exceptions.general import InvalidCursorError
+from common.api.schemas.user import (
+    MAX_USER_PAGE_SIZE,
+    MAX_USERNAME_BATCH_SIZE,
+    MAX_USERNAME_SEARCH_RESULTS,
+    CreateUserRequest,
+    InternalUserIdentity,
+    UpdatePasswordHashRequest,
+    UserAuthData,
+)
 from fastapi.testclient import TestClient
+from sqlalchemy import event, update
 from sqlalchemy.orm import Session
 
+from service.api import router as router_module
+from service.database.models import User
 from service.database.user_handler import UserHandler
 
 
@@ -69,3 +84,296 @@ def test_user_retrieval_fails_if_user_does_not_exist(
 ) -> None:
     response = client.get("/auth/nobody/")
     assert response.status_code == ex.UserDoesNotExistError.status_code
+
+
+def test_password_hashes_are_replaced_unless_the_password_changed(
+    db: Session,
+    client: TestClient,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user = UserHandler(db).create_user(create_user_payload)
+    rehash = UpdatePasswordHashRequest(
+        hashed_password="rehashed",  # noqa: S106
+        previous_hashed_password=create_user_payload.hashed_password,
+    )
+
+    replaced = client.put(f"/users/{user.uuid}/password", json=rehash.model_dump())
+    stale = client.put(f"/users/{user.uuid}/password", json=rehash.model_dump())
+    unknown = client.put(f"/users/{uuid.uuid4()}/password", json=rehash.model_dump())
+
+    assert replaced.status_code == HTTPStatus.NO_CONTENT
+    assert not replaced.content
+    assert stale.status_code == ex.PasswordHashChangedError.status_code
+    assert unknown.status_code == ex.UserDoesNotExistError.status_code
+    auth_data = client.get(f"/auth/{user.username}/").json()
+    assert auth_data["hashed_password"] == "rehashed"  # noqa: S105
+
+
+def test_usernames_are_resolved_in_a_single_batch_request(
+    db: Session,
+    client: TestClient,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = UserHandler(db)
+    user = user_handler.create_user(create_user_payload)
+    user_uuid = str(user.uuid).upper()
+    unknown_uuid = str(uuid.uuid4())
+
+    response = client.post(
+        "/users/usernames",
+        json={"uuids": [user_uuid, unknown_uuid]},
+    )
+    data = response.json()
+
+    assert response.status_code == HTTPStatus.OK
+    assert data["usernames"] == {user_uuid: create_user_payload.username}
+    assert data["missing"] == [unknown_uuid]
+
+
+def test_username_batch_request_rejects_invalid_or_oversized_batches(
+    client: TestClient,
+) -> None:
+    oversized = [str(uuid.uuid4()) for _ in range(MAX_USERNAME_BATCH_SIZE + 1)]
+
+    assert client.post("/users/usernames", json={"uuids": []}).status_code == (
+        HTTPStatus.UNPROCESSABLE_ENTITY
+    )
+    assert client.post("/users/usernames", json={"uuids": ["nope"]}).status_code == (
+        HTTPStatus.UNPROCESSABLE_ENTITY
+    )
+    assert client.post("/users/usernames", json={"uuids": oversized}).status_code == (
+        HTTPStatus.UNPROCESSABLE_ENTITY
+    )
+
+
+def _create_users(db: Session, count: int) -> list[str]:
+    # Users created in one transaction share a created_at, so pages must be ordered
+    # by uuid within it.
+    users = [
+        User(username=f"user{i}", hashed_password="hash")  # noqa: S106
+        for i in range(count)
+    ]
+    db.add_all(users)
+    db.commit()
+    return sorted(str(user.uuid) for user in users)
+
+
+def test_users_are_listed_page_by_page(db: Session, client: TestClient) -> None:
+    uuids = _create_users(db, 5)
+
+    listed = []
+    cursor = None
+    pages = 0
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        response = client.get("/users", params=params)
+        assert response.status_code == HTTPStatus.OK
+        page = response.json()
+        listed.extend(user["uuid"] for user in page["users"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert listed == uuids
+    assert pages == 3  # noqa: PLR2004
+
+
+def test_user_listing_rejects_invalid_cursors_and_limits(client: TestClient) -> None:
+    assert client.get("/users", params={"cursor": "nope"}).status_code == (
+        InvalidCursorError.status_code
+    )
+    assert client.get("/users", params={"limit": 0}).status_code == (
+        HTTPStatus.UNPROCESSABLE_ENTITY
+    )
+    assert client.get(
+        "/users",
+        params={"limit": MAX_USER_PAGE_SIZE + 1},
+    ).status_code == (HTTPStatus.UNPROCESSABLE_ENTITY)
+
+
+def test_users_are_exported_as_ndjson(
+    db: Session,
+    client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(router_module, "EXPORT_BATCH_SIZE", 2)
+    uuids = _create_users(db, 5)
+
+    response = client.get("/users/export")
+    lines = response.text.splitlines()
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["uuid"] for line in lines] == uuids
+
+
+def test_user_changes_are_listed_page_by_page(db: Session, client: TestClient) -> None:
+    uuids = _create_users(db, 3)
+
+    first = client.get("/users/changes", params={"limit": 2}).json()
+    second = client.get(
+        "/users/changes",
+        params={"limit": 2, "since": first["next_cursor"]},
+    ).json()
+    db.execute(update(User).where(User.username == "user0").values(username="renamed"))
+    db.commit()
+    renamed = client.get("/users/changes", params={"since": second["next_cursor"]})
+
+    assert first["has_more"]
+    assert not second["has_more"]
+    listed = [change["uuid"] for change in first["changes"] + second["changes"]]
+    assert sorted(listed) == uuids
+    assert [change["username"] for change in renamed.json()["changes"]] == ["renamed"]
+
+
+def test_user_changes_are_streamed_as_ndjson(
+    db: Session,
+    client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(router_module, "EXPORT_BATCH_SIZE", 2)
+    uuids = _create_users(db, 5)
+
+    response = client.get("/users/changes/stream")
+    *changes, last = (json.loads(line) for line in response.text.splitlines())
+    caught_up = client.get("/users/changes", params={"since": last["next_cursor"]})
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert sorted(change["uuid"] for change in changes) == uuids
+    assert caught_up.json()["changes"] == []
+
+
+def test_user_changes_reject_invalid_cursors(client: TestClient) -> None:
+    # A cursor with a position in a second shard, which this database does not have.
+    sharded = "W251bGwsbnVsbF0"
+
+    for path in ("/users/changes", "/users/changes/stream"):
+        for since in ("nope", sharded):
+            response = client.get(path, params={"since": since})
+            assert response.status_code == InvalidCursorError.status_code
+
+
+def test_username_availability_is_reported(
+    db: Session,
+    client: TestClient,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    UserHandler(db).create_user(create_user_payload)
+
+    taken = client.get(f"/usernames/{create_user_payload.username}/availability")
+    free = client.get("/usernames/nobody/availability")
+
+    assert taken.status_code == HTTPStatus.OK
+    assert taken.json() == {
+        "username": create_user_payload.username,
+        "available": False,
+    }
+    assert free.json() == {"username": "nobody", "available": True}
+
+
+def test_usernames_are_suggested_by_prefix(db: Session, client: TestClient) -> None:
+    handler = UserHandler(db)
+    for username in ("alice", "alina", "bob"):
+        handler.create_user(
+            CreateUserRequest(username=username, hashed_password="hash"),  # noqa: S106
+        )
+
+    response = client.get("/users/search", params={"prefix": "al"})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"prefix": "al", "usernames": ["alice", "alina"]}
+
+
+def test_username_search_rejects_empty_prefixes_and_oversized_limits(
+    client: TestClient,
+) -> None:
+    assert client.get("/users/search", params={"prefix": ""}).status_code == (
+        HTTPStatus.UNPROCESSABLE_ENTITY
+    )
+    assert client.get(
+        "/users/search",
+        params={"prefix": "al", "limit": MAX_USERNAME_SEARCH_RESULTS + 1},
+    ).status_code == (HTTPStatus.UNPROCESSABLE_ENTITY)
+
+
+@pytest.mark.parametrize("path", ["/users/{uuid}/", "/auth/{username}/"])
+def test_user_lookups_are_revalidated_with_etags(
+    db: Session,
+    client: TestClient,
+    create_user_payload: CreateUserRequest,
+    path: str,
+) -> None:
+    user = UserHandler(db).create_user(create_user_payload)
+    url = path.format(uuid=user.uuid, username=user.username)
+
+    first = client.get(url)
+    etag = first.headers["etag"]
+    revalidated = client.get(url, headers={"If-None-Match": etag})
+    db.execute(update(User).values(hashed_password="new hash"))  # noqa: S106
+    changed = client.get(url, headers={"If-None-Match": etag})
+
+    assert first.status_code == HTTPStatus.OK
+    assert "max-age=" in first.headers["cache-control"]
+    assert revalidated.status_code == HTTPStatus.NOT_MODIFIED
+    assert revalidated.headers["etag"] == etag
+    assert not revalidated.content
+    assert changed.status_code == HTTPStatus.OK
+    assert changed.headers["etag"] != etag
+
+
+@pytest.mark.parametrize("path", ["/users/{uuid}/", "/auth/{username}/"])
+def test_user_lookups_read_the_body_and_its_etag_in_one_statement(
+    db: Session,
+    client: TestClient,
+    create_user_payload: CreateUserRequest,
+    path: str,
+) -> None:
+    user = UserHandler(db).create_user(create_user_payload)
+    url = path.format(uuid=user.uuid, username=user.username)
+    statements = []
+    event.listen(
+        db.get_bind(),
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+
+    response = client.get(url)
+
+    assert response.status_code == HTTPStatus.OK
+    assert len(statements) == 1
+    assert client.get(url).headers["etag"] == response.headers["etag"]
+
+
+def test_internal_callers_can_exchange_msgpack(
+    client: TestClient,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    msgpack_headers = {"Content-Type": MSGPACK, "Accept": MSGPACK}
+
+    created = client.post(
+        "/users",
+        content=encode_msgpack(create_user_payload),
+        headers=msgpack_headers,
+    )
+    auth_data = client.get(
+        f"/auth/{create_user_payload.username}/",
+        headers=msgpack_headers,
+    )
+    revalidated = client.get(
+        f"/auth/{create_user_payload.username}/",
+        headers={**msgpack_headers, "If-None-Match": auth_data.headers["etag"]},
+    )
+    as_json = client.get(
+        f"/auth/{create_user_payload.username}/",
+        headers={"If-None-Match": auth_data.headers["etag"]},
+    )
+
+    identity = decode(created.content, MSGPACK, InternalUserIdentity)
+    assert created.status_code == HTTPStatus.CREATED
+    assert auth_data.headers["content-type"] == MSGPACK
+    assert decode(auth_data.content, MSGPACK, UserAuthData).uuid == identity.uuid
+    assert revalidated.status_code == HTTPStatus.NOT_MODIFIED
+    # The JSON representation has its own ETag.
+    assert as_json.status_code == HTTPStatus.OK
+    assert as_json.json()["uuid"] == identity.uuid
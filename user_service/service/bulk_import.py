@@ -0,0 +1,425 @@
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import logging
+import sys
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from dataclasses import dataclass, field
+from typing import Any, TextIO
+
+from common.api.schemas.user import CreateUserRequest
+from common.service_logging import configure_logging
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from sqlalchemy import Engine, create_engine
+
+from service.config import get_database_config
+from service.database.models import User, UserShard, new_user_key
+from service.database.sharding import shard_of
+
+DEFAULT_BATCH_SIZE = 10_000
+
+_STAGING_TABLE = "user_import"
+
+# Rows are numbered by their position in the input, so conflicts can be reported
+# against the line they came from. Their UUIDs are generated by `new_user_key`, like
+# those of registered users.
+_CREATE_STAGING_TABLE = f"""
+    CREATE TEMPORARY TABLE IF NOT EXISTS {_STAGING_TABLE} (
+        line bigint NOT NULL,
+        uuid uuid NOT NULL,
+        username text NOT NULL,
+        hashed_password text NOT NULL
+    ) ON COMMIT DELETE ROWS
+"""
+
+_COPY_TO_STAGING = f"""
+    COPY {_STAGING_TABLE} (line, uuid, username, hashed_password) FROM STDIN
+    WITH (FORMAT csv)
+"""
+
+# Inserts the first row for each username in the batch, and returns every staged row
+# that was not inserted: usernames already taken, and repeats within the input.
+_MERGE_STAGING = f"""
+    WITH first AS (
+        SELECT DISTINCT ON (username) line, uuid, username, hashed_password
+        FROM {_STAGING_TABLE}
+        ORDER BY username, line
+    ), inserted AS (
+        INSERT INTO {User.__tablename__} (uuid, username, hashed_password)
+        SELECT uuid, username, hashed_password FROM first
+        ON CONFLICT (username) DO NOTHING
+        RETURNING username
+    )
+    SELECT staged.line, staged.username
+    FROM {_STAGING_TABLE} AS staged
+    LEFT JOIN first ON first.line = staged.line
+    LEFT JOIN inserted ON inserted.username = first.username
+    WHERE inserted.username IS NULL
+    ORDER BY staged.line
+"""  # noqa: S608
+
+# When users are sharded, each batch first reserves its usernames in the directory,
+# the same way, and only the users whose usernames it reserved are merged into the
+# shards their UUIDs hash to.
+_DIRECTORY_STAGING_TABLE = "user_shard_import"
+
+_CREATE_DIRECTORY_STAGING_TABLE = f"""
+    CREATE TEMPORARY TABLE IF NOT EXISTS {_DIRECTORY_STAGING_TABLE} (
+        line bigint NOT NULL,
+        uuid uuid NOT NULL,
+        username text NOT NULL,
+        shard smallint NOT NULL
+    ) ON COMMIT DELETE ROWS
+"""
+
+_COPY_TO_DIRECTORY_STAGING = f"""
+    COPY {_DIRECTORY_STAGING_TABLE} (line, uuid, username, shard) FROM STDIN
+    WITH (FORMAT csv)
+"""
+
+_RESERVE_STAGED_USERNAMES = f"""
+    WITH first AS (
+        SELECT DISTINCT ON (username) line, uuid, username, shard
+        FROM {_DIRECTORY_STAGING_TABLE}
+        ORDER BY username, line
+    ), reserved AS (
+        INSERT INTO {UserShard.__tablename__} (username, uuid, shard)
+        SELECT username, uuid, shard FROM first
+        ON CONFLICT (username) DO NOTHING
+        RETURNING username
+    )
+    SELECT staged.line, staged.username
+    FROM {_DIRECTORY_STAGING_TABLE} AS staged
+    LEFT JOIN first ON first.line = staged.line
+    LEFT JOIN reserved ON reserved.username = first.username
+    WHERE reserved.username IS NULL
+    ORDER BY staged.line
+"""  # noqa: S608
+
+# A username can be taken on a shard without being in the directory, by a user that
+# `rebalance` has not added to it yet. Its reservation is released again.
+_RELEASE_USERNAMES = f"""
+    DELETE FROM {UserShard.__tablename__} WHERE uuid = ANY(%s::uuid[])
+"""  # noqa: S608
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    inserted: int = 0
+    conflicts: int = 0
+    invalid: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+
+@dataclass(frozen=True)
+class StagedUser:
+    line: int
+    user: CreateUserRequest
+
+
+@dataclass(frozen=True)
+class KeyedUser:
+    line: int
+    uuid: str
+    username: str
+    hashed_password: str
+
+
+def _ndjson_rows(stream: TextIO) -> Iterator[tuple[int, str]]:
+    for line, text in enumerate(stream, start=1):
+        if text.strip():
+            yield line, text
+
+
+def _csv_rows(stream: TextIO) -> Iterator[tuple[int, dict]]:
+    # Line 1 is the header.
+    yield from enumerate(csv.DictReader(stream), start=2)
+
+
+def read_users(
+    stream: TextIO,
+    input_format: str,
+    report: ImportReport | None = None,
+) -> Iterator[StagedUser]:
+    """Lazily parse `CreateUserRequest` rows from NDJSON, or CSV with a header.
+
+    Rows that fail validation are logged, counted in `report`, and skipped.
+    """
+    if input_format == "ndjson":
+        rows, validate = _ndjson_rows(stream), CreateUserRequest.model_validate_json
+    else:
+        rows, validate = _csv_rows(stream), CreateUserRequest.model_validate
+
+    for line, row in rows:
+        try:
+            yield StagedUser(line, validate(row))
+        except ValidationError:
+            logging.warning("Skipping invalid row on line %s", line, exc_info=True)
+            if report is not None:
+                report.invalid += 1
+
+
+def _batches(users: Iterable[StagedUser], size: int) -> Iterator[list[StagedUser]]:
+    users = iter(users)
+    while batch := list(itertools.islice(users, size)):
+        yield batch
+
+
+def _with_keys(batch: list[StagedUser]) -> list[KeyedUser]:
+    return [
+        KeyedUser(
+            staged.line,
+            str(new_user_key()),
+            staged.user.username,
+            staged.user.hashed_password,
+        )
+        for staged in batch
+    ]
+
+
+def _to_csv(rows: Iterable[tuple]) -> io.StringIO:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    return buffer
+
+
+def _merge_users(
+    cursor: Any,  # noqa: ANN401
+    users: list[KeyedUser],
+) -> list[tuple[int, str]]:
+    cursor.copy_expert(
+        _COPY_TO_STAGING,
+        _to_csv((u.line, u.uuid, u.username, u.hashed_password) for u in users),
+    )
+    cursor.execute(_MERGE_STAGING)
+    return cursor.fetchall()
+
+
+def _record_batch(
+    report: ImportReport,
+    rows: int,
+    conflicts: list[tuple[int, str]],
+    on_conflict: Callable[[int, str], None] | None,
+) -> None:
+    report.rows += rows
+    report.conflicts += len(conflicts)
+    report.inserted += rows - len(conflicts)
+    if on_conflict is not None:
+        for line, username in conflicts:
+            on_conflict(line, username)
+
+    logging.info(
+        "Imported %s rows (%s inserted, %s conflicts) at %.0f rows/s",
+        report.rows,
+        report.inserted,
+        report.conflicts,
+        report.rows_per_second,
+    )
+
+
+def import_users(
+    engine: Engine,
+    users: Iterable[StagedUser],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_conflict: Callable[[int, str], None] | None = None,
+    report: ImportReport | None = None,
+) -> ImportReport:
+    """Load users into the users table with `COPY`, one batch per transaction.
+
+    Each batch is copied into a temporary staging table and merged into the users
+    table with `ON CONFLICT DO NOTHING`, so only one batch is ever held in memory.
+    `on_conflict` is called with the line and username of every row that was not
+    inserted because the username is taken, either already or earlier in the input.
+    """
+    report = report or ImportReport()
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(_CREATE_STAGING_TABLE)
+            connection.commit()
+
+            for batch in _batches(users, batch_size):
+                conflicts = _merge_users(cursor, _with_keys(batch))
+                connection.commit()
+                _record_batch(report, len(batch), conflicts, on_conflict)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    return report
+
+
+def import_sharded_users(  # noqa: PLR0913
+    directory: Engine,
+    shards: Sequence[Engine],
+    users: Iterable[StagedUser],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_conflict: Callable[[int, str], None] | None = None,
+    report: ImportReport | None = None,
+) -> ImportReport:
+    """Load users into sharded users tables, like `import_users`.
+
+    Each batch reserves its usernames in the directory, which is what keeps them
+    unique across shards, and the users it reserved are then merged into the shard
+    that `shard_of` their UUID picks. The reservations are only committed once every
+    shard has committed its users, so a failed batch leaves no username reserved
+    without a user. Its users already committed to other shards are added to the
+    directory by the next `rebalance`.
+    """
+    report = report or ImportReport()
+    with contextlib.ExitStack() as stack:
+        connections = [
+            stack.enter_context(contextlib.closing(engine.raw_connection()))
+            for engine in (directory, *shards)
+        ]
+        try:
+            cursors = [
+                stack.enter_context(connection.cursor()) for connection in connections
+            ]
+            directory_cursor, *shard_cursors = cursors
+            directory_cursor.execute(_CREATE_DIRECTORY_STAGING_TABLE)
+            for cursor in shard_cursors:
+                cursor.execute(_CREATE_STAGING_TABLE)
+            for connection in connections:
+                connection.commit()
+
+            for batch in _batches(users, batch_size):
+                keyed = _with_keys(batch)
+                placed = {u.uuid: shard_of(u.uuid, len(shards)) for u in keyed}
+                directory_cursor.copy_expert(
+                    _COPY_TO_DIRECTORY_STAGING,
+                    _to_csv(
+                        (u.line, u.uuid, u.username, placed[u.uuid]) for u in keyed
+                    ),
+                )
+                directory_cursor.execute(_RESERVE_STAGED_USERNAMES)
+                conflicts = directory_cursor.fetchall()
+
+                not_reserved = {line for line, _ in conflicts}
+                by_shard = defaultdict(list)
+                for user in keyed:
+                    if user.line not in not_reserved:
+                        by_shard[placed[user.uuid]].append(user)
+
+                taken = []
+                for shard, shard_users in by_shard.items():
+                    taken += _merge_users(shard_cursors[shard], shard_users)
+                    connections[1 + shard].commit()
+                if taken:
+                    lines = {line for line, _ in taken}
+                    directory_cursor.execute(
+                        _RELEASE_USERNAMES,
+                        ([u.uuid for u in keyed if u.line in lines],),
+                    )
+                connections[0].commit()
+
+                conflicts = sorted(conflicts + taken)
+                _record_batch(report, len(batch), conflicts, on_conflict)
+        except Exception:
+            for connection in connections:
+                connection.rollback()
+            raise
+
+    return report
+
+
+def _parse_args(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Bulk import pre-hashed users from NDJSON or CSV.",
+    )
+    parser.add_argument(
+        "path",
+        help="file to import, or - to read from stdin",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("ndjson", "csv"),
+        help="input format; inferred from the file extension by default",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="rows to load per transaction",
+    )
+    parser.add_argument(
+        "--conflicts",
+        help="write the line and username of every conflicting row to this CSV file",
+    )
+    return parser.parse_args(argv)
+
+
+def _input_format(args: argparse.Namespace) -> str:
+    if args.format is not None:
+        return args.format
+    return "csv" if args.path.endswith(".csv") else "ndjson"
+
+
+def main(argv: list[str] | None = None) -> None:
+    load_dotenv()
+    configure_logging()
+    args = _parse_args(argv)
+
+    with contextlib.ExitStack() as stack:
+        stream = sys.stdin
+        if args.path != "-":
+            stream = stack.enter_context(open(args.path, newline=""))
+
+        on_conflict = None
+        if args.conflicts:
+            conflicts = stack.enter_context(
+                open(args.conflicts, "w", newline=""),
+            )
+            writer = csv.writer(conflicts)
+            writer.writerow(("line", "username"))
+
+            def on_conflict(line: int, username: str) -> None:
+                writer.writerow((line, username))
+
+        config = get_database_config()
+        engine = create_engine(config.url)
+        stack.callback(engine.dispose)
+        shards = [create_engine(url) for url in config.db_shard_urls]
+        for shard in shards:
+            stack.callback(shard.dispose)
+
+        report = ImportReport()
+        users = read_users(stream, _input_format(args), report)
+        if shards:
+            import_sharded_users(
+                engine,
+                shards,
+                users,
+                args.batch_size,
+                on_conflict,
+                report,
+            )
+        else:
+            import_users(engine, users, args.batch_size, on_conflict, report)
+
+    logging.info(
+        "Import finished: %s rows, %s inserted, %s conflicts, %s invalid, %.0f rows/s",
+        report.rows,
+        report.inserted,
+        report.conflicts,
+        report.invalid,
+        report.rows_per_second,
+    )
+
+
+if __name__ == "__main__":
+    main()
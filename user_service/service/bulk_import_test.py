@@ -0,0 +1,165 @@
+import io
+from collections.abc import Generator
+
+import pytest
+from sqlalchemy import Engine, create_engine, func, select
+from sqlalchemy.orm import Session
+
+from service.bulk_import import (
+    ImportReport,
+    import_sharded_users,
+    import_users,
+    read_users,
+)
+from service.database.models import User, UserShard
+from service.database.session import Base, DirectoryBase
+from service.database.sharding import shard_of
+
+NDJSON = """\
+{"username": "alice", "hashed_password": "hash-a"}
+{"username": "bob", "hashed_password": "hash-b"}
+
+{"username": "alice", "hashed_password": "hash-a2"}
+{"username": "carol"}
+not json
+{"username": "dave", "hashed_password": "hash-d"}
+"""
+
+CSV = """\
+username,hashed_password
+alice,"hash,with,commas"
+bob,hash-b
+"""
+
+
+def test_ndjson_rows_are_validated_and_numbered() -> None:
+    report = ImportReport()
+
+    users = list(read_users(io.StringIO(NDJSON), "ndjson", report))
+
+    assert [(u.line, u.user.username) for u in users] == [
+        (1, "alice"),
+        (2, "bob"),
+        (4, "alice"),
+        (7, "dave"),
+    ]
+    assert report.invalid == 2  # noqa: PLR2004
+
+
+def test_csv_rows_are_numbered_after_the_header() -> None:
+    users = list(read_users(io.StringIO(CSV), "csv"))
+
+    assert [(u.line, u.user.username) for u in users] == [(2, "alice"), (3, "bob")]
+    assert users[0].user.hashed_password == "hash,with,commas"  # noqa: S105
+
+
+def test_import_inserts_users_and_reports_conflicts(db: Session) -> None:
+    db.add(User(username="bob", hashed_password="existing"))  # noqa: S106
+    db.commit()
+    conflicts = []
+
+    report = import_users(
+        db.get_bind(),
+        read_users(io.StringIO(NDJSON), "ndjson"),
+        batch_size=2,
+        on_conflict=lambda line, username: conflicts.append((line, username)),
+    )
+
+    assert report.rows == 4  # noqa: PLR2004
+    assert report.inserted == 2  # noqa: PLR2004
+    assert report.conflicts == 2  # noqa: PLR2004
+    assert conflicts == [(2, "bob"), (4, "alice")]
+
+    users = dict(db.execute(select(User.username, User.hashed_password)).all())
+    assert users == {"alice": "hash-a", "bob": "existing", "dave": "hash-d"}
+
+
+def test_import_deduplicates_usernames_within_a_batch(db: Session) -> None:
+    conflicts = []
+
+    report = import_users(
+        db.get_bind(),
+        read_users(io.StringIO(NDJSON), "ndjson"),
+        on_conflict=lambda line, username: conflicts.append((line, username)),
+    )
+
+    assert report.inserted == 3  # noqa: PLR2004
+    assert conflicts == [(4, "alice")]
+    assert db.scalar(select(func.count()).select_from(User)) == 3  # noqa: PLR2004
+
+
+@pytest.fixture
+def engines(shard_urls: list[str]) -> Generator[list[Engine], None, None]:
+    engines = [create_engine(url) for url in shard_urls]
+    DirectoryBase.metadata.create_all(engines[0])
+    for engine in engines:
+        Base.metadata.create_all(engine)
+    yield engines
+    for engine in engines:
+        engine.dispose()
+
+
+def test_sharded_import_places_users_on_their_shards(engines: list[Engine]) -> None:
+    directory, shards = engines[0], engines
+    with directory.begin() as connection:
+        connection.execute(
+            UserShard.__table__.insert(),
+            {
+                "username": "bob",
+                "uuid": "00000000-0000-0000-0000-000000000001",
+                "shard": 0,
+            },
+        )
+    conflicts = []
+
+    report = import_sharded_users(
+        directory,
+        shards,
+        read_users(io.StringIO(NDJSON), "ndjson"),
+        batch_size=2,
+        on_conflict=lambda line, username: conflicts.append((line, username)),
+    )
+
+    assert report.inserted == 2  # noqa: PLR2004
+    assert conflicts == [(2, "bob"), (4, "alice")]
+
+    with directory.connect() as connection:
+        entries = connection.execute(
+            select(UserShard.username, UserShard.uuid, UserShard.shard),
+        ).all()
+    assert {entry.username for entry in entries} == {"alice", "bob", "dave"}
+    for entry in entries:
+        if entry.username == "bob":
+            continue
+        assert entry.shard == shard_of(entry.uuid, len(shards))
+        with shards[entry.shard].connect() as connection:
+            user = connection.execute(
+                select(User.username).where(User.uuid == entry.uuid),
+            ).scalar()
+        assert user == entry.username
+
+
+def test_sharded_import_releases_usernames_taken_on_a_shard(
+    engines: list[Engine],
+) -> None:
+    directory, shards = engines[0], engines
+    # On a shard, but not yet added to the directory by a rebalance.
+    for shard in shards:
+        with Session(shard) as session, session.begin():
+            session.add(
+                User(username="alice", hashed_password="existing"),  # noqa: S106
+            )
+    conflicts = []
+
+    report = import_sharded_users(
+        directory,
+        shards,
+        read_users(io.StringIO(NDJSON), "ndjson"),
+        on_conflict=lambda line, username: conflicts.append((line, username)),
+    )
+
+    assert report.inserted == 2  # noqa: PLR2004
+    assert conflicts == [(1, "alice"), (4, "alice")]
+    with directory.connect() as connection:
+        usernames = set(connection.execute(select(UserShard.username)).scalars())
+    assert usernames == {"bob", "dave"}
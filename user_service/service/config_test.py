@@ -0,0 +1,79 @@
+import pytest
+
+from service.config import (
+    DatabaseConfig,
+    get_database_config,
+    get_http_cache_config,
+    get_user_key_config,
+)
+
+
+def test_database_config_is_read_from_environment(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("DB_HOST", "db.internal")
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "false")
+
+    config = get_database_config()
+
+    assert isinstance(config, DatabaseConfig)
+    assert config.db_host == "db.internal"
+    assert config.db_pool_size == 20  # noqa: PLR2004
+    assert config.db_pool_pre_ping is False
+    assert "@db.internal:" in config.url
+
+
+def test_exception_raised_when_pool_size_is_not_positive(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("DB_POOL_SIZE", "0")
+
+    with pytest.raises(ValueError):
+        get_database_config()
+
+
+def test_exception_raised_when_max_overflow_is_negative(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "-1")
+
+    with pytest.raises(ValueError):
+        get_database_config()
+
+
+def test_exception_raised_when_explain_sample_rate_is_not_a_fraction(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("DB_SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "1.5")
+
+    with pytest.raises(ValueError):
+        get_database_config()
+
+
+def test_exception_raised_when_shards_are_used_with_asyncpg(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("DB_ASYNC", "true")
+    monkeypatch.setenv("DB_SHARD_URLS", '["postgresql://shard-0/users"]')
+
+    with pytest.raises(ValueError):
+        get_database_config()
+
+
+def test_exception_raised_when_user_key_version_is_unsupported(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("USER_KEY_VERSION", "1")
+
+    with pytest.raises(ValueError):
+        get_user_key_config()
+
+
+def test_exception_raised_when_http_cache_max_age_is_negative(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("HTTP_CACHE_AUTH_MAX_AGE", "-1")
+
+    with pytest.raises(ValueError):
+        get_http_cache_config()
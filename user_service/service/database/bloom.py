@@ -0,0 +1,258 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import math
+import threading
+from collections.abc import Callable, Iterable, Iterator
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Engine, Select, select
+
+from service.config import UsernameFilterConfig, get_username_filter_config
+from service.database.cache import MISSING
+from service.database.models import User, UserShard
+from service.database.session import (
+    AsyncSQLAlchemyConnector,
+    Connector,
+    ShardedConnector,
+)
+
+# Usernames fetched per round trip while the filter is being built.
+_BUILD_BATCH_SIZE = 10_000
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter of strings.
+
+    Sized for `capacity` items at the given false-positive rate, unless that would
+    exceed `max_bytes`, in which case the filter is capped and the rate degrades.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        error_rate: float,
+        max_bytes: int | None = None,
+    ) -> None:
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        if max_bytes is not None:
+            bits = min(bits, max_bytes * 8)
+        self.size = max(bits, 8)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self._bits = bytearray(math.ceil(self.size / 8))
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    @property
+    def expected_error_rate(self) -> float:
+        """The false-positive rate once `capacity` items have been added."""
+        return (1 - math.exp(-self.hashes * self.capacity / self.size)) ** self.hashes
+
+    def _positions(self, item: str) -> list[int]:
+        # Double hashing: k positions from the two halves of a single digest.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        self.update((item,))
+
+    def update(self, items: Iterable[str]) -> None:
+        positions = [self._positions(item) for item in items]
+        with self._lock:
+            for item_positions in positions:
+                for position in item_positions:
+                    self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += len(positions)
+
+    def __contains__(self, item: str) -> bool:
+        """Return `False` if `item` was definitely never added."""
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+class UsernameFilter:
+    """A Bloom filter of every existing username, used to reject unknown ones.
+
+    Until the filter has been built from the users table (and again whenever it may
+    have missed a username), `might_exist` answers `True` for everything so that
+    lookups fall through to the database.
+    """
+
+    def __init__(self, config: UsernameFilterConfig | None = None) -> None:
+        self.config = config or UsernameFilterConfig()
+        self._filter: BloomFilter | None = None
+        self._building: BloomFilter | None = None
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def might_exist(self, username: str) -> bool:
+        bloom = self._filter
+        return bloom is None or username in bloom
+
+    def add(self, username: str) -> None:
+        with self._lock:
+            for bloom in (self._filter, self._building):
+                if bloom is not None:
+                    bloom.add(username)
+
+    def invalidate(self) -> None:
+        """Stop trusting the filter, e.g. after user change notifications were lost."""
+        logging.info("Username filter invalidated")
+        with self._lock:
+            self._filter = None
+            self._invalidations += 1
+
+    @contextlib.contextmanager
+    def rebuilding(self) -> Iterator[BloomFilter]:
+        """Build a new filter, which replaces the current one once the block exits.
+
+        Usernames added while the filter is being built are added to both filters, so
+        none are lost in the swap. If the filter is invalidated in the meantime, the
+        new one is discarded.
+        """
+        bloom = BloomFilter(
+            self.config.username_filter_capacity,
+            self.config.username_filter_error_rate,
+            self.config.username_filter_max_bytes,
+        )
+        with self._lock:
+            self._building = bloom
+            invalidations = self._invalidations
+        try:
+            yield bloom
+        finally:
+            with self._lock:
+                self._building = None
+
+        with self._lock:
+            if self._invalidations != invalidations:
+                logging.warning("Username filter invalidated while being built")
+                return
+            self._filter = bloom
+        if bloom.count > bloom.capacity:
+            logging.warning(
+                "Username filter holds %s usernames but is sized for %s; "
+                "raise USERNAME_FILTER_CAPACITY",
+                bloom.count,
+                bloom.capacity,
+            )
+        logging.info(
+            "Username filter built: %s usernames, %s bytes, %s hashes, "
+            "expected false-positive rate %.4f",
+            bloom.count,
+            bloom.nbytes,
+            bloom.hashes,
+            bloom.expected_error_rate,
+        )
+
+
+def _build_from_database(
+    username_filter: UsernameFilter,
+    engine: Engine,
+    usernames: Select,
+) -> None:
+    # The filter starts taking added usernames before the query's snapshot is taken,
+    # so users created after the snapshot are added to it, not only to the old one.
+    with username_filter.rebuilding() as bloom, engine.connect() as connection:
+        result = connection.execution_options(yield_per=_BUILD_BATCH_SIZE).execute(
+            usernames,
+        )
+        for partition in result.scalars().partitions():
+            bloom.update(partition)
+
+
+async def _build_from_database_async(
+    username_filter: UsernameFilter,
+    connector: AsyncSQLAlchemyConnector,
+) -> None:
+    with username_filter.rebuilding() as bloom:
+        async with connector.engine.connect() as connection:
+            result = await connection.stream(
+                select(User.username).execution_options(yield_per=_BUILD_BATCH_SIZE),
+            )
+            # Hashing a whole partition would hold up the event loop.
+            async for partition in result.scalars().partitions():
+                await run_in_threadpool(bloom.update, partition)
+
+
+async def build_username_filter(
+    username_filter: UsernameFilter,
+    connector: Connector,
+) -> None:
+    """Build the filter by streaming every username from the primary.
+
+    When users are sharded, the usernames are streamed from the directory instead,
+    which holds all of them.
+    """
+    logging.info("Building username filter")
+    if isinstance(connector, AsyncSQLAlchemyConnector):
+        await _build_from_database_async(username_filter, connector)
+    elif isinstance(connector, ShardedConnector):
+        await run_in_threadpool(
+            _build_from_database,
+            username_filter,
+            connector.directory,
+            select(UserShard.username),
+        )
+    else:
+        await run_in_threadpool(
+            _build_from_database,
+            username_filter,
+            connector.engine,
+            select(User.username),
+        )
+
+
+async def maintain_username_filter(
+    username_filter: UsernameFilter,
+    connector: Connector,
+    can_build: Callable[[], bool] = lambda: True,
+    interval: float = 1,
+) -> None:
+    """Keep the filter built, rebuilding it whenever it has been invalidated.
+
+    `can_build` gates (re)builds until the filter can also be kept up to date, i.e.
+    until changes made by other workers are being received.
+    """
+    while True:
+        if not username_filter.ready and can_build():
+            try:
+                await build_username_filter(username_filter, connector)
+                continue
+            except Exception:
+                logging.exception("Could not build the username filter")
+        await asyncio.sleep(interval)
+
+
+_username_filter: UsernameFilter | None | object = MISSING
+_username_filter_lock = threading.Lock()
+
+
+def _create_username_filter() -> UsernameFilter | None:
+    config = get_username_filter_config()
+    return UsernameFilter(config) if config.username_filter_enabled else None
+
+
+def get_username_filter() -> UsernameFilter | None:
+    """Return the process-wide username filter, or `None` if it is disabled."""
+    global _username_filter  # noqa: PLW0603
+
+    if _username_filter is MISSING:
+        with _username_filter_lock:
+            if _username_filter is MISSING:
+                _username_filter = _create_username_filter()
+    return _username_filter
@@ -0,0 +1,170 @@
+from typing import Any
+
+import pytest
+from common.api.schemas.user import CreateUserRequest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from service.config import UsernameFilterConfig
+from service.database.bloom import BloomFilter, UsernameFilter, build_username_filter
+from service.database.notifications import apply_user_change
+from service.database.session import AsyncSQLAlchemyConnector, SQLAlchemyConnector
+from service.database.user_handler import UserHandler
+
+
+def _url(postgresql: Any, driver: str = "postgresql") -> str:  # noqa: ANN401
+    info = postgresql.info
+    return f"{driver}://{info.user}@{info.host}:{info.port}/{info.dbname}"
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives() -> None:
+    bloom = BloomFilter(capacity=10_000, error_rate=0.01)
+    members = [f"user{i}" for i in range(10_000)]
+    bloom.update(members)
+
+    false_positives = sum(f"other{i}" in bloom for i in range(10_000))
+
+    assert all(member in bloom for member in members)
+    assert false_positives < 200  # noqa: PLR2004
+    assert bloom.expected_error_rate == pytest.approx(0.01, rel=0.1)
+
+
+def test_bloom_filter_size_is_capped_by_the_memory_budget() -> None:
+    bloom = BloomFilter(capacity=1_000_000, error_rate=0.01, max_bytes=1024)
+
+    assert bloom.nbytes == 1024  # noqa: PLR2004
+    assert bloom.expected_error_rate > 0.01  # noqa: PLR2004
+
+
+def test_username_filter_only_rejects_once_built() -> None:
+    username_filter = UsernameFilter(UsernameFilterConfig(username_filter_capacity=100))
+
+    assert username_filter.might_exist("nobody")
+
+    with username_filter.rebuilding() as bloom:
+        bloom.add("alice")
+        username_filter.add("bob")
+
+    assert username_filter.ready
+    assert username_filter.might_exist("alice")
+    assert username_filter.might_exist("bob")
+    assert not username_filter.might_exist("nobody")
+
+
+def test_username_filter_invalidated_while_building_is_discarded() -> None:
+    username_filter = UsernameFilter(UsernameFilterConfig(username_filter_capacity=100))
+
+    with username_filter.rebuilding():
+        username_filter.invalidate()
+
+    assert not username_filter.ready
+
+
+def test_user_change_notifications_add_usernames() -> None:
+    username_filter = UsernameFilter(UsernameFilterConfig(username_filter_capacity=100))
+    with username_filter.rebuilding():
+        pass
+
+    apply_user_change(None, '{"uuid": null, "username": "carol"}', username_filter)
+
+    assert username_filter.might_exist("carol")
+
+
+@pytest.mark.asyncio
+async def test_username_filter_is_built_from_the_users_table(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    UserHandler(db).create_user(create_user_payload)
+    connector = SQLAlchemyConnector(_url(postgresql))
+    username_filter = UsernameFilter()
+
+    await build_username_filter(username_filter, connector)
+
+    assert username_filter.might_exist(create_user_payload.username)
+    assert not username_filter.might_exist("nobody")
+    connector.dispose()
+
+
+@pytest.mark.asyncio
+async def test_username_filter_is_built_through_asyncpg(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    UserHandler(db).create_user(create_user_payload)
+    connector = AsyncSQLAlchemyConnector(_url(postgresql, "postgresql+asyncpg"))
+    username_filter = UsernameFilter()
+
+    await build_username_filter(username_filter, connector)
+
+    assert username_filter.might_exist(create_user_payload.username)
+    assert not username_filter.might_exist("nobody")
+    await connector.dispose()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("connector_type", "driver"),
+    [
+        (SQLAlchemyConnector, "postgresql"),
+        (AsyncSQLAlchemyConnector, "postgresql+asyncpg"),
+    ],
+)
+async def test_username_filter_keeps_users_created_while_it_is_built(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+    postgresql: Any,  # noqa: ANN401
+    connector_type: type[SQLAlchemyConnector | AsyncSQLAlchemyConnector],
+    driver: str,
+) -> None:
+    connector = connector_type(_url(postgresql, driver))
+    engine = getattr(connector.engine, "sync_engine", connector.engine)
+    username_filter = UsernameFilter()
+
+    created = []
+
+    # The user is created, and the change notification for it handled, once the
+    # usernames are being read, too late for them to include it.
+    def create_user(*_: object) -> None:
+        if not created:
+            created.append(UserHandler(db).create_user(create_user_payload))
+            username_filter.add(create_user_payload.username)
+
+    event.listen(engine, "after_cursor_execute", create_user)
+
+    await build_username_filter(username_filter, connector)
+
+    assert username_filter.might_exist(create_user_payload.username)
+    if isinstance(connector, AsyncSQLAlchemyConnector):
+        await connector.dispose()
+    else:
+        connector.dispose()
+
+
+def test_definite_misses_do_not_reach_the_database(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    username_filter = UsernameFilter()
+    with username_filter.rebuilding():
+        pass
+    user_handler = UserHandler(db, username_filter=username_filter)
+    user_handler.create_user(create_user_payload)
+    statements = []
+    event.listen(
+        db.get_bind(),
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+
+    assert user_handler.get_auth_data_and_version("nobody") is None
+    assert user_handler.is_username_available("nobody")
+    assert statements == []
+
+    auth_data_and_version = user_handler.get_auth_data_and_version(
+        create_user_payload.username,
+    )
+    assert auth_data_and_version is not None
+    assert not user_handler.is_username_available(create_user_payload.username)
@@ -0,0 +1,279 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterable
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any
+
+from common.api.schemas.user import UserAuthData
+
+from service.config import (
+    CacheConfig,
+    get_cache_config,
+    get_username_directory_config,
+)
+from service.database.username_directory import UsernameDirectory
+
+# Returned by `LRUCache.get` when a key is not cached. Distinct from `None`, which is
+# cached to remember that a lookup found nothing.
+MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+
+class LRUCache:
+    """A bounded, thread-safe LRU cache whose entries expire after a TTL.
+
+    `None` values are treated as negative entries and expire after `negative_ttl`, so
+    repeated lookups of missing keys do not reach the database.
+
+    `generation` changes on every invalidation. Read-through callers pass the value
+    they saw before querying the database to `put`, so a result that raced with an
+    invalidation is discarded instead of being cached stale.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        negative_ttl: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.stats = CacheStats()
+        self.generation = 0
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of entries, including expired ones not yet evicted."""
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:  # noqa: ANN401
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return MISSING
+
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def put(
+        self,
+        key: Hashable,
+        value: Any,  # noqa: ANN401
+        generation: int | None = None,
+    ) -> None:
+        ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self.generation += 1
+            if self._entries.pop(key, MISSING) is not MISSING:
+                self.stats.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self.stats.invalidations += len(self._entries)
+            self._entries.clear()
+
+
+class UserCache:
+    """Read-through caches for the user lookups made on every feed render and login.
+
+    Entries hold plain values rather than ORM instances, so they can be shared across
+    sessions (and threads) safely.
+
+    Usernames are looked up in the host's shared `directory` first, if there is one,
+    and only cached per worker when it does not know them. The directory lags behind
+    changes until its next refresh, so it is bypassed for users invalidated since.
+    The versions of users looked up by UUID are cached without their usernames,
+    which are looked up the same way.
+    """
+
+    def __init__(
+        self,
+        config: CacheConfig | None = None,
+        directory: UsernameDirectory | None = None,
+    ) -> None:
+        config = config or CacheConfig()
+        self.directory = directory
+        # uuid -> True, for users changed since the directory was last refreshed
+        self.directory_bypass = LRUCache(config.user_cache_size, config.user_cache_ttl)
+        # uuid -> username
+        self.usernames = LRUCache(
+            config.user_cache_size,
+            config.user_cache_ttl,
+            config.user_cache_negative_ttl,
+        )
+        # ("uuid", uuid) -> version of the user's row, or
+        # ("username", username) -> (UserAuthData, version of the user's row)
+        self.versions = LRUCache(
+            config.user_cache_size,
+            config.user_cache_ttl,
+            config.user_cache_negative_ttl,
+        )
+        # (prefix, limit) -> usernames
+        self.searches = LRUCache(
+            config.user_cache_search_size,
+            config.user_cache_search_ttl,
+        )
+
+    def _directory_username(self, key: str) -> str | None:
+        if self.directory is None or self.directory_bypass.get(key) is not MISSING:
+            return None
+        return self.directory.get(key)
+
+    def get_username(self, uuid: str) -> str | None | object:
+        key = str(uuid).lower()
+        username = self._directory_username(key)
+        if username is not None:
+            return username
+        return self.usernames.get(key)
+
+    def set_username(
+        self,
+        uuid: str,
+        username: str | None,
+        generation: int | None = None,
+    ) -> None:
+        self.usernames.put(str(uuid).lower(), username, generation)
+
+    def generations(self) -> tuple[int, int]:
+        """Return the generations to pass to `set_username_and_version`."""
+        return self.usernames.generation, self.versions.generation
+
+    def get_username_and_version(
+        self,
+        uuid: str,
+    ) -> tuple[str, datetime] | None | object:
+        key = str(uuid).lower()
+        version = self.versions.get(("uuid", key))
+        if version is MISSING or version is None:
+            return version
+        username = self.get_username(key)
+        if username is MISSING or username is None:
+            return MISSING
+        return username, version
+
+    def set_username_and_version(
+        self,
+        uuid: str,
+        username_and_version: tuple[str, datetime] | None,
+        generations: tuple[int, int] | None = None,
+    ) -> None:
+        key = str(uuid).lower()
+        username_generation, version_generation = generations or (None, None)
+        if username_and_version is None:
+            self.versions.put(("uuid", key), None, version_generation)
+            return
+        username, version = username_and_version
+        if self._directory_username(key) != username:
+            self.usernames.put(key, username, username_generation)
+        self.versions.put(("uuid", key), version, version_generation)
+
+    def get_auth_data_and_version(
+        self,
+        username: str,
+    ) -> tuple[UserAuthData, datetime] | None | object:
+        return self.versions.get(("username", username))
+
+    def set_auth_data_and_version(
+        self,
+        username: str,
+        auth_data_and_version: tuple[UserAuthData, datetime] | None,
+        generation: int | None = None,
+    ) -> None:
+        self.versions.put(("username", username), auth_data_and_version, generation)
+
+    def get_search(self, prefix: str, limit: int) -> list[str] | object:
+        return self.searches.get((prefix, limit))
+
+    def set_search(self, prefix: str, limit: int, usernames: list[str]) -> None:
+        self.searches.put((prefix, limit), usernames)
+
+    def invalidate(
+        self,
+        uuid: str | None = None,
+        usernames: Iterable[str | None] = (),
+    ) -> None:
+        if uuid is not None:
+            if self.directory is not None:
+                self.directory_bypass.put(str(uuid).lower(), value=True)
+            self.usernames.delete(str(uuid).lower())
+            self.versions.delete(("uuid", str(uuid).lower()))
+        for username in usernames:
+            if username is not None:
+                self.versions.delete(("username", username))
+
+    def clear(self) -> None:
+        logging.info("Clearing user cache")
+        self.usernames.clear()
+        self.versions.clear()
+        self.searches.clear()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        stats = {
+            "usernames": {**asdict(self.usernames.stats), "size": len(self.usernames)},
+            "versions": {**asdict(self.versions.stats), "size": len(self.versions)},
+            "searches": {**asdict(self.searches.stats), "size": len(self.searches)},
+        }
+        if self.directory is not None:
+            stats["directory"] = {"size": len(self.directory)}
+        return stats
+
+
+_user_cache: UserCache | None | object = MISSING
+_user_cache_lock = threading.Lock()
+
+
+def _create_user_cache() -> UserCache | None:
+    config = get_cache_config()
+    if not config.user_cache_enabled:
+        return None
+    directory_config = get_username_directory_config()
+    directory = None
+    if directory_config.username_directory_enabled:
+        directory = UsernameDirectory(directory_config.username_directory_path)
+    return UserCache(config, directory)
+
+
+def get_user_cache() -> UserCache | None:
+    """Return the process-wide user cache, or `None` if caching is disabled."""
+    global _user_cache  # noqa: PLW0603
+
+    if _user_cache is MISSING:
+        with _user_cache_lock:
+            if _user_cache is MISSING:
+                _user_cache = _create_user_cache()
+    return _user_cache
@@ -0,0 +1,97 @@
+from datetime import UTC, datetime
+
+import pytest
+from common.api.schemas.user import UserAuthData
+
+from service.config import CacheConfig
+from service.database import cache as cache_module
+from service.database.cache import MISSING, LRUCache, UserCache, get_user_cache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_cached_values_are_returned_until_they_expire() -> None:
+    clock = FakeClock()
+    cache = LRUCache(maxsize=10, ttl=60, clock=clock)
+
+    cache.put("key", "value")
+    assert cache.get("key") == "value"
+
+    clock.now = 61
+    assert cache.get("key") is MISSING
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+    assert cache.stats.expirations == 1
+
+
+def test_negative_entries_expire_after_the_negative_ttl() -> None:
+    clock = FakeClock()
+    cache = LRUCache(maxsize=10, ttl=60, negative_ttl=5, clock=clock)
+
+    cache.put("missing", None)
+    assert cache.get("missing") is None
+
+    clock.now = 6
+    assert cache.get("missing") is MISSING
+
+
+def test_least_recently_used_entries_are_evicted_first() -> None:
+    cache = LRUCache(maxsize=2, ttl=60)
+
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3  # noqa: PLR2004
+    assert cache.stats.evictions == 1
+
+
+def test_results_that_raced_with_an_invalidation_are_not_cached() -> None:
+    cache = LRUCache(maxsize=10, ttl=60)
+
+    generation = cache.generation
+    cache.delete("key")
+    cache.put("key", "stale", generation)
+
+    assert cache.get("key") is MISSING
+
+
+def test_user_cache_invalidates_usernames_and_versions() -> None:
+    cache = UserCache(CacheConfig())
+    uuid = "8A3F2C4E-0C1B-4E8B-9B1E-2F7D6C5B4A39"
+    auth_data = UserAuthData(uuid=uuid, hashed_password="hash")  # noqa: S106
+    version = datetime(2024, 1, 1, tzinfo=UTC)
+    cache.set_username(uuid, "old")
+    cache.set_username_and_version(uuid, ("old", version))
+    cache.set_auth_data_and_version("old", (auth_data, version))
+    cache.set_auth_data_and_version("new", None)
+
+    cache.invalidate(uuid.lower(), ["new", "old"])
+
+    assert cache.get_username(uuid) is MISSING
+    assert cache.get_username_and_version(uuid) is MISSING
+    assert cache.get_auth_data_and_version("old") is MISSING
+    assert cache.get_auth_data_and_version("new") is MISSING
+    assert cache.stats()["versions"]["invalidations"] == 3  # noqa: PLR2004
+
+
+def test_user_cache_is_shared_by_the_process(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(cache_module, "_user_cache", MISSING)
+
+    assert get_user_cache() is get_user_cache()
+
+
+def test_user_cache_can_be_disabled(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(cache_module, "_user_cache", MISSING)
+    monkeypatch.setenv("USER_CACHE_ENABLED", "false")
+
+    assert get_user_cache() is None
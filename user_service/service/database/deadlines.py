@@ -0,0 +1,79 @@
+from typing import Any
+
+from common.api import deadlines
+from common.api.exceptions.general import DeadlineExceededError
+from sqlalchemy import Engine, event
+from sqlalchemy.engine import Connection, ExceptionContext
+
+# Connection.info key set when a transaction begins, until its timeout has been set.
+_TIMEOUT_PENDING = "deadlines.timeout_pending"
+
+# The SQLSTATE of a statement cancelled by `statement_timeout`.
+_QUERY_CANCELED = "57014"
+
+# `set_config(..., true)` is `SET LOCAL` with the timeout as a bind parameter, so
+# drivers that prepare statements prepare it once, rather than once per timeout.
+_SET_STATEMENT_TIMEOUT = {
+    "numeric_dollar": "SELECT set_config('statement_timeout', $1, true)",
+    "pyformat": "SELECT set_config('statement_timeout', %s, true)",
+}
+
+
+def _set_statement_timeout(conn: Connection, milliseconds: int) -> None:
+    # A cursor of its own leaves the statement's cursor, which may be a server-side
+    # one, to that statement.
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(
+            _SET_STATEMENT_TIMEOUT[conn.dialect.paramstyle],
+            (str(milliseconds),),
+        )
+    finally:
+        cursor.close()
+
+
+def instrument(engine: Engine) -> None:
+    """Hold the engine's statements to the deadline of the current request.
+
+    The first statement of each transaction sets its `statement_timeout` to the time
+    left, so that Postgres stops work that nobody is waiting for any more. Statements
+    run once the deadline has passed, and those cancelled by the timeout, raise
+    `DeadlineExceededError`. Without a deadline, nothing is changed.
+    """
+
+    def begin(conn: Connection) -> None:
+        conn.info[_TIMEOUT_PENDING] = True
+
+    def before_execute(
+        conn: Connection,  # noqa: ARG001
+        *_: Any,  # noqa: ANN401
+    ) -> None:
+        left = deadlines.remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceededError
+
+    def before_cursor_execute(
+        conn: Connection,
+        *_: Any,  # noqa: ANN401
+    ) -> None:
+        pending = conn.info.pop(_TIMEOUT_PENDING, False)
+        left = deadlines.remaining()
+        if left is None or not pending:
+            return
+        # A deadline that has passed since `before_execute` leaves the shortest
+        # timeout, for Postgres to cancel the statement through `handle_error`.
+        _set_statement_timeout(conn, max(int(left * 1000), 1))
+
+    def handle_error(context: ExceptionContext) -> Exception | None:
+        cancelled = getattr(context.original_exception, "pgcode", None)
+        if cancelled == _QUERY_CANCELED and deadlines.remaining() is not None:
+            return DeadlineExceededError()
+        return None
+
+    event.listen(engine, "begin", begin)
+    # Statements are rejected before their cursor is used, as the `handle_error` of
+    # the other instruments, which time statements from `before_cursor_execute`, is
+    # not called for statements that never reach it.
+    event.listen(engine, "before_execute", before_execute)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
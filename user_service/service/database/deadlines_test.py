@@ -0,0 +1,114 @@
+import time
+from collections.abc import Generator
+from typing import Any
+
+import pytest
+from common.api import deadlines
+from common.api.deadlines import deadline
+from common.api.exceptions.general import DeadlineExceededError
+from sqlalchemy import Engine, create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from service.database import metrics, slow_queries
+from service.database.deadlines import instrument
+from service.database.metrics import DatabaseMetrics
+from service.database.slow_queries import SlowQueryLog
+
+
+def _url(postgresql: Any, driver: str = "postgresql") -> str:  # noqa: ANN401
+    info = postgresql.info
+    return f"{driver}://{info.user}@{info.host}:{info.port}/{info.dbname}"
+
+
+@pytest.fixture
+def engine(postgresql: Any) -> Generator[Engine, None, None]:  # noqa: ANN401
+    engine = create_engine(_url(postgresql))
+    instrument(engine)
+    yield engine
+    engine.dispose()
+
+
+def _statement_timeout_ms(value: str) -> int:
+    if value.endswith("ms"):
+        return int(value.removesuffix("ms"))
+    return int(value.removesuffix("s")) * 1000
+
+
+def test_transactions_are_limited_to_the_time_left(engine: Engine) -> None:
+    with deadline(2), engine.begin() as connection:
+        timeout = connection.execute(text("SHOW statement_timeout")).scalar_one()
+
+    assert 1500 < _statement_timeout_ms(timeout) <= 2000  # noqa: PLR2004
+
+    with engine.begin() as connection:
+        assert connection.execute(text("SHOW statement_timeout")).scalar_one() == "0"
+
+
+def test_statements_cancelled_at_the_deadline_raise(engine: Engine) -> None:
+    started = time.monotonic()
+    with deadline(0.2), pytest.raises(DeadlineExceededError), engine.begin() as conn:
+        conn.execute(text("SELECT pg_sleep(5)"))
+
+    assert time.monotonic() - started < 2  # noqa: PLR2004
+
+
+def test_statements_after_the_deadline_are_not_run(
+    engine: Engine,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    with deadline(1), engine.begin() as connection:
+        connection.execute(text("SELECT 1"))
+        now = time.monotonic()
+        monkeypatch.setattr(deadlines.time, "monotonic", lambda: now + 2)
+
+        with pytest.raises(DeadlineExceededError):
+            connection.execute(text("SELECT 1"))
+
+
+def test_statements_after_the_deadline_leave_no_timings_behind(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    engine = create_engine(_url(postgresql))
+    # In the order the connectors instrument their engines.
+    DatabaseMetrics().instrument("primary", engine)
+    SlowQueryLog(threshold=1).instrument("primary", engine)
+    instrument(engine)
+
+    with engine.connect() as connection:
+        with deadline(-1):
+            for _ in range(3):
+                with pytest.raises(DeadlineExceededError):
+                    connection.execute(text("SELECT 1"))
+        connection.execute(text("SELECT 1"))
+
+        assert connection.info[metrics._QUERY_STARTED] == []
+        assert connection.info[slow_queries._QUERY_STARTED] == []
+    engine.dispose()
+
+
+def test_server_side_cursors_keep_their_own_cursor(engine: Engine) -> None:
+    with deadline(2), engine.connect() as connection:
+        rows = connection.execution_options(yield_per=10).execute(
+            text("SELECT generate_series(1, 100)"),
+        )
+        assert len(rows.all()) == 100  # noqa: PLR2004
+
+
+@pytest.mark.asyncio
+async def test_async_transactions_are_limited_to_the_time_left(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    engine = create_async_engine(_url(postgresql, "postgresql+asyncpg"))
+    instrument(engine.sync_engine)
+    try:
+        with deadline(2):
+            async with engine.begin() as connection:
+                result = await connection.execute(text("SHOW statement_timeout"))
+                timeout = result.scalar_one()
+            with pytest.raises(DeadlineExceededError), deadline(0.2):
+                async with engine.begin() as connection:
+                    await connection.execute(text("SELECT pg_sleep(5)"))
+    finally:
+        await engine.dispose()
+
+    assert 1500 < _statement_timeout_ms(timeout) <= 2000  # noqa: PLR2004
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import threading
+from collections.abc import Iterable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from common.api.deadlines import no_deadline
+from common.api.exceptions.user import UserAlreadyExistsError, UserCreationError
+from common.api.schemas.user import CreateUserRequest
+from sqlalchemy import Engine, Row, exc
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from service.config import GroupCommitConfig, get_group_commit_config
+from service.database.cache import MISSING
+from service.database.models import User
+from service.database.replicas import ReplicaSet
+from service.database.session import (
+    AsyncSQLAlchemyConnector,
+    ShardedConnector,
+    get_database_connector,
+)
+
+# A whole batch is inserted by one statement, in one transaction. Usernames that are
+# already taken insert nothing and return no row.
+_insert_users = (
+    insert(User)
+    .on_conflict_do_nothing(index_elements=[User.username])
+    .returning(User.username, User.uuid, User.created_at)
+)
+
+
+@dataclass
+class _PendingUser:
+    user_in: CreateUserRequest
+    result: Future | asyncio.Future = field(default_factory=Future)
+
+    def resolve(self, row: Row | None) -> None:
+        if row is None:
+            logging.error("User %s already exists", self.user_in.username)
+            self.fail(UserAlreadyExistsError())
+        elif not self.result.done():
+            self.result.set_result(row)
+
+    def fail(self, error: Exception) -> None:
+        # The caller may have given up waiting, e.g. if its request was cancelled.
+        if not self.result.done():
+            self.result.set_exception(error)
+
+
+def _first_of_each_username(batch: list[_PendingUser]) -> list[_PendingUser]:
+    """Fail every repeat of a username within the batch; only the first can win."""
+    first = {}
+    for pending in batch:
+        if pending.user_in.username in first:
+            pending.resolve(None)
+        else:
+            first[pending.user_in.username] = pending
+    return list(first.values())
+
+
+def _settle(batch: list[_PendingUser], created: Iterable[Row]) -> None:
+    rows = {row.username: row for row in created}
+    for pending in batch:
+        pending.resolve(rows.get(pending.user_in.username))
+
+
+def _fail(batch: list[_PendingUser], error: Exception) -> None:
+    for pending in batch:
+        if isinstance(error, exc.IntegrityError):
+            pending.fail(UserCreationError())
+        else:
+            pending.fail(error)
+
+
+def _pin(replicas: ReplicaSet | None, created: list[Row]) -> None:
+    if replicas is not None:
+        replicas.pin(key for row in created for key in (row.uuid, row.username))
+
+
+class GroupCommitter:
+    """Inserts the users registered by concurrent requests together, in one commit.
+
+    Users are collected until `max_batch_size` are waiting, or for at most `max_delay`
+    seconds after the first, and the batch is then inserted with a single multi-row
+    `INSERT ... ON CONFLICT DO NOTHING RETURNING`. Each caller receives the row of
+    their own user, or `UserAlreadyExistsError` if the username was taken, including
+    by an earlier caller in the same batch.
+
+    A full batch is inserted on the thread of the caller that filled it, and any other
+    on a timer thread.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        replicas: ReplicaSet | None = None,
+        config: GroupCommitConfig | None = None,
+    ) -> None:
+        config = config or GroupCommitConfig()
+        self.engine = engine
+        self.replicas = replicas
+        self.max_batch_size = config.group_commit_max_batch_size
+        self.max_delay = config.group_commit_max_delay
+        self._batch: list[_PendingUser] = []
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+
+    def create_user(self, user_in: CreateUserRequest) -> Row:
+        """Insert a user with the next batch, and return its uuid and creation time.
+
+        Raises:
+            UserAlreadyExistsError: If the username is taken.
+            UserCreationError: If the batch could not be inserted.
+        """
+        pending = _PendingUser(user_in)
+        full_batch = None
+        with self._lock:
+            self._batch.append(pending)
+            if len(self._batch) >= self.max_batch_size:
+                full_batch = self._take_batch()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self._commit_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if full_batch is not None:
+            self._commit(full_batch)
+        return pending.result.result()
+
+    def _take_batch(self) -> list[_PendingUser]:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, []
+        return batch
+
+    def _commit_on_timer(self) -> None:
+        with self._lock:
+            # The batch this timer was started for may already have filled up.
+            if self._timer is not threading.current_thread():
+                return
+            batch = self._take_batch()
+        self._commit(batch)
+
+    def _commit(self, batch: list[_PendingUser]) -> None:
+        batch = _first_of_each_username(batch)
+        logging.info("Inserting a batch of %s users", len(batch))
+        try:
+            # The batch is inserted for several requests, so no one request's
+            # deadline may cut it short.
+            with no_deadline(), self.engine.begin() as connection:
+                created = connection.execute(
+                    _insert_users,
+                    [pending.user_in.model_dump() for pending in batch],
+                ).all()
+        except Exception as error:
+            logging.exception("Error inserting a batch of %s users", len(batch))
+            _fail(batch, error)
+            return
+        _pin(self.replicas, created)
+        _settle(batch, created)
+
+
+class AsyncGroupCommitter:
+    """Asyncio counterpart of `GroupCommitter`, on an `AsyncEngine`.
+
+    Batches are inserted by tasks on the event loop of the callers.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        replicas: ReplicaSet | None = None,
+        config: GroupCommitConfig | None = None,
+    ) -> None:
+        config = config or GroupCommitConfig()
+        self.engine = engine
+        self.replicas = replicas
+        self.max_batch_size = config.group_commit_max_batch_size
+        self.max_delay = config.group_commit_max_delay
+        self._batch: list[_PendingUser] = []
+        self._timer: asyncio.TimerHandle | None = None
+        # Running commits, referenced so that they are not garbage collected.
+        self._commits: set[asyncio.Task] = set()
+
+    async def create_user(self, user_in: CreateUserRequest) -> Row:
+        """Insert a user with the next batch, and return its uuid and creation time.
+
+        Raises:
+            UserAlreadyExistsError: If the username is taken.
+            UserCreationError: If the batch could not be inserted.
+        """
+        loop = asyncio.get_running_loop()
+        pending = _PendingUser(user_in, loop.create_future())
+        self._batch.append(pending)
+        if len(self._batch) >= self.max_batch_size:
+            self._start_commit()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._start_commit)
+        return await pending.result
+
+    def _start_commit(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, []
+        commit = asyncio.create_task(self._commit(batch))
+        self._commits.add(commit)
+        commit.add_done_callback(self._commits.discard)
+
+    async def _commit(self, batch: list[_PendingUser]) -> None:
+        batch = _first_of_each_username(batch)
+        logging.info("Inserting a batch of %s users", len(batch))
+        try:
+            with no_deadline():
+                async with self.engine.begin() as connection:
+                    result = await connection.execute(
+                        _insert_users,
+                        [pending.user_in.model_dump() for pending in batch],
+                    )
+                    created = result.all()
+        except Exception as error:
+            logging.exception("Error inserting a batch of %s users", len(batch))
+            _fail(batch, error)
+            return
+        _pin(self.replicas, created)
+        _settle(batch, created)
+
+
+_group_committer: GroupCommitter | AsyncGroupCommitter | None | object = MISSING
+_group_committer_lock = threading.Lock()
+
+
+def _create_group_committer() -> GroupCommitter | AsyncGroupCommitter | None:
+    config = get_group_commit_config()
+    if not config.group_commit_enabled:
+        return None
+
+    connector = get_database_connector()
+    if isinstance(connector, ShardedConnector):
+        logging.warning("Group commit is not supported with sharding, disabling it")
+        return None
+    if isinstance(connector, AsyncSQLAlchemyConnector):
+        return AsyncGroupCommitter(connector.engine, connector.replicas, config)
+    return GroupCommitter(connector.engine, connector.replicas, config)
+
+
+def get_group_committer() -> GroupCommitter | AsyncGroupCommitter | None:
+    """Return the process-wide group committer, or `None` if it is disabled."""
+    global _group_committer  # noqa: PLW0603
+
+    if _group_committer is MISSING:
+        with _group_committer_lock:
+            if _group_committer is MISSING:
+                _group_committer = _create_group_committer()
+    return _group_committer
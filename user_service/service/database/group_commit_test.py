@@ -0,0 +1,143 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import pytest
+from common.api.exceptions.user import UserAlreadyExistsError
+from common.api.schemas.user import CreateUserRequest
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session
+
+from service.config import GroupCommitConfig
+from service.database.group_commit import AsyncGroupCommitter, GroupCommitter
+from service.database.models import User
+from service.database.user_handler import UserHandler
+
+
+def _url(postgresql: Any, driver: str = "postgresql") -> str:  # noqa: ANN401
+    info = postgresql.info
+    return f"{driver}://{info.user}@{info.host}:{info.port}/{info.dbname}"
+
+
+def _user(username: str) -> CreateUserRequest:
+    return CreateUserRequest(username=username, hashed_password="hash")  # noqa: S106
+
+
+def _count_inserts(engine: Any) -> list[str]:  # noqa: ANN401
+    inserts = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record(*args: Any) -> None:  # noqa: ANN401
+        statement = args[2]
+        if statement.startswith("INSERT"):
+            inserts.append(statement)
+
+    return inserts
+
+
+def test_concurrent_registrations_are_inserted_together(
+    db: Session,
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    engine = create_engine(_url(postgresql))
+    inserts = _count_inserts(engine)
+    committer = GroupCommitter(
+        engine,
+        config=GroupCommitConfig(
+            group_commit_max_batch_size=10,
+            group_commit_max_delay=5,
+        ),
+    )
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        created = list(
+            executor.map(committer.create_user, [_user(f"user{i}") for i in range(10)]),
+        )
+
+    # A full batch is inserted straight away, without waiting out the delay.
+    assert len(inserts) == 1
+    assert len({row.uuid for row in created}) == 10  # noqa: PLR2004
+    assert [row.username for row in created] == [f"user{i}" for i in range(10)]
+    assert db.execute(select(func.count(User.uuid))).scalar() == 10  # noqa: PLR2004
+    engine.dispose()
+
+
+def test_each_caller_learns_whether_their_username_was_taken(
+    db: Session,
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    UserHandler(db).create_user(_user("taken"))
+    engine = create_engine(_url(postgresql))
+    committer = GroupCommitter(
+        engine,
+        config=GroupCommitConfig(group_commit_max_batch_size=4),
+    )
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(committer.create_user, _user(username))
+            for username in ("taken", "fresh", "twice", "twice")
+        ]
+
+    outcomes = [future.exception() or future.result().username for future in futures]
+    assert isinstance(outcomes[0], UserAlreadyExistsError)
+    assert outcomes[1] == "fresh"
+    assert "twice" in outcomes[2:]
+    assert any(isinstance(outcome, UserAlreadyExistsError) for outcome in outcomes[2:])
+    engine.dispose()
+
+
+@pytest.mark.usefixtures("db")
+def test_a_partial_batch_is_inserted_after_the_delay(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    engine = create_engine(_url(postgresql))
+    committer = GroupCommitter(
+        engine,
+        config=GroupCommitConfig(group_commit_max_delay=0.01),
+    )
+
+    created = committer.create_user(_user("alone"))
+
+    assert created.username == "alone"
+    engine.dispose()
+
+
+def test_handler_registers_through_the_committer(
+    db: Session,
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    engine = create_engine(_url(postgresql))
+    handler = UserHandler(db, committer=GroupCommitter(engine))
+
+    user = handler.create_user(_user("alice"))
+
+    assert handler.get_by_uuid(str(user.uuid)).username == "alice"
+    with pytest.raises(UserAlreadyExistsError):
+        handler.create_user(_user("alice"))
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("db")
+async def test_async_registrations_are_inserted_together(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    engine = create_async_engine(_url(postgresql, "postgresql+asyncpg"))
+    inserts = _count_inserts(engine.sync_engine)
+    committer = AsyncGroupCommitter(
+        engine,
+        config=GroupCommitConfig(group_commit_max_delay=0.05),
+    )
+
+    results = await asyncio.gather(
+        *(committer.create_user(_user(f"user{i}")) for i in range(5)),
+        committer.create_user(_user("user0")),
+        return_exceptions=True,
+    )
+
+    assert len(inserts) == 1
+    assert [row.username for row in results[:5]] == [f"user{i}" for i in range(5)]
+    assert isinstance(results[5], UserAlreadyExistsError)
+    await engine.dispose()
@@ -0,0 +1,185 @@
+import functools
+import re
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+from common.metrics import Histogram
+from sqlalchemy import Engine, event, exc
+from sqlalchemy.engine import Connection, ExceptionContext
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+# Statements beyond this many distinct fingerprints are counted together, so that
+# dynamically built SQL cannot grow the metrics without bound.
+MAX_FINGERPRINTS = 200
+OTHER_STATEMENTS = "<other>"
+
+# Connection.info key holding the start times of the statements being executed.
+_QUERY_STARTED = "metrics.query_started"
+
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|\$\d+|%s|\?")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> str:
+    """Reduce a SQL statement to its shape, without any parameters or literals.
+
+    Placeholders of every paramstyle and inline literals become `?`, and lists of
+    placeholders, such as those of an expanded `IN`, collapse to a single `(?)`.
+    """
+    statement = _PLACEHOLDER.sub("?", statement)
+    statement = _LITERAL.sub("?", statement)
+    statement = _PLACEHOLDER_LIST.sub("(?)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+class EngineMetrics:
+    """Query latencies and pool usage of a single engine."""
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self.queries: dict[str, Histogram] = {}
+        self.checkout_wait = Histogram()
+        self.checkout_timeouts = 0
+        self.connects = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self._lock = threading.Lock()
+
+    def observe_query(self, statement: str, seconds: float) -> None:
+        key = fingerprint(statement)
+        with self._lock:
+            histogram = self.queries.get(key)
+            if histogram is None:
+                if len(self.queries) >= MAX_FINGERPRINTS:
+                    key = OTHER_STATEMENTS
+                histogram = self.queries.setdefault(key, Histogram())
+            histogram.observe(seconds)
+
+    def observe_checkout_wait(self, seconds: float, *, timed_out: bool) -> None:
+        with self._lock:
+            self.checkout_wait.observe(seconds)
+            if timed_out:
+                self.checkout_timeouts += 1
+
+    def on_connect(self, *_: Any) -> None:  # noqa: ANN401
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, *_: Any) -> None:  # noqa: ANN401
+        with self._lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def on_checkin(self, *_: Any) -> None:  # noqa: ANN401
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            pool = {
+                "size": self.engine.pool.size(),
+                "in_use": self.engine.pool.checkedout(),
+                "peak_in_use": self.peak_in_use,
+                "overflow": max(self.engine.pool.overflow(), 0),
+                "connects": self.connects,
+                "checkout_timeouts": self.checkout_timeouts,
+                "checkout_wait_seconds": self.checkout_wait.snapshot(),
+            }
+            queries = {
+                statement: histogram.snapshot()
+                for statement, histogram in self.queries.items()
+            }
+        return {"pool": pool, "queries": queries}
+
+
+class DatabaseMetrics:
+    """In-process metrics for every engine of a connector, keyed by engine name."""
+
+    def __init__(self) -> None:
+        self.engines: dict[str, EngineMetrics] = {}
+
+    def instrument(self, name: str, engine: Engine) -> None:
+        """Record the query latencies and pool usage of `engine` under `name`."""
+        metrics = EngineMetrics(engine)
+        self.engines[name] = metrics
+
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(
+            engine,
+            "after_cursor_execute",
+            functools.partial(_after_cursor_execute, metrics),
+        )
+        event.listen(engine, "handle_error", _handle_error)
+        event.listen(engine.pool, "connect", metrics.on_connect)
+        event.listen(engine.pool, "checkout", metrics.on_checkout)
+        event.listen(engine.pool, "checkin", metrics.on_checkin)
+        if isinstance(engine.pool, _TimedCheckoutMixin):
+            engine.pool.on_checkout_wait = metrics.observe_checkout_wait
+
+    def snapshot(self) -> dict[str, Any]:
+        return {name: metrics.snapshot() for name, metrics in self.engines.items()}
+
+
+def _before_cursor_execute(conn: Connection, *_: Any) -> None:  # noqa: ANN401
+    conn.info.setdefault(_QUERY_STARTED, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(
+    metrics: EngineMetrics,
+    conn: Connection,
+    _cursor: Any,  # noqa: ANN401
+    statement: str,
+    *_: Any,  # noqa: ANN401
+) -> None:
+    started = conn.info[_QUERY_STARTED].pop()
+    metrics.observe_query(statement, time.perf_counter() - started)
+
+
+def _handle_error(context: ExceptionContext) -> None:
+    # A failed statement never reaches `after_cursor_execute`.
+    if context.connection is not None and context.connection.info.get(_QUERY_STARTED):
+        context.connection.info[_QUERY_STARTED].pop()
+
+
+class _TimedCheckoutMixin:
+    """Reports how long each checkout waited for a connection.
+
+    Pool events only fire once a connection has been handed out, so the wait for a
+    free connection can only be timed by wrapping `connect`.
+    """
+
+    on_checkout_wait: Callable[..., None] | None = None
+
+    def connect(self) -> Any:  # noqa: ANN401
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            if self.on_checkout_wait is not None:
+                self.on_checkout_wait(
+                    time.perf_counter() - started,
+                    timed_out=timed_out,
+                )
+
+    def recreate(self) -> Pool:
+        # Disposing an engine replaces its pool with a recreated one.
+        pool = super().recreate()
+        pool.on_checkout_wait = self.on_checkout_wait
+        return pool
+
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
@@ -0,0 +1,78 @@
+from typing import Any
+
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from service.config import DatabaseConfig
+from service.database.metrics import (
+    MAX_FINGERPRINTS,
+    OTHER_STATEMENTS,
+    DatabaseMetrics,
+    EngineMetrics,
+    TimedQueuePool,
+    fingerprint,
+)
+from service.database.session import SQLAlchemyConnector
+
+
+def test_fingerprints_ignore_parameters_and_literals() -> None:
+    assert fingerprint(
+        "SELECT users.username\n  FROM users WHERE users.uuid = %(uuid)s LIMIT 1",
+    ) == ("SELECT users.username FROM users WHERE users.uuid = ? LIMIT ?")
+    assert fingerprint("SELECT * FROM users WHERE username = 'bob'") == fingerprint(
+        "SELECT * FROM users WHERE username = $1",
+    )
+    assert fingerprint("WHERE uuid IN (%(uuid_1)s, %(uuid_2)s, %(uuid_3)s)") == (
+        "WHERE uuid IN (?)"
+    )
+
+
+def test_distinct_fingerprints_are_bounded() -> None:
+    metrics = EngineMetrics(create_engine("postgresql://", poolclass=TimedQueuePool))
+
+    for i in range(MAX_FINGERPRINTS + 10):
+        metrics.observe_query(f"SELECT * FROM table_{i}", 0.001)  # noqa: S608
+
+    assert len(metrics.queries) == MAX_FINGERPRINTS + 1
+    assert metrics.queries[OTHER_STATEMENTS].count == 10  # noqa: PLR2004
+
+
+def test_query_latencies_and_pool_usage_are_recorded(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    info = postgresql.info
+    engine = create_engine(
+        f"postgresql://{info.user}@{info.host}:{info.port}/{info.dbname}",
+        poolclass=TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    metrics = DatabaseMetrics()
+    metrics.instrument("primary", engine)
+
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        connection.execute(text("SELECT 2"))
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        in_use = metrics.snapshot()["primary"]["pool"]["in_use"]
+
+    snapshot = metrics.snapshot()["primary"]
+    assert snapshot["queries"]["SELECT ?"]["count"] == 2  # noqa: PLR2004
+    assert in_use == 1
+    assert snapshot["pool"]["in_use"] == 0
+    assert snapshot["pool"]["peak_in_use"] == 1
+    assert snapshot["pool"]["connects"] == 1
+    assert snapshot["pool"]["checkout_timeouts"] == 1
+    assert snapshot["pool"]["checkout_wait_seconds"]["count"] == 2  # noqa: PLR2004
+    engine.dispose()
+
+
+def test_connector_metrics_can_be_disabled() -> None:
+    config = DatabaseConfig(db_metrics_enabled=False)
+
+    connector = SQLAlchemyConnector("postgresql://", config)
+
+    assert connector.metrics.snapshot() == {}
+    assert not isinstance(connector.engine.pool, TimedQueuePool)
@@ -1,11 +1,81 @@
+import functools
+import os
+import time
 import uuid
+from collections.abc import Callable
 
-from common.api.schemas.user import InternalUserIdentity, UserAuthData
-from sqlalchemy import UUID, Column, String
+from common.api.schemas.user import (
+    USER_CREATED,
+    USER_UPDATED,
+    InternalUserIdentity,
+    UserAuthData,
+)
+from sqlalchemy import (
+    DDL,
+    UUID,
+    BigInteger,
+    Column,
+    Identity,
+    Index,
+    SmallInteger,
+    String,
+    event,
+    text,
+)
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.sql import func
 from sqlalchemy.sql.sqltypes import DateTime
 
-from service.database.session import Base
+from service.config import get_user_events_config, get_user_key_config
+from service.database.session import Base, DirectoryBase
+
+USER_CHANGES_CHANNEL = "user_changes"
+
+# The ID of the transaction running a statement. Postgres' transaction IDs are 64-bit
+# `xid8`s, which fit a bigint for the lifetime of any database.
+CURRENT_TRANSACTION_ID = text("pg_current_xact_id()::text::bigint")
+
+# Every transaction with a lower ID than this has either committed or rolled back, as
+# of the snapshot of the statement that reads it.
+OLDEST_RUNNING_TRANSACTION_ID = text(
+    "pg_snapshot_xmin(pg_current_snapshot())::text::bigint",
+)
+
+_UUID7_VERSION = 0x7 << 76
+_UUID7_VARIANT = 0b10 << 62
+
+
+def uuid7() -> uuid.UUID:
+    """Generate a version 7 UUID, as specified by RFC 9562.
+
+    The first 48 bits are the Unix time in milliseconds. The 12 bits after the
+    version hold the fraction of the millisecond (the RFC's method 3), so that the
+    UUIDs generated by one process are ordered to within a quarter of a microsecond,
+    and the remaining 62 bits are random.
+    """
+    timestamp_ms, remainder_ns = divmod(time.time_ns(), 1_000_000)
+    fraction = remainder_ns * 4096 // 1_000_000
+    random_bits = int.from_bytes(os.urandom(8), "big") >> 2
+    return uuid.UUID(
+        int=(timestamp_ms & ((1 << 48) - 1)) << 80
+        | _UUID7_VERSION
+        | fraction << 64
+        | _UUID7_VARIANT
+        | random_bits,
+    )
+
+
+_USER_KEY_GENERATORS: dict[int, Callable[[], uuid.UUID]] = {4: uuid.uuid4, 7: uuid7}
+
+
+@functools.cache
+def _user_key_generator() -> Callable[[], uuid.UUID]:
+    return _USER_KEY_GENERATORS[get_user_key_config().user_key_version]
+
+
+def new_user_key() -> uuid.UUID:
+    """Generate the UUID of a new user, of the version set by `USER_KEY_VERSION`."""
+    return _user_key_generator()()
 
 
 class User(Base):
@@ -16,7 +86,7 @@ class User(Base):
         primary_key=True,
         unique=True,
         nullable=False,
-        default=uuid.uuid4,
+        default=new_user_key,
     )
     username = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
@@ -28,6 +98,24 @@ class User(Base):
         DateTime(timezone=True),
         onupdate=func.now(),
     )
+    # The transaction that last wrote the user, which orders the change feed.
+    change_xid = Column(
+        BigInteger,
+        nullable=False,
+        server_default=CURRENT_TRANSACTION_ID,
+    )
+
+    __table_args__ = (
+        # Keyset pagination of the user listing walks this index in order.
+        Index("ix_users_created_at_uuid", created_at, uuid),
+        # Username prefix searches are range scans of this index. Unlike the default
+        # collation, "C" orders strings by code point, so every username with a given
+        # prefix is in one contiguous range, already in the order they are returned.
+        Index("ix_users_username_prefix", username.collate("C")),
+        # The change feed is a keyset range scan of this index, and so are the reads of
+        # the users changed since the username directory was last refreshed.
+        Index("ix_users_change_xid_uuid", change_xid, uuid),
+    )
 
     def to_identity(self) -> InternalUserIdentity:
         return InternalUserIdentity(uuid=str(self.uuid))
@@ -40,3 +128,207 @@ class User(Base):
 
     def to_username(self) -> str:
         return {"username": self.username}
+
+
+class UserOutboxEvent(Base):
+    """A change to a user, recorded with it and waiting to be published."""
+
+    __tablename__ = "user_outbox"
+
+    event_id = Column(BigInteger, Identity(), primary_key=True)
+    event_type = Column(String, nullable=False)
+    uuid = Column(UUID(as_uuid=True), nullable=False)
+    username = Column(String, nullable=False)
+    version = Column(DateTime(timezone=True), nullable=False)
+
+
+class UserShard(DirectoryBase):
+    """The shard that a user lives on, when users are sharded."""
+
+    __tablename__ = "user_shards"
+
+    username = Column(String, primary_key=True)
+    uuid = Column(UUID(as_uuid=True), unique=True, nullable=False)
+    shard = Column(SmallInteger, nullable=False)
+
+
+# `create_all` skips tables that already exist, so the column and indexes added to the
+# users table since it was first created are also added here, to tables that predate
+# them, and those no longer used are dropped. Adding `change_xid` rewrites the table
+# once, stamping every existing user with the ID of the upgrading transaction.
+_add_change_xid = DDL(
+    f"""
+    ALTER TABLE {User.__tablename__}
+    ADD COLUMN IF NOT EXISTS change_xid bigint NOT NULL
+    DEFAULT {CURRENT_TRANSACTION_ID.text}
+    """,
+)
+event.listen(
+    Base.metadata,
+    "after_create",
+    _add_change_xid.execute_if(dialect="postgresql"),
+)
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL("DROP INDEX IF EXISTS ix_users_updated_at").execute_if(dialect="postgresql"),
+)
+for _index in User.__table__.indexes:
+    event.listen(
+        Base.metadata,
+        "after_create",
+        CreateIndex(_index, if_not_exists=True).execute_if(dialect="postgresql"),
+    )
+
+
+# Every insert or update of a user is broadcast on USER_CHANGES_CHANNEL, so each worker
+# can drop its cached copy of that user. The notification is only delivered once the
+# writing transaction commits.
+_notify_user_change = DDL(
+    f"""
+    CREATE OR REPLACE FUNCTION notify_user_change() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify(
+            '{USER_CHANGES_CHANNEL}',
+            json_build_object(
+                'uuid', NEW.uuid,
+                'username', NEW.username,
+                'old_username', CASE WHEN TG_OP = 'UPDATE' THEN OLD.username END
+            )::text
+        );
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+)
+_user_change_trigger = DDL(
+    f"""
+    CREATE OR REPLACE TRIGGER user_change_notify
+    AFTER INSERT OR UPDATE ON {User.__tablename__}
+    FOR EACH ROW EXECUTE FUNCTION notify_user_change()
+    """,
+)
+
+# MetaData-level `after_create` runs on every `create_all`, so the trigger is also
+# installed on databases whose users table predates it.
+event.listen(
+    Base.metadata,
+    "after_create",
+    _notify_user_change.execute_if(dialect="postgresql"),
+)
+event.listen(
+    Base.metadata,
+    "after_create",
+    _user_change_trigger.execute_if(dialect="postgresql"),
+)
+
+
+# Inserts take their `change_xid` from the column default, and updates from this
+# trigger, so every write moves the user to the end of the change feed however it is
+# made.
+_stamp_user_change = DDL(
+    f"""
+    CREATE OR REPLACE FUNCTION stamp_user_change() RETURNS trigger AS $$
+    BEGIN
+        NEW.change_xid := {CURRENT_TRANSACTION_ID.text};
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+)
+_user_change_stamp_trigger = DDL(
+    f"""
+    CREATE OR REPLACE TRIGGER user_change_stamp
+    BEFORE UPDATE ON {User.__tablename__}
+    FOR EACH ROW EXECUTE FUNCTION stamp_user_change()
+    """,
+)
+event.listen(
+    Base.metadata,
+    "after_create",
+    _stamp_user_change.execute_if(dialect="postgresql"),
+)
+event.listen(
+    Base.metadata,
+    "after_create",
+    _user_change_stamp_trigger.execute_if(dialect="postgresql"),
+)
+
+
+# With user events enabled, every new user and changed username is also recorded in
+# the outbox, by the transaction that writes it, for `OutboxRelay` to publish.
+# Transactions that only move users between shards turn SKIP_USER_EVENTS_SETTING on,
+# as the users they insert are not new.
+SKIP_USER_EVENTS_SETTING = "klink.skip_user_events"
+
+_record_user_event = DDL(
+    f"""
+    CREATE OR REPLACE FUNCTION record_user_event() RETURNS trigger AS $$
+    BEGIN
+        IF current_setting('{SKIP_USER_EVENTS_SETTING}', true) = 'on' THEN
+            RETURN NEW;
+        END IF;
+        IF TG_OP = 'INSERT' OR NEW.username IS DISTINCT FROM OLD.username THEN
+            INSERT INTO {UserOutboxEvent.__tablename__}
+                (event_type, uuid, username, version)
+            VALUES (
+                CASE TG_OP
+                    WHEN 'INSERT' THEN '{USER_CREATED}'
+                    ELSE '{USER_UPDATED}'
+                END,
+                NEW.uuid,
+                NEW.username,
+                now()
+            );
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,  # noqa: S608
+)
+_user_event_trigger = DDL(
+    f"""
+    CREATE OR REPLACE TRIGGER user_event_record
+    AFTER INSERT OR UPDATE OF username ON {User.__tablename__}
+    FOR EACH ROW EXECUTE FUNCTION record_user_event()
+    """,
+)
+# Without a relay to empty it, the outbox would only grow, so the trigger is dropped
+# again when user events are turned off.
+_drop_user_event_trigger = DDL(
+    f"DROP TRIGGER IF EXISTS user_event_record ON {User.__tablename__}",
+)
+
+
+def _user_events_enabled(*_: object, **__: object) -> bool:
+    return get_user_events_config().user_events_enabled
+
+
+def _user_events_disabled(*_: object, **__: object) -> bool:
+    return not _user_events_enabled()
+
+
+event.listen(
+    Base.metadata,
+    "after_create",
+    _record_user_event.execute_if(
+        dialect="postgresql",
+        callable_=_user_events_enabled,
+    ),
+)
+event.listen(
+    Base.metadata,
+    "after_create",
+    _user_event_trigger.execute_if(
+        dialect="postgresql",
+        callable_=_user_events_enabled,
+    ),
+)
+event.listen(
+    Base.metadata,
+    "after_create",
+    _drop_user_event_trigger.execute_if(
+        dialect="postgresql",
+        callable_=_user_events_disabled,
+    ),
+)
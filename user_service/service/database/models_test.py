@@ -1,10 +1,22 @@
+import time
+import uuid
+
+import pytest
 from common.api.schemas.user import (
     CreateUserRequest,
     InternalUserIdentity,
     UserAuthData,
 )
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import Session
 
+from service.database.models import (
+    User,
+    _user_key_generator,
+    new_user_key,
+    uuid7,
+)
+from service.database.session import Base
 from service.database.user_handler import UserHandler
 
 
@@ -30,3 +42,69 @@ def test_auth_data_can_be_retrieved_from_user_model(
     assert isinstance(user_auth_data, UserAuthData)
     assert user_auth_data.uuid == str(user.uuid)
     assert user_auth_data.hashed_password == user.hashed_password
+
+
+def test_create_all_upgrades_a_users_table_that_predates_its_columns_and_indexes(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    added_indexes = {
+        "ix_users_created_at_uuid",
+        "ix_users_username_prefix",
+        "ix_users_change_xid_uuid",
+    }
+    for index in added_indexes:
+        db.execute(text(f"DROP INDEX {index}"))
+    db.execute(text("ALTER TABLE users DROP COLUMN change_xid"))
+    db.execute(text("CREATE INDEX ix_users_updated_at ON users (updated_at)"))
+    db.execute(
+        text(
+            "INSERT INTO users (uuid, username, hashed_password) "
+            "VALUES (gen_random_uuid(), 'OldUser', 'hash')",
+        ),
+    )
+    db.commit()
+
+    engine = db.get_bind()
+    Base.metadata.create_all(engine)
+    Base.metadata.create_all(engine)
+
+    inspector = inspect(engine)
+    assert "change_xid" in {column["name"] for column in inspector.get_columns("users")}
+    indexes = {index["name"] for index in inspector.get_indexes("users")}
+    assert added_indexes <= indexes
+    assert "ix_users_updated_at" not in indexes
+    old_user = db.query(User).filter_by(username="OldUser").one()
+    assert old_user.change_xid is not None
+    UserHandler(db).create_user(create_user_payload)
+    new_user = db.query(User).filter_by(username=create_user_payload.username).one()
+    assert new_user.change_xid > old_user.change_xid
+
+
+def test_uuid7_keys_are_time_ordered_and_valid() -> None:
+    keys = []
+    for _ in range(3):
+        keys.append(uuid7())
+        time.sleep(0.002)
+
+    assert keys == sorted(keys)
+    for key in keys:
+        assert key.version == 7  # noqa: PLR2004
+        assert key.variant == uuid.RFC_4122
+        assert abs((key.int >> 80) - time.time() * 1000) < 60_000  # noqa: PLR2004
+        auth_data = UserAuthData(uuid=str(key), hashed_password="hash")  # noqa: S106
+        assert auth_data.uuid == str(key)
+
+
+@pytest.mark.parametrize("version", [4, 7])
+def test_user_key_version_is_configurable(
+    monkeypatch: pytest.MonkeyPatch,
+    version: int,
+) -> None:
+    monkeypatch.setenv("USER_KEY_VERSION", str(version))
+    _user_key_generator.cache_clear()
+
+    try:
+        assert new_user_key().version == version
+    finally:
+        _user_key_generator.cache_clear()
@@ -0,0 +1,117 @@
+import json
+import logging
+import select
+import threading
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy.engine import make_url
+
+from service.database.bloom import UsernameFilter
+from service.database.cache import UserCache
+from service.database.models import USER_CHANGES_CHANNEL
+
+
+def apply_user_change(
+    cache: UserCache | None,
+    payload: str,
+    username_filter: UsernameFilter | None = None,
+) -> None:
+    """Apply a user change notification to the cache and the username filter."""
+    try:
+        change = json.loads(payload)
+    except ValueError:
+        logging.warning("Ignoring malformed user change notification: %s", payload)
+        return
+
+    if cache is not None:
+        cache.invalidate(
+            change.get("uuid"),
+            (change.get("username"), change.get("old_username")),
+        )
+    if username_filter is not None and change.get("username") is not None:
+        username_filter.add(change["username"])
+
+
+class UserChangeListener:
+    """LISTENs for user changes on a dedicated connection.
+
+    Changes invalidate the cache and are added to the username filter. The listener
+    runs on a daemon thread. If the connection drops, the whole cache is cleared and
+    the filter invalidated, since notifications may have been missed while
+    disconnected.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        url: str,
+        cache: UserCache | None,
+        poll_interval: float = 1.0,
+        reconnect_delay: float = 5.0,
+        username_filter: UsernameFilter | None = None,
+    ) -> None:
+        # LISTEN needs a psycopg2 connection, whichever driver serves the requests.
+        libpq_url = make_url(url).set(drivername="postgresql")
+        self.dsn = libpq_url.render_as_string(hide_password=False)
+        self.cache = cache
+        self.username_filter = username_filter
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self._stopped = threading.Event()
+        self._listening = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="user-change-listener",
+            daemon=True,
+        )
+
+    def start(self) -> None:
+        logging.info("Listening for user changes on %s", USER_CHANGES_CHANNEL)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join(timeout=self.poll_interval * 2)
+
+    @property
+    def listening(self) -> bool:
+        return self._listening.is_set()
+
+    def wait_until_listening(self, timeout: float | None = None) -> bool:
+        return self._listening.wait(timeout)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except psycopg2.Error:
+                logging.exception("User change listener lost its connection")
+            self._listening.clear()
+            if self.cache is not None:
+                self.cache.clear()
+            if self.username_filter is not None:
+                self.username_filter.invalidate()
+            self._stopped.wait(self.reconnect_delay)
+
+    def _listen(self) -> None:
+        connection = psycopg2.connect(self.dsn)
+        try:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {USER_CHANGES_CHANNEL}")
+            self._listening.set()
+
+            while not self._stopped.is_set():
+                readable, _, _ = select.select([connection], [], [], self.poll_interval)
+                if not readable:
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    apply_user_change(
+                        self.cache,
+                        notification.payload,
+                        self.username_filter,
+                    )
+        finally:
+            connection.close()
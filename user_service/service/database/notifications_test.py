@@ -0,0 +1,83 @@
+import time
+import uuid
+
+from common.api.schemas.user import CreateUserRequest
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from service.config import CacheConfig
+from service.database.cache import MISSING, UserCache
+from service.database.models import User
+from service.database.notifications import UserChangeListener, apply_user_change
+from service.database.user_handler import UserHandler
+
+
+def wait_for(condition: callable, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_user_change_payload_invalidates_old_and_new_usernames() -> None:
+    cache = UserCache(CacheConfig())
+    user_uuid = str(uuid.uuid4())
+    cache.set_username(user_uuid, "old")
+    cache.set_auth_data_and_version("old", None)
+    cache.set_auth_data_and_version("new", None)
+
+    apply_user_change(
+        cache,
+        f'{{"uuid": "{user_uuid}", "username": "new", "old_username": "old"}}',
+    )
+
+    assert cache.get_username(user_uuid) is MISSING
+    assert cache.get_auth_data_and_version("old") is MISSING
+    assert cache.get_auth_data_and_version("new") is MISSING
+
+
+def test_malformed_user_change_payload_is_ignored() -> None:
+    cache = UserCache(CacheConfig())
+    cache.set_auth_data_and_version("user", None)
+
+    apply_user_change(cache, "not json")
+
+    assert cache.get_auth_data_and_version("user") is None
+
+
+def test_committed_user_changes_invalidate_other_workers_caches(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user = UserHandler(db).create_user(create_user_payload)
+    user_uuid = str(user.uuid)
+
+    # Another worker's cache, populated before the change.
+    cache = UserCache(CacheConfig())
+    other_worker = UserHandler(db, cache)
+    username, _ = other_worker.get_username_and_version(user_uuid)
+    assert username == create_user_payload.username
+    assert other_worker.get_auth_data_and_version("RenamedUser") is None
+
+    listener = UserChangeListener(
+        db.get_bind().url.render_as_string(hide_password=False),
+        cache,
+        poll_interval=0.05,
+    )
+    listener.start()
+    try:
+        assert listener.wait_until_listening(timeout=5)
+
+        db.execute(
+            update(User).where(User.uuid == user.uuid).values(username="RenamedUser"),
+        )
+        db.commit()
+
+        assert wait_for(lambda: cache.get_username(user_uuid) is MISSING)
+        username, _ = other_worker.get_username_and_version(user_uuid)
+        assert username == "RenamedUser"
+        assert other_worker.get_auth_data_and_version("RenamedUser") is not None
+    finally:
+        listener.stop()
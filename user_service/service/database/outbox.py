@@ -0,0 +1,95 @@
+import logging
+import threading
+
+from common.api.schemas.user import UserEvent
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy.engine import make_url
+
+from service.database.models import UserOutboxEvent
+from service.events import EventPublisher
+
+_outbox = UserOutboxEvent.__table__
+
+
+class OutboxRelay:
+    """Publishes the user events recorded in a database's outbox.
+
+    Each batch of events is read, published, and deleted by one transaction, which
+    only commits once the broker has confirmed every event in it. If publishing
+    fails, the transaction rolls back and the batch is published again, so events
+    are delivered at least once. The relay runs on a daemon thread.
+
+    Every worker runs a relay, and the rows of a batch are locked with `SKIP LOCKED`,
+    so relays share the outbox without publishing the same event twice, though
+    events of one user may then be published out of order.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        url: str,
+        publisher: EventPublisher,
+        batch_size: int = 100,
+        poll_interval: float = 0.5,
+        retry_delay: float = 5.0,
+    ) -> None:
+        # The relay waits on the broker mid-transaction, so it keeps a connection of
+        # its own, apart from the pool serving requests.
+        libpq_url = make_url(url).set(drivername="postgresql")
+        self.engine = create_engine(libpq_url, pool_size=1, max_overflow=0)
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="user-outbox-relay",
+            daemon=True,
+        )
+
+    def start(self) -> None:
+        logging.info("Relaying user events from %s", _outbox.name)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join(timeout=self.retry_delay)
+        self.publisher.close()
+        self.engine.dispose()
+
+    def relay_batch(self) -> int:
+        """Publish the oldest unlocked events, and return how many there were."""
+        with self.engine.begin() as connection:
+            rows = connection.execute(
+                select(_outbox)
+                .order_by(_outbox.c.event_id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True),
+            ).all()
+            if not rows:
+                return 0
+
+            self.publisher.publish(
+                [UserEvent.model_validate(row, from_attributes=True) for row in rows],
+            )
+            connection.execute(
+                delete(_outbox).where(
+                    _outbox.c.event_id.in_([row.event_id for row in rows]),
+                ),
+            )
+        return len(rows)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                relayed = self.relay_batch()
+            except Exception:
+                logging.exception("Could not relay user events")
+                self.publisher.close()
+                self._stopped.wait(self.retry_delay)
+                continue
+
+            # A full batch suggests more are waiting, which are relayed straight away.
+            if relayed < self.batch_size:
+                self.publisher.keep_alive()
+                self._stopped.wait(self.poll_interval)
@@ -0,0 +1,162 @@
+from collections.abc import Sequence
+from typing import Any
+
+import pytest
+from common.api.schemas.user import (
+    USER_CREATED,
+    USER_UPDATED,
+    CreateUserRequest,
+    UserEvent,
+)
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from service.database.models import User, UserOutboxEvent
+from service.database.outbox import OutboxRelay
+from service.database.session import Base
+from service.database.user_handler import UserHandler
+from service.events import InMemoryPublisher
+
+
+def _url(postgresql: Any) -> str:  # noqa: ANN401
+    info = postgresql.info
+    return f"postgresql://{info.user}@{info.host}:{info.port}/{info.dbname}"
+
+
+@pytest.fixture
+def events_db(db: Session, monkeypatch: pytest.MonkeyPatch) -> Session:
+    monkeypatch.setenv("USER_EVENTS_ENABLED", "true")
+    # The trigger recording events is only installed while they are enabled.
+    Base.metadata.create_all(db.get_bind())
+    return db
+
+
+def _outbox(db: Session) -> list[tuple[str, str]]:
+    return [
+        (row.event_type, row.username)
+        for row in db.execute(
+            select(UserOutboxEvent).order_by(UserOutboxEvent.event_id),
+        ).scalars()
+    ]
+
+
+def _users(count: int) -> list[CreateUserRequest]:
+    return [
+        CreateUserRequest(username=f"user{i}", hashed_password=f"hash{i}")
+        for i in range(count)
+    ]
+
+
+def test_users_are_recorded_in_the_outbox_when_they_change(events_db: Session) -> None:
+    handler = UserHandler(events_db)
+    user = handler.create_user(_users(1)[0])
+
+    events_db.execute(
+        update(User)
+        .where(User.uuid == user.uuid)
+        .values(hashed_password="new"),  # noqa: S106
+    )
+    events_db.execute(
+        update(User).where(User.uuid == user.uuid).values(username="renamed"),
+    )
+    events_db.commit()
+
+    assert _outbox(events_db) == [(USER_CREATED, "user0"), (USER_UPDATED, "renamed")]
+
+
+def test_users_created_by_failed_transactions_are_not_recorded(
+    events_db: Session,
+) -> None:
+    events_db.add(User(username="rolled-back", hashed_password="hash"))  # noqa: S106
+    events_db.flush()
+    events_db.rollback()
+
+    assert _outbox(events_db) == []
+
+
+def test_nothing_is_recorded_while_events_are_disabled(
+    events_db: Session,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("USER_EVENTS_ENABLED", "false")
+    Base.metadata.create_all(events_db.get_bind())
+
+    UserHandler(events_db).create_user(_users(1)[0])
+
+    assert _outbox(events_db) == []
+
+
+def test_relay_publishes_events_in_order_and_empties_the_outbox(
+    events_db: Session,
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    handler = UserHandler(events_db)
+    created = [handler.create_user(user) for user in _users(5)]
+    publisher = InMemoryPublisher()
+    relay = OutboxRelay(_url(postgresql), publisher, batch_size=3)
+
+    try:
+        assert relay.relay_batch() == 3  # noqa: PLR2004
+        assert relay.relay_batch() == 2  # noqa: PLR2004
+        assert relay.relay_batch() == 0
+    finally:
+        relay.engine.dispose()
+
+    assert [event.uuid for event in publisher.published] == [
+        str(user.uuid) for user in created
+    ]
+    assert {event.event_type for event in publisher.published} == {USER_CREATED}
+    assert _outbox(events_db) == []
+
+
+class _FailingPublisher(InMemoryPublisher):
+    def publish(self, _events: Sequence[UserEvent]) -> None:
+        msg = "Broker unavailable"
+        raise ConnectionError(msg)
+
+
+def test_events_are_kept_until_they_are_published(
+    events_db: Session,
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    UserHandler(events_db).create_user(_users(1)[0])
+    relay = OutboxRelay(_url(postgresql), _FailingPublisher())
+
+    try:
+        with pytest.raises(ConnectionError):
+            relay.relay_batch()
+    finally:
+        relay.engine.dispose()
+
+    assert _outbox(events_db) == [(USER_CREATED, "user0")]
+
+
+def test_relays_do_not_publish_the_same_events(
+    events_db: Session,
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    handler = UserHandler(events_db)
+    for user in _users(4):
+        handler.create_user(user)
+    other = OutboxRelay(_url(postgresql), InMemoryPublisher(), batch_size=2)
+    relayed_meanwhile = []
+
+    class _InterleavedPublisher(InMemoryPublisher):
+        def publish(self, events: Sequence[UserEvent]) -> None:
+            # Another worker relays while this batch is still being published.
+            relayed_meanwhile.append(other.relay_batch())
+            super().publish(events)
+
+    publisher = _InterleavedPublisher()
+    relay = OutboxRelay(_url(postgresql), publisher, batch_size=2)
+    try:
+        relay.relay_batch()
+    finally:
+        relay.engine.dispose()
+        other.engine.dispose()
+
+    published = {event.event_id for event in publisher.published}
+    published_meanwhile = {event.event_id for event in other.publisher.published}
+    assert relayed_meanwhile == [2]
+    assert len(published | published_meanwhile) == 4  # noqa: PLR2004
+    assert events_db.scalar(select(func.count()).select_from(UserOutboxEvent)) == 0
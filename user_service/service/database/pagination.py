@@ -0,0 +1,92 @@
+import base64
+import binascii
+import json
+import uuid as uuid_lib
+from collections.abc import Iterable
+from datetime import datetime
+from typing import Any
+
+from common.api.exceptions.general import InvalidCursorError
+from sqlalchemy import Row
+
+# The position of a user in the listing: the `(created_at, uuid)` of the last user on
+# the previous page.
+Cursor = tuple[datetime, uuid_lib.UUID]
+
+# The position of a consumer in the change feed of one database: the
+# `(change_xid, uuid)` of the last change it has read from it.
+ChangePosition = tuple[int, uuid_lib.UUID]
+
+# A consumer's position in the change feed of each database, by shard, with `None`
+# for the databases it has not read any changes from yet.
+ChangeCursor = list[ChangePosition | None]
+
+
+def _encode(position: Any) -> str:  # noqa: ANN401
+    serialized = json.dumps(position, separators=(",", ":"))
+    return base64.urlsafe_b64encode(serialized.encode()).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> Any:  # noqa: ANN401
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded))
+
+
+def encode_cursor(created_at: datetime, uuid: uuid_lib.UUID | str) -> str:
+    return _encode([created_at.isoformat(), str(uuid)])
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Decode a cursor produced by `encode_cursor`.
+
+    Raises:
+        InvalidCursorError: If the cursor was not produced by `encode_cursor`.
+    """
+    try:
+        created_at, uuid = _decode(cursor)
+        return datetime.fromisoformat(created_at), uuid_lib.UUID(uuid)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursorError from None
+
+
+def encode_change_cursor(cursor: ChangeCursor) -> str:
+    return _encode(
+        [
+            None if position is None else [position[0], str(position[1])]
+            for position in cursor
+        ],
+    )
+
+
+def decode_change_cursor(cursor: str) -> ChangeCursor:
+    """Decode a cursor produced by `encode_change_cursor`.
+
+    Raises:
+        InvalidCursorError: If the cursor was not produced by `encode_change_cursor`.
+    """
+    try:
+        positions = [
+            None if position is None else (int(position[0]), uuid_lib.UUID(position[1]))
+            for position in _decode(cursor)
+        ]
+    except (binascii.Error, ValueError, TypeError, IndexError, KeyError):
+        raise InvalidCursorError from None
+    if not positions:
+        raise InvalidCursorError
+    return positions
+
+
+def advance_change_cursor(
+    cursor: ChangeCursor | None,
+    changes: Iterable[Row],
+) -> ChangeCursor:
+    """Return the position of a consumer once it has read `changes`, in feed order.
+
+    Each change is a row with the `shard` it was read from, its `change_xid` and its
+    `uuid`.
+    """
+    positions = list(cursor or [None])
+    for change in changes:
+        positions.extend([None] * (change.shard + 1 - len(positions)))
+        positions[change.shard] = (change.change_xid, change.uuid)
+    return positions
@@ -0,0 +1,57 @@
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from common.api.exceptions.general import InvalidCursorError
+
+from service.database.pagination import (
+    advance_change_cursor,
+    decode_change_cursor,
+    decode_cursor,
+    encode_change_cursor,
+    encode_cursor,
+)
+
+
+def test_cursor_round_trips_its_position() -> None:
+    created_at = datetime(2023, 7, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    user_uuid = uuid.uuid4()
+
+    cursor = encode_cursor(created_at, user_uuid)
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, user_uuid)
+
+
+@pytest.mark.parametrize("cursor", ["", "nope", "bm9wZQ", "WyJub3BlIiwibm9wZSJd"])
+def test_malformed_cursors_are_rejected(cursor: str) -> None:
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor)
+
+
+def test_change_cursor_round_trips_its_positions() -> None:
+    cursor = [(742, uuid.uuid4()), None]
+
+    assert decode_change_cursor(encode_change_cursor(cursor)) == cursor
+
+
+@pytest.mark.parametrize("cursor", ["", "nope", "W10", "W1siYSJdXQ", "WyJub3BlIl0"])
+def test_malformed_change_cursors_are_rejected(cursor: str) -> None:
+    with pytest.raises(InvalidCursorError):
+        decode_change_cursor(cursor)
+
+
+def test_change_cursors_advance_to_the_last_change_read_from_each_shard() -> None:
+    first, second, third = (uuid.uuid4() for _ in range(3))
+    changes = [
+        SimpleNamespace(shard=1, change_xid=10, uuid=first),
+        SimpleNamespace(shard=1, change_xid=12, uuid=second),
+        SimpleNamespace(shard=0, change_xid=11, uuid=third),
+    ]
+
+    assert advance_change_cursor(None, changes) == [(11, third), (12, second)]
+    assert advance_change_cursor([(11, third), None], changes[:1]) == [
+        (11, third),
+        (10, first),
+    ]
@@ -0,0 +1,266 @@
+import itertools
+import logging
+import threading
+import time
+from collections.abc import Callable, Iterable, Sequence
+from typing import Any, Literal
+
+from sqlalchemy import Engine, Executable, Result, Row, event, exc
+from sqlalchemy.engine import ExceptionContext
+from sqlalchemy.ext.asyncio import AsyncResult, AsyncSession
+from sqlalchemy.orm import Session
+
+# Session.info key holding the keys written by the current transaction.
+_PINNED_KEYS = "replicas.pinned_keys"
+
+# Pins are pruned lazily; this bounds how many can build up between prunes.
+_MAX_PINS = 10_000
+
+
+class ReplicaSet:
+    """Chooses the engine that serves a read: one of the replicas, or the primary.
+
+    Replicas are picked round-robin or by fewest checked-out connections. A replica
+    that fails to connect is skipped for `retry_after` seconds. Reads fall back to
+    the primary when no replica is healthy, and for keys written in the last
+    `pin_window` seconds, so a freshly registered user can always read back their
+    own data.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        primary: Engine,
+        replicas: Sequence[Engine] = (),
+        strategy: Literal["round_robin", "least_connections"] = "round_robin",
+        retry_after: float = 30,
+        pin_window: float = 5,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.retry_after = retry_after
+        self.pin_window = pin_window
+        self._clock = clock
+        self._turns = itertools.count()
+        self._unhealthy_until: dict[Engine, float] = {}
+        self._pins: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        for replica in self.replicas:
+            event.listen(replica, "handle_error", self._handle_error)
+
+    def choose(self, keys: Iterable[Any] = ()) -> Engine:
+        if not self.replicas or any(self.is_pinned(key) for key in keys):
+            return self.primary
+
+        now = self._clock()
+        healthy = [
+            replica
+            for replica in self.replicas
+            if self._unhealthy_until.get(replica, 0) <= now
+        ]
+        if not healthy:
+            logging.warning("No healthy read replicas, reading from the primary")
+            return self.primary
+
+        if self.strategy == "least_connections":
+            return min(healthy, key=lambda replica: replica.pool.checkedout())
+        return healthy[next(self._turns) % len(healthy)]
+
+    def mark_unhealthy(self, replica: Engine) -> None:
+        logging.warning("Read replica %s is unhealthy", replica.url)
+        with self._lock:
+            self._unhealthy_until[replica] = self._clock() + self.retry_after
+
+    def pin(self, keys: Iterable[Any]) -> None:
+        """Serve reads of the given keys from the primary for the pin window."""
+        now = self._clock()
+        with self._lock:
+            if len(self._pins) > _MAX_PINS:
+                self._pins = {k: t for k, t in self._pins.items() if t > now}
+            for key in keys:
+                self._pins[str(key).lower()] = now + self.pin_window
+
+    def is_pinned(self, key: Any) -> bool:  # noqa: ANN401
+        pinned_until = self._pins.get(str(key).lower())
+        return pinned_until is not None and pinned_until > self._clock()
+
+    def _handle_error(self, context: ExceptionContext) -> None:
+        # Failing to connect at all leaves `connection` unset.
+        if context.is_disconnect or context.connection is None:
+            self.mark_unhealthy(context.engine)
+
+
+class RoutingSession(Session):
+    """A session that sends reads flagged as `read_only` to a replica.
+
+    Everything else, including flushes and any statement executed without the flag,
+    uses the primary the session is bound to.
+    """
+
+    def __init__(
+        self,
+        *args: Any,  # noqa: ANN401
+        replicas: ReplicaSet | None = None,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+
+    def get_bind(
+        self,
+        mapper: Any = None,  # noqa: ANN401
+        *,
+        read_only: bool = False,
+        replica_keys: Iterable[Any] = (),
+        **kwargs: Any,  # noqa: ANN401
+    ) -> Engine:
+        if read_only and self.replicas is not None and not self._flushing:
+            return self.replicas.choose(replica_keys)
+        return super().get_bind(mapper, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _pin_committed_keys(session: RoutingSession) -> None:
+    keys = session.info.pop(_PINNED_KEYS, None)
+    if keys and session.replicas is not None:
+        session.replicas.pin(keys)
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _discard_pinned_keys(session: RoutingSession) -> None:
+    session.info.pop(_PINNED_KEYS, None)
+
+
+def pin_to_primary(session: Session | AsyncSession, keys: Iterable[Any]) -> None:
+    """Read the given keys from the primary for a while after this transaction."""
+    session.info.setdefault(_PINNED_KEYS, set()).update(keys)
+
+
+def _read_arguments(keys: Iterable[Any]) -> dict:
+    return {"read_only": True, "replica_keys": keys}
+
+
+def _has_replicas(session: Session) -> bool:
+    return (
+        isinstance(session, RoutingSession)
+        and session.replicas is not None
+        and bool(session.replicas.replicas)
+    )
+
+
+def execute_read(
+    session: Session,
+    statement: Executable,
+    params: dict | None = None,
+    keys: Iterable[Any] = (),
+    execution_options: dict | None = None,
+) -> Result:
+    """Execute a read-only statement on a replica, retrying on the primary."""
+    execution_options = execution_options or {}
+    try:
+        return session.execute(
+            statement,
+            params,
+            execution_options=execution_options,
+            bind_arguments=_read_arguments(keys),
+        )
+    except exc.OperationalError:
+        if not _has_replicas(session):
+            raise
+        logging.warning("Replica read failed, retrying on the primary", exc_info=True)
+        session.rollback()
+        return session.execute(statement, params, execution_options=execution_options)
+
+
+async def execute_read_async(
+    session: AsyncSession,
+    statement: Executable,
+    params: dict | None = None,
+    keys: Iterable[Any] = (),
+) -> Result:
+    """Execute a read-only statement on a replica, retrying on the primary."""
+    try:
+        return await session.execute(
+            statement,
+            params,
+            bind_arguments=_read_arguments(keys),
+        )
+    except exc.OperationalError:
+        if not _has_replicas(session.sync_session):
+            raise
+        logging.warning("Replica read failed, retrying on the primary", exc_info=True)
+        await session.rollback()
+        return await session.execute(statement, params)
+
+
+def _may_lag(session: Session, keys: Iterable[Any]) -> bool:
+    return _has_replicas(session) and not any(
+        session.replicas.is_pinned(key) for key in keys
+    )
+
+
+def read_first(
+    session: Session,
+    statement: Executable,
+    params: dict | None = None,
+    keys: Iterable[Any] = (),
+) -> Row | None:
+    """Read the first row of a lookup by key, from the primary if a replica has none.
+
+    Keys are only pinned to the primary by the worker that wrote them, so a replica
+    read on any other worker may not have the write yet. A missing row is read again
+    from the primary, so that callers never return or cache a miss that is not one.
+    """
+    keys = list(keys)
+    row = execute_read(session, statement, params, keys).first()
+    if row is None and _may_lag(session, keys):
+        row = session.execute(statement, params).first()
+    return row
+
+
+async def read_first_async(
+    session: AsyncSession,
+    statement: Executable,
+    params: dict | None = None,
+    keys: Iterable[Any] = (),
+) -> Row | None:
+    """Read the first row of a lookup by key, like `read_first`."""
+    keys = list(keys)
+    row = (await execute_read_async(session, statement, params, keys)).first()
+    if row is None and _may_lag(session.sync_session, keys):
+        row = (await session.execute(statement, params)).first()
+    return row
+
+
+async def stream_read_async(
+    session: AsyncSession,
+    statement: Executable,
+    params: dict | None = None,
+    keys: Iterable[Any] = (),
+    execution_options: dict | None = None,
+) -> AsyncResult:
+    """Stream the results of a read-only statement from a replica.
+
+    Like `execute_read_async`, the statement is retried on the primary if the replica
+    cannot be reached.
+    """
+    execution_options = execution_options or {}
+    try:
+        return await session.stream(
+            statement,
+            params,
+            execution_options=execution_options,
+            bind_arguments=_read_arguments(keys),
+        )
+    except exc.OperationalError:
+        if not _has_replicas(session.sync_session):
+            raise
+        logging.warning("Replica read failed, retrying on the primary", exc_info=True)
+        await session.rollback()
+        return await session.stream(
+            statement,
+            params,
+            execution_options=execution_options,
+        )
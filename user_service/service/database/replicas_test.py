@@ -0,0 +1,170 @@
+from typing import Any
+
+import pytest
+from common.api.schemas.user import CreateUserRequest
+from sqlalchemy import Engine, create_engine, insert
+
+from service.config import CacheConfig, get_database_config
+from service.database.cache import MISSING, UserCache
+from service.database.models import User
+from service.database.replicas import ReplicaSet, RoutingSession
+from service.database.session import Base, SQLAlchemyConnector
+from service.database.user_handler import UserHandler
+
+UNREACHABLE_REPLICA = "postgresql://postgres@127.0.0.1:1/postgres"
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def engine(name: str) -> Engine:
+    return create_engine(f"postgresql+psycopg2://postgres@localhost/{name}")
+
+
+def primary_url(postgresql: Any) -> str:  # noqa: ANN401
+    info = postgresql.info
+    return f"postgresql+psycopg2://{info.user}@{info.host}:{info.port}/{info.dbname}"
+
+
+def test_reads_are_spread_over_replicas_in_turn() -> None:
+    primary, first, second = engine("primary"), engine("first"), engine("second")
+    replicas = ReplicaSet(primary, [first, second])
+
+    assert [replicas.choose() for _ in range(4)] == [first, second, first, second]
+
+
+def test_reads_go_to_the_replica_with_fewest_connections() -> None:
+    primary, busy, idle = engine("primary"), engine("busy"), engine("idle")
+    replicas = ReplicaSet(primary, [busy, idle], strategy="least_connections")
+    busy.pool.checkedout = lambda: 3
+    idle.pool.checkedout = lambda: 1
+
+    assert replicas.choose() is idle
+
+
+def test_unhealthy_replicas_are_skipped_until_they_can_be_retried() -> None:
+    clock = FakeClock()
+    primary, replica = engine("primary"), engine("replica")
+    replicas = ReplicaSet(primary, [replica], retry_after=30, clock=clock)
+
+    replicas.mark_unhealthy(replica)
+    assert replicas.choose() is primary
+
+    clock.now = 31
+    assert replicas.choose() is replica
+
+
+def test_pinned_keys_are_read_from_the_primary_within_the_window() -> None:
+    clock = FakeClock()
+    primary, replica = engine("primary"), engine("replica")
+    replicas = ReplicaSet(primary, [replica], pin_window=5, clock=clock)
+
+    replicas.pin(["NewUser"])
+    assert replicas.choose(["newuser"]) is primary
+    assert replicas.choose(["OtherUser"]) is replica
+
+    clock.now = 6
+    assert replicas.choose(["NewUser"]) is replica
+
+
+def test_routing_session_only_sends_flagged_reads_to_replicas() -> None:
+    primary, replica = engine("primary"), engine("replica")
+    session = RoutingSession(bind=primary, replicas=ReplicaSet(primary, [replica]))
+
+    assert session.get_bind(read_only=True) is replica
+    assert session.get_bind() is primary
+
+
+def test_reads_fall_back_to_the_primary_when_a_replica_is_down(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    connector = SQLAlchemyConnector(
+        primary_url(postgresql),
+        replica_urls=[UNREACHABLE_REPLICA],
+    )
+    connector.create_schema()
+    with connector.engine.begin() as connection:
+        connection.execute(
+            insert(User).values(
+                username="Existing",
+                hashed_password="hash",  # noqa: S106
+            ),
+        )
+
+    sessions = connector.create_session()
+    user = UserHandler(next(sessions)).get_by_username("Existing")
+
+    assert user is not None
+    assert connector.replicas.choose() is connector.engine
+    sessions.close()
+
+
+def test_newly_created_users_are_read_back_from_the_primary(
+    postgresql: Any,  # noqa: ANN401
+    create_user_payload: CreateUserRequest,
+) -> None:
+    connector = SQLAlchemyConnector(
+        primary_url(postgresql),
+        replica_urls=[primary_url(postgresql)],
+    )
+    connector.create_schema()
+    (replica,) = connector.replica_engines
+
+    sessions = connector.create_session()
+    user_uuid = UserHandler(next(sessions)).create_user(create_user_payload).uuid
+    sessions.close()
+
+    session = connector.session_factory()
+    assert session.get_bind(read_only=True, replica_keys=[user_uuid]) is not replica
+    assert session.get_bind(read_only=True, replica_keys=["Someone"]) is replica
+    assert UserHandler(session).get_by_uuid(user_uuid) is not None
+    session.close()
+
+
+def test_users_missing_from_a_lagging_replica_are_read_from_the_primary(
+    shard_urls: list[str],
+    create_user_payload: CreateUserRequest,
+) -> None:
+    # The second database stands in for a replica that has not caught up yet.
+    primary, replica = shard_urls
+    connector = SQLAlchemyConnector(primary, replica_urls=[replica])
+    connector.create_schema()
+    Base.metadata.create_all(connector.replica_engines[0])
+    # Created by another worker, so the new user is not pinned on this one.
+    other_worker = SQLAlchemyConnector(primary)
+    sessions = other_worker.create_session()
+    user_uuid = str(UserHandler(next(sessions)).create_user(create_user_payload).uuid)
+    sessions.close()
+
+    cache = UserCache(CacheConfig())
+    session = connector.session_factory()
+    user_handler = UserHandler(session, cache)
+
+    assert (
+        user_handler.get_auth_data_and_version(create_user_payload.username) is not None
+    )
+    assert user_handler.get_username_and_version(user_uuid) is not None
+    assert cache.get_username_and_version(user_uuid) is not MISSING
+    assert user_handler.get_by_uuid(user_uuid) is not None
+    assert user_handler.get_by_username("nobody") is None
+    session.close()
+    connector.dispose()
+    other_worker.dispose()
+
+
+@pytest.mark.parametrize("strategy", ["round_robin", "least_connections"])
+def test_replica_strategy_is_read_from_configuration(
+    monkeypatch: pytest.MonkeyPatch,
+    strategy: str,
+) -> None:
+    monkeypatch.setenv("DB_REPLICA_STRATEGY", strategy)
+    config = get_database_config()
+    connector = SQLAlchemyConnector(config.url, config, [UNREACHABLE_REPLICA])
+
+    assert connector.replicas.strategy == strategy
+    assert connector.replica_engines[0].url.drivername == "postgresql+psycopg2"
@@ -1,31 +1,163 @@
 import logging
-import os
-from collections.abc import Generator
+import threading
+import uuid as uuid_lib
+from collections.abc import AsyncGenerator, Generator, Sequence
+from concurrent.futures import ThreadPoolExecutor
 
 from common.api.exceptions.general import InternalError
 from psycopg2 import OperationalError
-from sqlalchemy import create_engine, engine
+from sqlalchemy import URL, create_engine, engine, make_url
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import Pool
+
+from service.config import DatabaseConfig, get_database_config
+from service.database import deadlines
+from service.database.metrics import (
+    DatabaseMetrics,
+    TimedAsyncQueuePool,
+    TimedQueuePool,
+)
+from service.database.replicas import ReplicaSet, RoutingSession
+from service.database.sharding import shard_of
+from service.database.slow_queries import SlowQueryLog
 
 Base = declarative_base()
 
+# When users are sharded, the directory of which shard each user lives on is kept in
+# a database of its own, apart from the users tables.
+DirectoryBase = declarative_base()
+
+
+def _pool_options(config: DatabaseConfig, timed_pool: type[Pool]) -> dict:
+    options = {
+        "pool_size": config.db_pool_size,
+        "max_overflow": config.db_max_overflow,
+        "pool_timeout": config.db_pool_timeout,
+        "pool_recycle": config.db_pool_recycle,
+        "pool_pre_ping": config.db_pool_pre_ping,
+    }
+    if config.db_metrics_enabled:
+        options["poolclass"] = timed_pool
+    return options
+
+
+def _named_engines(
+    primary: engine.Engine,
+    replicas: list[engine.Engine],
+) -> list[tuple[str, engine.Engine]]:
+    return [("primary", primary)] + [
+        (f"replica-{i}", replica) for i, replica in enumerate(replicas)
+    ]
+
+
+def _database_metrics(
+    config: DatabaseConfig,
+    engines: list[tuple[str, engine.Engine]],
+) -> DatabaseMetrics:
+    metrics = DatabaseMetrics()
+    if config.db_metrics_enabled:
+        for name, instrumented in engines:
+            metrics.instrument(name, instrumented)
+    return metrics
+
+
+def _slow_query_log(
+    config: DatabaseConfig,
+    engines: list[tuple[str, engine.Engine]],
+) -> SlowQueryLog:
+    slow_queries = SlowQueryLog(
+        config.db_slow_query_threshold,
+        config.db_slow_query_explain_sample_rate,
+        config.db_slow_query_log_size,
+    )
+    if config.db_slow_query_threshold > 0:
+        for name, instrumented in engines:
+            slow_queries.instrument(name, instrumented)
+    return slow_queries
+
+
+def _hold_to_deadlines(
+    config: DatabaseConfig,
+    engines: list[tuple[str, engine.Engine]],
+) -> None:
+    if config.db_request_deadlines_enabled:
+        for _, instrumented in engines:
+            deadlines.instrument(instrumented)
+
+
+def _replica_url(replica_url: str, primary_url: URL) -> URL:
+    """Use the primary's driver for a replica, so one list serves both engine modes."""
+    return make_url(replica_url).set(drivername=primary_url.drivername)
+
+
+def _replica_set(
+    primary: engine.Engine,
+    replicas: list[engine.Engine],
+    config: DatabaseConfig,
+) -> ReplicaSet:
+    return ReplicaSet(
+        primary,
+        replicas,
+        strategy=config.db_replica_strategy,
+        retry_after=config.db_replica_retry_after,
+        pin_window=config.db_read_your_writes_window,
+    )
+
 
 class SQLAlchemyConnector:
-    def __init__(self, url: str) -> None:
-        logging.info("Establishing database connection")
-        self.engine: engine.Engine = create_engine(url)
-        Base.metadata.create_all(self.engine)
+    def __init__(
+        self,
+        url: str,
+        config: DatabaseConfig | None = None,
+        replica_urls: Sequence[str] = (),
+    ) -> None:
+        config = config or DatabaseConfig()
+        logging.info("Creating database engine")
+        self.engine: engine.Engine = create_engine(
+            url,
+            **_pool_options(config, TimedQueuePool),
+        )
+        self.replica_engines: list[engine.Engine] = [
+            create_engine(
+                _replica_url(replica_url, self.engine.url),
+                **_pool_options(config, TimedQueuePool),
+            )
+            for replica_url in replica_urls
+        ]
+        self.replicas = _replica_set(self.engine, self.replica_engines, config)
+        engines = _named_engines(self.engine, self.replica_engines)
+        self.metrics = _database_metrics(config, engines)
+        self.slow_queries = _slow_query_log(config, engines)
+        _hold_to_deadlines(config, engines)
         self.session_factory: sessionmaker = sessionmaker(
+            class_=RoutingSession,
             autocommit=False,
             autoflush=False,
             bind=self.engine,
+            replicas=self.replicas,
         )
 
+    def create_schema(self) -> None:
+        logging.info("Creating database schema")
+        Base.metadata.create_all(self.engine)
+
+    def dispose(self) -> None:
+        logging.info("Disposing database engine")
+        self.engine.dispose()
+        for replica in self.replica_engines:
+            replica.dispose()
+
     def create_session(self) -> Generator[Session, None, None]:
         try:
             db_session: Session = self.session_factory()
-            logging.info("Database connection established: %s", self.engine.url)
+            logging.info("Database session created: %s", self.engine.url)
             yield db_session
             db_session.commit()
         except OperationalError:
@@ -39,13 +171,196 @@ class SQLAlchemyConnector:
             db_session.close()
 
 
+class AsyncSQLAlchemyConnector:
+    """Asyncio counterpart of `SQLAlchemyConnector`, backed by asyncpg."""
+
+    def __init__(
+        self,
+        url: str,
+        config: DatabaseConfig | None = None,
+        replica_urls: Sequence[str] = (),
+    ) -> None:
+        config = config or DatabaseConfig()
+        logging.info("Creating async database engine")
+        self.engine: AsyncEngine = create_async_engine(
+            url,
+            **_pool_options(config, TimedAsyncQueuePool),
+        )
+        self.replica_engines: list[AsyncEngine] = [
+            create_async_engine(
+                _replica_url(replica_url, self.engine.url),
+                **_pool_options(config, TimedAsyncQueuePool),
+            )
+            for replica_url in replica_urls
+        ]
+        replica_sync_engines = [replica.sync_engine for replica in self.replica_engines]
+        self.replicas = _replica_set(
+            self.engine.sync_engine,
+            replica_sync_engines,
+            config,
+        )
+        engines = _named_engines(self.engine.sync_engine, replica_sync_engines)
+        self.metrics = _database_metrics(config, engines)
+        self.slow_queries = _slow_query_log(config, engines)
+        _hold_to_deadlines(config, engines)
+        # Instances are used after commit (e.g. to build the response), and lazy
+        # refreshes are not possible outside of an awaited call.
+        self.session_factory: async_sessionmaker = async_sessionmaker(
+            sync_session_class=RoutingSession,
+            autoflush=False,
+            expire_on_commit=False,
+            bind=self.engine,
+            replicas=self.replicas,
+        )
+
+    async def create_schema(self) -> None:
+        logging.info("Creating database schema")
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+    async def dispose(self) -> None:
+        logging.info("Disposing async database engine")
+        await self.engine.dispose()
+        for replica in self.replica_engines:
+            await replica.dispose()
+
+    async def create_session(self) -> AsyncGenerator[AsyncSession, None]:
+        db_session: AsyncSession = self.session_factory()
+        try:
+            logging.info("Async database session created: %s", self.engine.url)
+            yield db_session
+            await db_session.commit()
+        except SQLAlchemyError:
+            logging.exception("Error committing to the database")
+            await db_session.rollback()
+            raise InternalError from None
+        finally:
+            await db_session.close()
+
+
+class ShardedConnector:
+    """Users spread over several databases, each with its own pool of connections.
+
+    A user lives on the shard picked by `shard_of` their UUID. The directory database
+    maps each username to its user's UUID and shard, so that any lookup goes to a
+    single shard, and its primary key keeps usernames unique across every shard.
+    """
+
+    def __init__(
+        self,
+        directory_url: str,
+        shard_urls: Sequence[str],
+        config: DatabaseConfig | None = None,
+    ) -> None:
+        config = config or DatabaseConfig()
+        logging.info("Creating database engines for %s shards", len(shard_urls))
+        self.directory: engine.Engine = create_engine(
+            directory_url,
+            **_pool_options(config, TimedQueuePool),
+        )
+        self.shards: list[engine.Engine] = [
+            create_engine(
+                _replica_url(shard_url, self.directory.url),
+                **_pool_options(config, TimedQueuePool),
+            )
+            for shard_url in shard_urls
+        ]
+        engines = [("directory", self.directory)] + [
+            (f"shard-{i}", shard) for i, shard in enumerate(self.shards)
+        ]
+        self.metrics = _database_metrics(config, engines)
+        self.slow_queries = _slow_query_log(config, engines)
+        _hold_to_deadlines(config, engines)
+        self.directory_session: sessionmaker = sessionmaker(
+            autoflush=False,
+            expire_on_commit=False,
+            bind=self.directory,
+        )
+        self.shard_sessions: list[sessionmaker] = [
+            sessionmaker(autoflush=False, expire_on_commit=False, bind=shard)
+            for shard in self.shards
+        ]
+        # Lookups spanning several shards query them all at once.
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(self.shards),
+            thread_name_prefix="shard-query",
+        )
+
+    def shard_of(self, uuid: uuid_lib.UUID | str) -> int:
+        return shard_of(uuid, len(self.shards))
+
+    def create_schema(self) -> None:
+        logging.info("Creating database schema")
+        DirectoryBase.metadata.create_all(self.directory)
+        for shard in self.shards:
+            Base.metadata.create_all(shard)
+
+    def dispose(self) -> None:
+        logging.info("Disposing database engines")
+        self.executor.shutdown(wait=False)
+        self.directory.dispose()
+        for shard in self.shards:
+            shard.dispose()
+
+
+Connector = SQLAlchemyConnector | AsyncSQLAlchemyConnector | ShardedConnector
+
+# One engine (and therefore one connection pool) is shared by every request handled
+# by this worker process.
+_connector: Connector | None = None
+_connector_lock = threading.Lock()
+
+
+def _create_connector() -> Connector:
+    config = get_database_config()
+    if config.db_shard_urls:
+        return ShardedConnector(config.url, config.db_shard_urls, config)
+    if config.db_async:
+        return AsyncSQLAlchemyConnector(
+            config.async_url,
+            config,
+            config.db_replica_urls,
+        )
+    return SQLAlchemyConnector(config.url, config, config.db_replica_urls)
+
+
+def get_database_connector() -> Connector:
+    """Return the process-wide connector, creating it on first use.
+
+    `DB_ASYNC` selects between the psycopg2 and asyncpg engines so that both can be
+    run (and benchmarked) from the same build, and `DB_SHARD_URLS` spreads users over
+    several databases.
+    """
+    global _connector  # noqa: PLW0603
+
+    if _connector is None:
+        with _connector_lock:
+            if _connector is None:
+                _connector = _create_connector()
+    return _connector
+
+
+async def init_database() -> Connector:
+    """Create the shared engine and the schema; called once at startup."""
+    connector = get_database_connector()
+    if isinstance(connector, AsyncSQLAlchemyConnector):
+        await connector.create_schema()
+    else:
+        connector.create_schema()
+    return connector
+
+
+async def close_database() -> None:
+    """Dispose of the shared engine and its pooled connections at shutdown."""
+    global _connector
+
+    connector, _connector = _connector, None
+    if isinstance(connector, AsyncSQLAlchemyConnector):
+        await connector.dispose()
+    elif connector is not None:
+        connector.dispose()
+
+
 def create_database_session() -> Generator[Session, None, None]:
     logging.debug("Creating database session")
-    user = os.getenv("DB_USER")
-    password = os.getenv("DB_PASS")
-    host = os.getenv("DB_HOST")
-    port = os.getenv("DB_PORT")
-    name = os.getenv("DB_NAME")
-    url = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{name}"
-    db_connection = SQLAlchemyConnector(url)
-    yield from db_connection.create_session()
+    yield from get_database_connector().create_session()
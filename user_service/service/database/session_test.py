@@ -7,9 +7,23 @@ from common.api.exceptions.general import InternalError
 from psycopg2 import OperationalError
 from sqlalchemy import engine
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from service.database.session import SQLAlchemyConnector, create_database_session
+from service.config import DatabaseConfig
+from service.database import session as session_module
+from service.database.session import (
+    AsyncSQLAlchemyConnector,
+    SQLAlchemyConnector,
+    close_database,
+    create_database_session,
+    get_database_connector,
+)
+
+
+@pytest.fixture(autouse=True)
+def _reset_shared_connector(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(session_module, "_connector", None)
 
 
 @pytest.fixture
@@ -82,3 +96,71 @@ def test_database_connector_establishes_a_database_connection_successfully(
     session = next(session_generator, None)
     assert session is not None
     assert isinstance(session, Session)
+
+
+def test_database_connector_applies_pool_configuration() -> None:
+    config = DatabaseConfig(
+        db_pool_size=3,
+        db_max_overflow=7,
+        db_pool_recycle=60,
+        db_pool_pre_ping=False,
+    )
+
+    connector = SQLAlchemyConnector(config.url, config)
+
+    assert connector.engine.pool.size() == config.db_pool_size
+    assert connector.engine.pool._max_overflow == config.db_max_overflow
+    assert connector.engine.pool._recycle == config.db_pool_recycle
+    assert connector.engine.pool._pre_ping is False
+
+
+def test_database_connector_is_shared_between_sessions() -> None:
+    first = get_database_connector()
+    second = get_database_connector()
+
+    assert first is second
+
+
+@pytest.mark.asyncio
+async def test_closing_the_database_disposes_of_the_shared_connector() -> None:
+    connector = get_database_connector()
+
+    with patch.object(connector, "dispose") as dispose:
+        await close_database()
+
+    dispose.assert_called_once()
+    assert get_database_connector() is not connector
+
+
+def test_database_sessions_are_checked_out_from_the_shared_engine(
+    postgresql: Any,  # noqa: ANN401
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    info = postgresql.info
+    monkeypatch.setenv("DB_USER", info.user)
+    monkeypatch.setenv("DB_HOST", info.host)
+    monkeypatch.setenv("DB_PORT", str(info.port))
+    monkeypatch.setenv("DB_NAME", info.dbname)
+
+    sessions = [create_database_session() for _ in range(3)]
+    engines = {next(session).get_bind() for session in sessions}
+
+    assert engines == {get_database_connector().engine}
+
+
+@pytest.mark.asyncio
+async def test_async_database_connector_provides_async_sessions(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    info = postgresql.info
+    connector = AsyncSQLAlchemyConnector(
+        f"postgresql+asyncpg://{info.user}@{info.host}:{info.port}/{info.dbname}",
+    )
+    await connector.create_schema()
+
+    session_generator = connector.create_session()
+    session = await anext(session_generator)
+
+    assert isinstance(session, AsyncSession)
+    await session_generator.aclose()
+    await connector.dispose()
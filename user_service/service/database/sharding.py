@@ -0,0 +1,31 @@
+import hashlib
+import uuid as uuid_lib
+
+_JUMP_MULTIPLIER = 2862933555777941757
+_UINT64 = (1 << 64) - 1
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Map a 64-bit key to one of `buckets` with Lamping and Veach's jump hash.
+
+    Going from N to N + 1 buckets moves only the keys that land in the new bucket,
+    about 1 / (N + 1) of them, so adding a shard moves the fewest users possible.
+    """
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * _JUMP_MULTIPLIER + 1) & _UINT64
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_key(uuid: uuid_lib.UUID | str) -> int:
+    # UUIDs are hashed rather than used directly, since time-ordered UUIDs are far
+    # from uniformly distributed.
+    uuid_bytes = uuid_lib.UUID(str(uuid)).bytes
+    return int.from_bytes(hashlib.blake2b(uuid_bytes, digest_size=8).digest(), "little")
+
+
+def shard_of(uuid: uuid_lib.UUID | str, shards: int) -> int:
+    """Return the index of the shard that the user with this UUID is placed on."""
+    return jump_hash(shard_key(uuid), shards)
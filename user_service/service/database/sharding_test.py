@@ -0,0 +1,191 @@
+import uuid
+from collections import Counter
+from collections.abc import Generator
+
+import pytest
+from common.api.exceptions.user import UserAlreadyExistsError
+from common.api.schemas.user import CreateUserRequest, UpdatePasswordHashRequest
+from sqlalchemy import select
+
+from service.database.models import User, UserShard
+from service.database.pagination import advance_change_cursor
+from service.database.session import ShardedConnector
+from service.database.sharding import jump_hash, shard_of
+from service.database.user_handler import ShardedUserHandler
+
+
+@pytest.fixture
+def connector(shard_urls: list[str]) -> Generator[ShardedConnector, None, None]:
+    # The first shard doubles as the directory, as when sharding an existing database.
+    connector = ShardedConnector(shard_urls[0], shard_urls)
+    connector.create_schema()
+    yield connector
+    connector.dispose()
+
+
+def _users(count: int) -> list[CreateUserRequest]:
+    return [
+        CreateUserRequest(username=f"user{i}", hashed_password=f"hash{i}")
+        for i in range(count)
+    ]
+
+
+def test_jump_hash_spreads_keys_evenly() -> None:
+    counts = Counter(shard_of(uuid.uuid4(), 4) for _ in range(10_000))
+
+    assert set(counts) == {0, 1, 2, 3}
+    assert all(2000 < count < 3000 for count in counts.values())  # noqa: PLR2004
+
+
+def test_adding_a_shard_only_moves_keys_onto_it() -> None:
+    keys = [uuid.uuid4().int >> 64 for _ in range(10_000)]
+
+    moved = [key for key in keys if jump_hash(key, 4) != jump_hash(key, 5)]
+
+    assert all(jump_hash(key, 5) == 4 for key in moved)  # noqa: PLR2004
+    assert 1500 < len(moved) < 2500  # noqa: PLR2004
+
+
+def test_users_are_created_on_the_shard_their_uuid_hashes_to(
+    connector: ShardedConnector,
+) -> None:
+    handler = ShardedUserHandler(connector)
+
+    created = [handler.create_user(user) for user in _users(20)]
+
+    for shard, sessions in enumerate(connector.shard_sessions):
+        with sessions() as session:
+            uuids = set(session.execute(select(User.uuid)).scalars())
+        assert uuids == {
+            user.uuid for user in created if connector.shard_of(user.uuid) == shard
+        }
+    assert 0 < len(uuids) < len(created)
+
+
+def test_users_are_found_by_username_and_uuid(connector: ShardedConnector) -> None:
+    handler = ShardedUserHandler(connector)
+    created = [handler.create_user(user) for user in _users(10)]
+
+    for user in created:
+        assert handler.get_by_username(user.username).uuid == user.uuid
+        assert handler.get_by_uuid(str(user.uuid)).username == user.username
+        username, _ = handler.get_username_and_version(str(user.uuid))
+        assert username == user.username
+        auth_data, _ = handler.get_auth_data_and_version(user.username)
+        assert auth_data.uuid == str(user.uuid)
+    assert handler.get_by_username("nobody") is None
+    assert handler.get_by_uuid(str(uuid.uuid4())) is None
+    assert handler.get_auth_data_and_version("nobody") is None
+
+
+def test_usernames_are_unique_across_shards(connector: ShardedConnector) -> None:
+    handler = ShardedUserHandler(connector)
+    [user] = _users(1)
+    handler.create_user(user)
+
+    with pytest.raises(UserAlreadyExistsError):
+        handler.create_user(user)
+
+    with connector.directory_session() as directory:
+        assert directory.execute(select(UserShard.username)).scalars().all() == [
+            user.username,
+        ]
+
+
+def test_batch_lookups_span_every_shard(connector: ShardedConnector) -> None:
+    handler = ShardedUserHandler(connector)
+    created = [handler.create_user(user) for user in _users(20)]
+    unknown = str(uuid.uuid4())
+
+    usernames = handler.get_usernames_by_uuids(
+        [str(user.uuid) for user in created] + [unknown],
+    )
+
+    assert usernames == {str(user.uuid): user.username for user in created}
+
+
+def test_users_not_yet_moved_are_found_through_the_directory(
+    connector: ShardedConnector,
+) -> None:
+    handler = ShardedUserHandler(connector)
+    user = handler.create_user(_users(1)[0])
+    # As though the user had been placed before the shard they now hash to existed.
+    old_shard = 1 - connector.shard_of(user.uuid)
+    with connector.shard_sessions[connector.shard_of(user.uuid)].begin() as session:
+        moved = session.get(User, user.uuid)
+        row = {c.name: getattr(moved, c.name) for c in User.__table__.columns}
+        session.delete(moved)
+    with connector.shard_sessions[old_shard].begin() as session:
+        session.add(User(**row))
+    with connector.directory_session.begin() as directory:
+        directory.get(UserShard, user.username).shard = old_shard
+
+    assert handler.get_by_uuid(str(user.uuid)).username == user.username
+    assert handler.get_username_and_version(str(user.uuid))[0] == user.username
+    assert handler.get_by_username(user.username).uuid == user.uuid
+    assert handler.replace_password_hash(
+        str(user.uuid),
+        UpdatePasswordHashRequest(
+            hashed_password="rehashed",  # noqa: S106
+            previous_hashed_password=row["hashed_password"],
+        ),
+    )
+    auth_data, _ = handler.get_auth_data_and_version(user.username)
+    assert auth_data.hashed_password == "rehashed"  # noqa: S105
+
+
+def test_listing_and_export_merge_shards_in_creation_order(
+    connector: ShardedConnector,
+) -> None:
+    handler = ShardedUserHandler(connector)
+    created = [handler.create_user(user) for user in _users(15)]
+    expected = sorted((user.created_at, user.uuid) for user in created)
+
+    page = handler.list_users(10)
+    exported = [row for batch in handler.export_users(4) for row in batch]
+
+    assert [(row.created_at, row.uuid) for row in page] == expected[:10]
+    assert [(row.created_at, row.uuid) for row in exported] == expected
+
+
+def test_username_search_merges_shards_in_code_point_order(
+    connector: ShardedConnector,
+) -> None:
+    handler = ShardedUserHandler(connector)
+    for user in _users(15):
+        handler.create_user(user)
+
+    assert handler.search_usernames("user1", 4) == [
+        "user1",
+        "user10",
+        "user11",
+        "user12",
+    ]
+
+
+def test_user_versions_are_read_from_the_user_shard(
+    connector: ShardedConnector,
+) -> None:
+    handler = ShardedUserHandler(connector)
+    users = [handler.create_user(user) for user in _users(4)]
+
+    for user in users:
+        assert handler.get_version_by_uuid(str(user.uuid)) == user.created_at
+        _, by_username = handler.get_auth_data_and_version(user.username)
+        assert by_username == user.created_at
+    assert handler.get_auth_data_and_version("nobody") is None
+
+
+def test_change_feed_follows_every_shard(connector: ShardedConnector) -> None:
+    handler = ShardedUserHandler(connector)
+    created = [handler.create_user(user) for user in _users(15)]
+
+    listed = []
+    cursor = None
+    while changes := handler.list_changes(4, cursor):
+        listed.extend(change.uuid for change in changes)
+        cursor = advance_change_cursor(cursor, changes)
+
+    assert sorted(listed) == sorted(user.uuid for user in created)
+    assert cursor is not None
+    assert len(cursor) == 2  # noqa: PLR2004
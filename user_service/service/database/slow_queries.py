@@ -0,0 +1,176 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any
+
+from sqlalchemy import Engine, event
+from sqlalchemy.engine import Connection, ExceptionContext, ExecutionContext
+
+from service.database.metrics import fingerprint
+
+REDACTED = "<redacted>"
+
+# Connection.info key holding the start times of the statements being executed.
+_QUERY_STARTED = "slow_queries.query_started"
+
+_EXPLAIN = "EXPLAIN (ANALYZE, BUFFERS) "
+_EXPLAIN_SAVEPOINT = "slow_query_explain"
+
+# Plans print the values compared by their conditions as literals, parameters
+# included, as psycopg2 interpolates those into the statement before sending it.
+# Strings are scrubbed from every line, and numbers only from those of conditions
+# and keys, as the others hold the costs, row counts and timings of the plan.
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"-?\b\d+(?:\.\d+)?\b")
+_PLAN_EXPRESSION = re.compile(
+    r"^(\s*(?!Rows Removed)(?:[\w-]+ )*(?:Cond|Filter|Key): )(.*)$",
+)
+
+
+@dataclass(frozen=True)
+class SlowQuery:
+    engine: str
+    statement: str
+    parameters: Any
+    seconds: float
+    occurred_at: str
+    plan: list[str] | None = None
+
+
+def redact(parameters: Any) -> Any:  # noqa: ANN401
+    """Replace every parameter value, keeping only the shape of the parameters."""
+    if isinstance(parameters, dict):
+        return {name: REDACTED for name in parameters}
+    if isinstance(parameters, list | tuple):
+        return [
+            redact(p) if isinstance(p, dict | list | tuple) else REDACTED
+            for p in parameters
+        ]
+    return REDACTED
+
+
+class SlowQueryLog:
+    """Logs statements slower than a threshold and keeps the most recent in memory.
+
+    For a sample of the slow `SELECT`s, the statement is run again under
+    `EXPLAIN (ANALYZE, BUFFERS)` on the same connection and its plan is kept with the
+    entry. The plan is captured inside a savepoint, so a failure cannot abort the
+    caller's transaction. Streamed results are never explained, since that would run
+    the whole scan twice.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        explain_sample_rate: float = 0.0,
+        size: int = 100,
+    ) -> None:
+        self.threshold = threshold
+        self.explain_sample_rate = explain_sample_rate
+        self._entries: deque[SlowQuery] = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def instrument(self, name: str, engine: Engine) -> None:
+        def after_cursor_execute(
+            conn: Connection,
+            _cursor: Any,  # noqa: ANN401
+            statement: str,
+            parameters: Any,  # noqa: ANN401
+            context: ExecutionContext,
+            executemany: bool,  # noqa: FBT001
+        ) -> None:
+            seconds = time.perf_counter() - conn.info[_QUERY_STARTED].pop()
+            if seconds < self.threshold:
+                return
+
+            plan = None
+            if not executemany and self._should_explain(statement, context):
+                plan = _explain(conn, statement, parameters)
+            self.record(
+                SlowQuery(
+                    engine=name,
+                    statement=fingerprint(statement),
+                    parameters=redact(parameters),
+                    seconds=seconds,
+                    occurred_at=datetime.now(timezone.utc).isoformat(),
+                    plan=plan,
+                ),
+            )
+
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+    def record(self, entry: SlowQuery) -> None:
+        logging.warning(
+            "Slow query on %s took %.3fs: %s %s",
+            entry.engine,
+            entry.seconds,
+            entry.statement,
+            entry.parameters,
+        )
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self) -> list[dict[str, Any]]:
+        """Return the recorded slow queries, most recent first."""
+        with self._lock:
+            return [asdict(entry) for entry in reversed(self._entries)]
+
+    def _should_explain(self, statement: str, context: ExecutionContext) -> bool:
+        return (
+            statement.lstrip()[:6].upper() == "SELECT"
+            and not context.execution_options.get("stream_results", False)
+            and self._random.random() < self.explain_sample_rate
+        )
+
+
+def scrub_plan_line(line: str) -> str:
+    """Replace the literal values in a line of a plan with `?`."""
+    line = _STRING_LITERAL.sub("?", line)
+    expression = _PLAN_EXPRESSION.match(line)
+    if expression is None:
+        return line
+    label, condition = expression.groups()
+    return label + _NUMBER_LITERAL.sub("?", condition)
+
+
+def _explain(
+    conn: Connection,
+    statement: str,
+    parameters: Any,  # noqa: ANN401
+) -> list[str] | None:
+    # A new cursor on the same DBAPI connection bypasses the engine's events, and
+    # keeps the original cursor's results intact.
+    explain_cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        explain_cursor.execute(f"SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+        try:
+            explain_cursor.execute(_EXPLAIN + statement, parameters)
+            plan = [scrub_plan_line(row[0]) for row in explain_cursor.fetchall()]
+        except Exception:
+            explain_cursor.execute(f"ROLLBACK TO SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+            raise
+        explain_cursor.execute(f"RELEASE SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+    except Exception:  # noqa: BLE001
+        logging.warning("Could not capture the plan of a slow query", exc_info=True)
+        return None
+    finally:
+        explain_cursor.close()
+    return plan
+
+
+def _before_cursor_execute(conn: Connection, *_: Any) -> None:  # noqa: ANN401
+    conn.info.setdefault(_QUERY_STARTED, []).append(time.perf_counter())
+
+
+def _handle_error(context: ExceptionContext) -> None:
+    # A failed statement never reaches `after_cursor_execute`.
+    if context.connection is not None and context.connection.info.get(_QUERY_STARTED):
+        context.connection.info[_QUERY_STARTED].pop()
@@ -0,0 +1,141 @@
+from typing import Any
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from service.database.slow_queries import (
+    REDACTED,
+    SlowQueryLog,
+    redact,
+    scrub_plan_line,
+)
+
+
+def _url(postgresql: Any, driver: str = "postgresql") -> str:  # noqa: ANN401
+    info = postgresql.info
+    return f"{driver}://{info.user}@{info.host}:{info.port}/{info.dbname}"
+
+
+def test_parameter_values_are_redacted() -> None:
+    assert redact({"username": "bob"}) == {"username": REDACTED}
+    assert redact(("bob", 1)) == [REDACTED, REDACTED]
+    assert redact([{"username": "bob"}]) == [{"username": REDACTED}]
+
+
+def test_literals_are_scrubbed_from_plan_conditions() -> None:
+    assert (
+        scrub_plan_line("  ->  Index Scan using ix on users  (cost=0.15..8.17 rows=1)")
+        == "  ->  Index Scan using ix on users  (cost=0.15..8.17 rows=1)"
+    )
+    assert (
+        scrub_plan_line("        Index Cond: (username = 'o''brien'::text)")
+        == "        Index Cond: (username = ?::text)"
+    )
+    assert (
+        scrub_plan_line("  Filter: ((age > 30) AND (score < -1.5))")
+        == "  Filter: ((age > ?) AND (score < ?))"
+    )
+    assert (
+        scrub_plan_line("  Rows Removed by Filter: 3") == "  Rows Removed by Filter: 3"
+    )
+    assert scrub_plan_line("Execution Time: 0.042 ms") == "Execution Time: 0.042 ms"
+
+
+def test_fast_statements_are_not_logged(postgresql: Any) -> None:  # noqa: ANN401
+    engine = create_engine(_url(postgresql))
+    slow_queries = SlowQueryLog(threshold=60)
+    slow_queries.instrument("primary", engine)
+
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+    assert slow_queries.entries() == []
+    engine.dispose()
+
+
+def test_slow_selects_are_logged_with_their_plan(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    engine = create_engine(_url(postgresql))
+    slow_queries = SlowQueryLog(threshold=0, explain_sample_rate=1)
+    slow_queries.instrument("primary", engine)
+
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE secrets (value text)"))
+        result = connection.execute(
+            text("SELECT :secret AS value, pg_sleep(0.01)"),
+            {"secret": "hunter2"},
+        )
+        assert result.scalar() == "hunter2"
+        # The transaction is still usable after the plan was captured.
+        connection.execute(text("INSERT INTO secrets VALUES ('x')"))
+
+    insert_entry, select_entry, create_entry = slow_queries.entries()
+    assert select_entry["parameters"] == {"secret": REDACTED}
+    assert "hunter2" not in str(select_entry)
+    assert any("Execution Time" in line for line in select_entry["plan"])
+    assert insert_entry["plan"] is None
+    assert create_entry["plan"] is None
+    engine.dispose()
+
+
+def test_plans_do_not_contain_parameter_values(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    engine = create_engine(_url(postgresql))
+    slow_queries = SlowQueryLog(threshold=0, explain_sample_rate=1)
+
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE accounts (name text, pin integer)"))
+        slow_queries.instrument("primary", engine)
+        connection.execute(
+            text("SELECT * FROM accounts WHERE name = :name AND pin = :pin"),
+            {"name": "alice", "pin": 4321},
+        )
+
+    (entry,) = slow_queries.entries()
+    plan = "\n".join(entry["plan"])
+    assert "Filter: " in plan
+    assert "alice" not in plan
+    assert "4321" not in plan
+    engine.dispose()
+
+
+def test_ring_buffer_keeps_the_most_recent_entries(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    engine = create_engine(_url(postgresql))
+    slow_queries = SlowQueryLog(threshold=0, size=2)
+    slow_queries.instrument("primary", engine)
+
+    with engine.connect() as connection:
+        for i in range(3):
+            connection.execute(text(f"SELECT {i} AS n"))
+
+    assert [entry["statement"] for entry in slow_queries.entries()] == [
+        "SELECT ? AS n",
+        "SELECT ? AS n",
+    ]
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_plans_are_captured_through_asyncpg(
+    postgresql: Any,  # noqa: ANN401
+) -> None:
+    engine = create_async_engine(_url(postgresql, "postgresql+asyncpg"))
+    slow_queries = SlowQueryLog(threshold=0, explain_sample_rate=1)
+    slow_queries.instrument("primary", engine.sync_engine)
+
+    async with engine.connect() as connection:
+        result = await connection.execute(
+            text("SELECT CAST(:n AS integer) AS n"),
+            {"n": 1},
+        )
+        assert result.scalar() == 1
+
+    (entry,) = slow_queries.entries()
+    assert entry["parameters"] == [REDACTED]
+    assert entry["plan"]
+    await engine.dispose()
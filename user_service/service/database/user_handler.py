@@ -1,27 +1,354 @@
+import contextlib
+import contextvars
+import functools
+import heapq
+import itertools
 import logging
+import operator
+import sys
+import uuid as uuid_lib
+from collections import defaultdict
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    Sequence,
+)
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from typing import Any
 
+from common.api.exceptions.general import InvalidCursorError
 from common.api.exceptions.user import (
     UserAlreadyExistsError,
+    UserCreationError,
+)
+from common.api.schemas.user import (
+    CreateUserRequest,
+    UpdatePasswordHashRequest,
+    UserAuthData,
+)
+from fastapi.concurrency import contextmanager_in_threadpool, run_in_threadpool
+from sqlalchemy import (
+    UUID,
+    Executable,
+    Row,
+    Select,
+    any_,
+    bindparam,
+    delete,
+    exc,
+    func,
+    literal,
+    select,
+    tuple_,
+    update,
 )
-from common.api.schemas.user import CreateUserRequest
-from fastapi import Depends
-from psycopg2 import IntegrityError
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from service.database.models import User
-from service.database.session import create_database_session
+from service.database.bloom import UsernameFilter, get_username_filter
+from service.database.cache import MISSING, UserCache, get_user_cache
+from service.database.group_commit import (
+    AsyncGroupCommitter,
+    GroupCommitter,
+    get_group_committer,
+)
+from service.database.models import (
+    OLDEST_RUNNING_TRANSACTION_ID,
+    User,
+    UserShard,
+    new_user_key,
+)
+from service.database.pagination import ChangeCursor, ChangePosition, Cursor
+from service.database.replicas import (
+    execute_read,
+    execute_read_async,
+    pin_to_primary,
+    read_first,
+    read_first_async,
+    stream_read_async,
+)
+from service.database.session import (
+    AsyncSQLAlchemyConnector,
+    ShardedConnector,
+    get_database_connector,
+)
+
+
+def _user_by_username(username: str) -> Select:
+    return select(User).where(User.username == username).limit(1)
+
+
+def _user_by_uuid(uuid: str) -> Select:
+    return select(User).where(User.uuid == uuid).limit(1)
+
+
+# Hot-path lookups select only the columns they return, so no ORM instances are built
+# and the statements compile once and are reused from the compiled cache. A user's
+# version changes whenever their row does, so it tells whether a copy of the user held
+# by a caller is still current. It is read by the same statement as the data it
+# versions, so the two always match.
+_user_version = func.coalesce(User.updated_at, User.created_at)
+_username_and_version_by_uuid = (
+    select(User.username, _user_version.label("version"))
+    .where(User.uuid == bindparam("uuid"))
+    .limit(1)
+)
+_auth_data_and_version_by_username = (
+    select(User.uuid, User.hashed_password, _user_version.label("version"))
+    .where(User.username == bindparam("username"))
+    .limit(1)
+)
+
+
+def _to_username_and_version(row: Row | None) -> tuple[str, datetime] | None:
+    return None if row is None else (row.username, row.version)
+
+
+def _to_auth_data_and_version(row: Row | None) -> tuple[UserAuthData, datetime] | None:
+    return None if row is None else (_to_auth_data(row), row.version)
+
+
+def _to_auth_data(row: Row | None) -> UserAuthData | None:
+    if row is None:
+        return None
+    # The row comes straight from the users table, so it needs no validation.
+    return UserAuthData.model_construct(
+        uuid=str(row.uuid),
+        hashed_password=row.hashed_password,
+    )
+
+
+# Resolves a whole batch of users with a single `uuid = ANY(:uuids)` index lookup.
+_usernames_by_uuids = select(User.uuid, User.username).where(
+    User.uuid == any_(bindparam("uuids", type_=ARRAY(UUID(as_uuid=True)))),
+)
+
+
+# Users in listing order. The `(created_at, uuid)` keyset is unique, so pages never
+# skip or repeat users created in the same instant.
+_listed_users = select(User.uuid, User.username, User.created_at).order_by(
+    User.created_at,
+    User.uuid,
+)
+
+
+_listing_order = operator.attrgetter("created_at", "uuid")
+
+
+def _users_after(cursor: Cursor | None, limit: int) -> Select:
+    statement = _listed_users.limit(limit)
+    if cursor is not None:
+        statement = statement.where(tuple_(User.created_at, User.uuid) > cursor)
+    return statement
+
+
+# The change feed lists users in the order of the transactions that last wrote them.
+# Transactions do not commit in that order, so only the writes of transactions older
+# than every running one are listed: no write can commit behind them any more, and a
+# consumer's position in the feed only ever moves forward.
+_feed_order = operator.attrgetter("change_xid", "uuid")
+
+
+def _changes_after(
+    position: ChangePosition | None,
+    limit: int,
+    shard: int = 0,
+) -> Select:
+    statement = (
+        select(
+            literal(shard).label("shard"),
+            User.change_xid,
+            User.uuid,
+            User.username,
+            _user_version.label("version"),
+        )
+        .where(User.change_xid < OLDEST_RUNNING_TRANSACTION_ID)
+        .order_by(User.change_xid, User.uuid)
+        .limit(limit)
+    )
+    if position is not None:
+        statement = statement.where(tuple_(User.change_xid, User.uuid) > position)
+    return statement
+
+
+def _change_positions(after: ChangeCursor | None, shards: int) -> ChangeCursor:
+    """Return the position of a cursor in the feed of each of `shards` databases.
+
+    Raises:
+        InvalidCursorError: If the cursor has positions in more databases than there
+            are.
+    """
+    positions = list(after or [])
+    if len(positions) > shards:
+        raise InvalidCursorError
+    return positions + [None] * (shards - len(positions))
+
+
+# Usernames compared by code point, matching the `ix_users_username_prefix` index and
+# the order of Python strings.
+_username_key = User.username.collate("C")
+
+
+def _prefix_upper_bound(prefix: str) -> str | None:
+    """Return the least string greater than every string starting with `prefix`.
+
+    `None` means there is no such string, when the prefix is only made of the highest
+    code point.
+    """
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    following = ord(prefix[-1]) + 1
+    # Surrogates cannot be encoded, so they are not in any stored username.
+    if 0xD800 <= following <= 0xDFFF:  # noqa: PLR2004
+        following = 0xE000
+    return prefix[:-1] + chr(following)
+
+
+def _usernames_starting_with(prefix: str, limit: int) -> Select:
+    # A range rather than `LIKE 'prefix%'`, which only uses the index when the prefix
+    # is known at planning time and contains no wildcards.
+    statement = (
+        select(User.username)
+        .where(_username_key >= prefix)
+        .order_by(_username_key)
+        .limit(limit)
+    )
+    if (upper := _prefix_upper_bound(prefix)) is not None:
+        statement = statement.where(_username_key < upper)
+    return statement
+
+
+# Registration in a single round trip: a username that is already taken inserts
+# nothing and returns no row, instead of raising and aborting the transaction.
+_insert_user = (
+    insert(User)
+    .on_conflict_do_nothing(index_elements=[User.username])
+    .returning(User.uuid, User.created_at)
+)
+
+
+# A rehash only replaces the hash that it was computed from, so it never overwrites a
+# password that was changed in the meantime.
+_replace_password_hash = (
+    update(User)
+    .where(
+        User.uuid == bindparam("user_uuid"),
+        User.hashed_password == bindparam("previous_hash"),
+    )
+    .values(hashed_password=bindparam("new_hash"))
+    .returning(User.username)
+)
+
+
+def _password_hash_replacement(uuid: str, hashes: UpdatePasswordHashRequest) -> dict:
+    return {
+        "user_uuid": uuid,
+        "previous_hash": hashes.previous_hashed_password,
+        "new_hash": hashes.hashed_password,
+    }
+
+
+# The directory of a sharded deployment, which maps every username to its user's UUID
+# and shard.
+_shard_by_username = select(UserShard.shard).where(
+    UserShard.username == bindparam("username"),
+)
+_directory_entries_by_uuids = select(
+    UserShard.uuid,
+    UserShard.username,
+    UserShard.shard,
+).where(UserShard.uuid == any_(bindparam("uuids", type_=ARRAY(UUID(as_uuid=True)))))
+_reserve_username = (
+    insert(UserShard)
+    .on_conflict_do_nothing(index_elements=[UserShard.username])
+    .returning(UserShard.username)
+)
+_release_username = delete(UserShard).where(
+    UserShard.username == bindparam("username"),
+)
+
+
+def _created_user(user_in: CreateUserRequest, created: Row) -> User:
+    """Build the created user from the inserted values, without reading it back."""
+    return User(
+        uuid=created.uuid,
+        username=user_in.username,
+        hashed_password=user_in.hashed_password,
+        created_at=created.created_at,
+    )
+
+
+def _might_exist(username_filter: UsernameFilter | None, username: str) -> bool:
+    """Return `False` only if the username filter is sure there is no such user."""
+    return username_filter is None or username_filter.might_exist(username)
+
+
+def _as_uuids(uuids: Iterable[str]) -> list[uuid_lib.UUID]:
+    return list({uuid_lib.UUID(str(uuid)) for uuid in uuids})
+
+
+def _cached_usernames(
+    cache: UserCache | None,
+    uuids: list[uuid_lib.UUID],
+) -> tuple[dict[str, str], list[uuid_lib.UUID]]:
+    """Split `uuids` into cached usernames and the UUIDs that must be queried."""
+    if cache is None:
+        return {}, uuids
+
+    usernames = {}
+    uncached = []
+    for uuid in uuids:
+        username = cache.get_username(str(uuid))
+        if username is MISSING:
+            uncached.append(uuid)
+        elif username is not None:
+            usernames[str(uuid)] = username
+    return usernames, uncached
+
+
+def _cache_usernames(
+    cache: UserCache | None,
+    queried: list[uuid_lib.UUID],
+    usernames: dict[str, str],
+    generation: int | None,
+) -> None:
+    if cache is None:
+        return
+    for uuid in queried:
+        cache.set_username(str(uuid), usernames.get(str(uuid)), generation)
 
 
 class UserHandler:
-    """Handles database interactions involving the User model."""
+    """Handles database interactions involving the User model.
 
-    def __init__(self, db: Session) -> None:
+    With a `committer`, new users are inserted in batches together with those of
+    concurrent requests, instead of in the handler's own transaction.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        cache: UserCache | None = None,
+        username_filter: UsernameFilter | None = None,
+        committer: GroupCommitter | None = None,
+    ) -> None:
         self.db = db
+        self.cache = cache
+        self.username_filter = username_filter
+        self.committer = committer
 
     def get_by_username(self, username: str) -> User:
         logging.info("Retrieving user %s", username)
 
-        user = self.db.query(User).filter(User.username == username).first()
+        row = read_first(self.db, _user_by_username(username), keys=[username])
+        user = None if row is None else row[0]
 
         if user is None:
             logging.info("User %s does not exist", username)
@@ -33,7 +360,8 @@ class UserHandler:
     def get_by_uuid(self, uuid: str) -> User:
         logging.info("Retrieving user by UUID: %s", uuid)
 
-        user = self.db.query(User).filter(User.uuid == uuid).first()
+        row = read_first(self.db, _user_by_uuid(uuid), keys=[uuid])
+        user = None if row is None else row[0]
 
         if user is None:
             logging.info("User with UUID %s does not exist", uuid)
@@ -42,32 +370,840 @@ class UserHandler:
 
         return user
 
+    def get_username_and_version(self, uuid: str) -> tuple[str, datetime] | None:
+        """Return the username and version of the user with the given UUID, if any."""
+        generations = None
+        if self.cache is not None:
+            username_and_version = self.cache.get_username_and_version(uuid)
+            if username_and_version is not MISSING:
+                return username_and_version
+            generations = self.cache.generations()
+
+        logging.info("Retrieving username and version of user with UUID %s", uuid)
+        row = read_first(
+            self.db,
+            _username_and_version_by_uuid,
+            {"uuid": uuid},
+            keys=[uuid],
+        )
+        username_and_version = _to_username_and_version(row)
+
+        if self.cache is not None:
+            self.cache.set_username_and_version(uuid, username_and_version, generations)
+        return username_and_version
+
+    def get_auth_data_and_version(
+        self,
+        username: str,
+    ) -> tuple[UserAuthData, datetime] | None:
+        """Return the auth data and version of the given user, if they exist."""
+        if not _might_exist(self.username_filter, username):
+            logging.info("User %s does not exist", username)
+            return None
+
+        generation = None
+        if self.cache is not None:
+            auth_data_and_version = self.cache.get_auth_data_and_version(username)
+            if auth_data_and_version is not MISSING:
+                return auth_data_and_version
+            generation = self.cache.versions.generation
+
+        logging.info("Retrieving auth data and version of user %s", username)
+        row = read_first(
+            self.db,
+            _auth_data_and_version_by_username,
+            {"username": username},
+            keys=[username],
+        )
+        auth_data_and_version = _to_auth_data_and_version(row)
+
+        if self.cache is not None:
+            self.cache.set_auth_data_and_version(
+                username,
+                auth_data_and_version,
+                generation,
+            )
+        return auth_data_and_version
+
+    def get_version_by_uuid(self, uuid: str) -> datetime | None:
+        """Return the version of the user with the given UUID, if there is one."""
+        username_and_version = self.get_username_and_version(uuid)
+        return None if username_and_version is None else username_and_version[1]
+
+    def get_usernames_by_uuids(self, uuids: Iterable[str]) -> dict[str, str]:
+        """Map each of the given UUIDs that belongs to a user to that user's name."""
+        usernames, uncached = _cached_usernames(self.cache, _as_uuids(uuids))
+        if not uncached:
+            return usernames
+        logging.info("Retrieving usernames for %s UUIDs", len(uncached))
+
+        generation = None if self.cache is None else self.cache.usernames.generation
+        rows = execute_read(
+            self.db,
+            _usernames_by_uuids,
+            {"uuids": uncached},
+            keys=uncached,
+        )
+        found = {str(uuid): username for uuid, username in rows}
+        _cache_usernames(self.cache, uncached, found, generation)
+
+        return usernames | found
+
+    def list_users(self, limit: int, after: Cursor | None = None) -> list[Row]:
+        """Return up to `limit` users in creation order, starting after `after`."""
+        logging.info("Listing %s users after %s", limit, after)
+        return execute_read(self.db, _users_after(after, limit)).all()
+
+    def list_changes(self, limit: int, after: ChangeCursor | None = None) -> list[Row]:
+        """Return up to `limit` created or changed users in feed order, after `after`.
+
+        Raises:
+            InvalidCursorError: If `after` is a cursor of a sharded deployment.
+        """
+        logging.info("Listing %s user changes after %s", limit, after)
+        [position] = _change_positions(after, 1)
+        return execute_read(self.db, _changes_after(position, limit)).all()
+
+    def export_users(self, batch_size: int) -> Iterator[Sequence[Row]]:
+        """Stream every user in creation order, `batch_size` rows at a time.
+
+        The rows are fetched through a server-side cursor, so memory use is bounded by
+        the batch size however many users there are.
+        """
+        logging.info("Exporting users")
+        result = execute_read(
+            self.db,
+            _listed_users,
+            execution_options={"yield_per": batch_size},
+        )
+        return result.partitions()
+
+    def search_usernames(self, prefix: str, limit: int) -> list[str]:
+        """Return up to `limit` usernames starting with `prefix`, in code point order.
+
+        Results are cached briefly, so users created since may be missing from them.
+        """
+        logging.info("Searching for usernames starting with %s", prefix)
+        if self.cache is not None:
+            usernames = self.cache.get_search(prefix, limit)
+            if usernames is not MISSING:
+                return usernames
+
+        usernames = list(
+            execute_read(self.db, _usernames_starting_with(prefix, limit)).scalars(),
+        )
+        if self.cache is not None:
+            self.cache.set_search(prefix, limit, usernames)
+        return usernames
+
+    def is_username_available(self, username: str) -> bool:
+        """Check whether a username is free, without a query for most free names."""
+        return self.get_auth_data_and_version(username) is None
+
     def create_user(self, user_in: CreateUserRequest) -> User:
         logging.info("Creating user %s", user_in.username)
 
-        if self.get_by_username(user_in.username) is not None:
+        if self.committer is not None:
+            created = self.committer.create_user(user_in)
+        else:
+            created = self._insert_user(user_in)
+        logging.info("User %s created", user_in.username)
+
+        if self.cache is not None:
+            self.cache.invalidate(created.uuid, [user_in.username])
+        if self.username_filter is not None:
+            self.username_filter.add(user_in.username)
+
+        return _created_user(user_in, created)
+
+    def replace_password_hash(
+        self,
+        uuid: str,
+        hashes: UpdatePasswordHashRequest,
+    ) -> bool:
+        """Replace a user's password hash, if it is still the previous one.
+
+        Returns whether it was replaced, which it is not if there is no such user or
+        their password hash has changed.
+        """
+        logging.info("Replacing password hash of user %s", uuid)
+
+        username = self.db.execute(
+            _replace_password_hash,
+            _password_hash_replacement(uuid, hashes),
+        ).scalar()
+        if username is None:
+            logging.info("Password hash of user %s was not replaced", uuid)
+            self.db.rollback()
+            return False
+        pin_to_primary(self.db, [uuid, username])
+        self.db.commit()
+
+        if self.cache is not None:
+            self.cache.invalidate(uuid, [username])
+        return True
+
+    def _insert_user(self, user_in: CreateUserRequest) -> Row:
+        try:
+            created = self.db.execute(_insert_user, user_in.model_dump()).first()
+            if created is not None:
+                pin_to_primary(self.db, [created.uuid, user_in.username])
+                self.db.commit()
+        except exc.IntegrityError:
+            logging.exception("Error creating user %s", user_in.username)
+            self.db.rollback()
+            raise UserCreationError from None
+
+        if created is None:
             logging.error("User %s already exists", user_in.username)
+            self.db.rollback()
             raise UserAlreadyExistsError
+        return created
+
+
+class AsyncUserHandler:
+    """Handles database interactions involving the User model on an AsyncSession."""
+
+    def __init__(
+        self,
+        db: AsyncSession,
+        cache: UserCache | None = None,
+        username_filter: UsernameFilter | None = None,
+        committer: AsyncGroupCommitter | None = None,
+    ) -> None:
+        self.db = db
+        self.cache = cache
+        self.username_filter = username_filter
+        self.committer = committer
+
+    async def get_by_username(self, username: str) -> User:
+        logging.info("Retrieving user %s", username)
 
-        user = User(
-            username=user_in.username,
-            hashed_password=user_in.hashed_password,
+        row = await read_first_async(
+            self.db,
+            _user_by_username(username),
+            keys=[username],
         )
+        user = None if row is None else row[0]
 
-        self.db.add(user)
+        if user is None:
+            logging.info("User %s does not exist", username)
+        else:
+            logging.info("Retrieved user %s", username)
+
+        return user
+
+    async def get_by_uuid(self, uuid: str) -> User:
+        logging.info("Retrieving user by UUID: %s", uuid)
+
+        row = await read_first_async(self.db, _user_by_uuid(uuid), keys=[uuid])
+        user = None if row is None else row[0]
+
+        if user is None:
+            logging.info("User with UUID %s does not exist", uuid)
+        else:
+            logging.info("Retrieved user with UUID %s", uuid)
+
+        return user
+
+    async def get_username_and_version(
+        self,
+        uuid: str,
+    ) -> tuple[str, datetime] | None:
+        """Return the username and version of the user with the given UUID, if any."""
+        generations = None
+        if self.cache is not None:
+            username_and_version = self.cache.get_username_and_version(uuid)
+            if username_and_version is not MISSING:
+                return username_and_version
+            generations = self.cache.generations()
+
+        logging.info("Retrieving username and version of user with UUID %s", uuid)
+        row = await read_first_async(
+            self.db,
+            _username_and_version_by_uuid,
+            {"uuid": uuid},
+            keys=[uuid],
+        )
+        username_and_version = _to_username_and_version(row)
+
+        if self.cache is not None:
+            self.cache.set_username_and_version(uuid, username_and_version, generations)
+        return username_and_version
+
+    async def get_auth_data_and_version(
+        self,
+        username: str,
+    ) -> tuple[UserAuthData, datetime] | None:
+        """Return the auth data and version of the given user, if they exist."""
+        if not _might_exist(self.username_filter, username):
+            logging.info("User %s does not exist", username)
+            return None
+
+        generation = None
+        if self.cache is not None:
+            auth_data_and_version = self.cache.get_auth_data_and_version(username)
+            if auth_data_and_version is not MISSING:
+                return auth_data_and_version
+            generation = self.cache.versions.generation
+
+        logging.info("Retrieving auth data and version of user %s", username)
+        row = await read_first_async(
+            self.db,
+            _auth_data_and_version_by_username,
+            {"username": username},
+            keys=[username],
+        )
+        auth_data_and_version = _to_auth_data_and_version(row)
+
+        if self.cache is not None:
+            self.cache.set_auth_data_and_version(
+                username,
+                auth_data_and_version,
+                generation,
+            )
+        return auth_data_and_version
+
+    async def get_version_by_uuid(self, uuid: str) -> datetime | None:
+        """Return the version of the user with the given UUID, if there is one."""
+        username_and_version = await self.get_username_and_version(uuid)
+        return None if username_and_version is None else username_and_version[1]
+
+    async def get_usernames_by_uuids(self, uuids: Iterable[str]) -> dict[str, str]:
+        """Map each of the given UUIDs that belongs to a user to that user's name."""
+        usernames, uncached = _cached_usernames(self.cache, _as_uuids(uuids))
+        if not uncached:
+            return usernames
+        logging.info("Retrieving usernames for %s UUIDs", len(uncached))
+
+        generation = None if self.cache is None else self.cache.usernames.generation
+        rows = await execute_read_async(
+            self.db,
+            _usernames_by_uuids,
+            {"uuids": uncached},
+            keys=uncached,
+        )
+        found = {str(uuid): username for uuid, username in rows}
+        _cache_usernames(self.cache, uncached, found, generation)
+
+        return usernames | found
+
+    async def list_users(self, limit: int, after: Cursor | None = None) -> list[Row]:
+        """Return up to `limit` users in creation order, starting after `after`."""
+        logging.info("Listing %s users after %s", limit, after)
+        result = await execute_read_async(self.db, _users_after(after, limit))
+        return result.all()
+
+    async def list_changes(
+        self,
+        limit: int,
+        after: ChangeCursor | None = None,
+    ) -> list[Row]:
+        """Return up to `limit` created or changed users in feed order, after `after`.
+
+        Raises:
+            InvalidCursorError: If `after` is a cursor of a sharded deployment.
+        """
+        logging.info("Listing %s user changes after %s", limit, after)
+        [position] = _change_positions(after, 1)
+        result = await execute_read_async(self.db, _changes_after(position, limit))
+        return result.all()
+
+    async def export_users(self, batch_size: int) -> AsyncIterator[Sequence[Row]]:
+        """Stream every user in creation order, `batch_size` rows at a time.
+
+        The rows are fetched through a server-side cursor, so memory use is bounded by
+        the batch size however many users there are.
+        """
+        logging.info("Exporting users")
+        result = await stream_read_async(
+            self.db,
+            _listed_users,
+            execution_options={"yield_per": batch_size},
+        )
+        return result.partitions()
+
+    async def search_usernames(self, prefix: str, limit: int) -> list[str]:
+        """Return up to `limit` usernames starting with `prefix`, in code point order.
+
+        Results are cached briefly, so users created since may be missing from them.
+        """
+        logging.info("Searching for usernames starting with %s", prefix)
+        if self.cache is not None:
+            usernames = self.cache.get_search(prefix, limit)
+            if usernames is not MISSING:
+                return usernames
+
+        result = await execute_read_async(
+            self.db,
+            _usernames_starting_with(prefix, limit),
+        )
+        usernames = list(result.scalars())
+        if self.cache is not None:
+            self.cache.set_search(prefix, limit, usernames)
+        return usernames
+
+    async def is_username_available(self, username: str) -> bool:
+        """Check whether a username is free, without a query for most free names."""
+        return await self.get_auth_data_and_version(username) is None
+
+    async def create_user(self, user_in: CreateUserRequest) -> User:
+        logging.info("Creating user %s", user_in.username)
+
+        if self.committer is not None:
+            created = await self.committer.create_user(user_in)
+        else:
+            created = await self._insert_user(user_in)
+        logging.info("User %s created", user_in.username)
+
+        if self.cache is not None:
+            self.cache.invalidate(created.uuid, [user_in.username])
+        if self.username_filter is not None:
+            self.username_filter.add(user_in.username)
+
+        return _created_user(user_in, created)
+
+    async def replace_password_hash(
+        self,
+        uuid: str,
+        hashes: UpdatePasswordHashRequest,
+    ) -> bool:
+        """Replace a user's password hash, if it is still the previous one.
+
+        Returns whether it was replaced, which it is not if there is no such user or
+        their password hash has changed.
+        """
+        logging.info("Replacing password hash of user %s", uuid)
+
+        result = await self.db.execute(
+            _replace_password_hash,
+            _password_hash_replacement(uuid, hashes),
+        )
+        username = result.scalar()
+        if username is None:
+            logging.info("Password hash of user %s was not replaced", uuid)
+            await self.db.rollback()
+            return False
+        pin_to_primary(self.db, [uuid, username])
+        await self.db.commit()
+
+        if self.cache is not None:
+            self.cache.invalidate(uuid, [username])
+        return True
+
+    async def _insert_user(self, user_in: CreateUserRequest) -> Row:
         try:
-            self.db.commit()
-            logging.info("User %s created", user_in.username)
-        except IntegrityError:
+            result = await self.db.execute(_insert_user, user_in.model_dump())
+            created = result.first()
+            if created is not None:
+                pin_to_primary(self.db, [created.uuid, user_in.username])
+                await self.db.commit()
+        except exc.IntegrityError:
             logging.exception("Error creating user %s", user_in.username)
-            self.db.rollback()
-            raise
+            await self.db.rollback()
+            raise UserCreationError from None
+
+        if created is None:
+            logging.error("User %s already exists", user_in.username)
+            await self.db.rollback()
+            raise UserAlreadyExistsError
+        return created
+
+
+class ShardedUserHandler:
+    """Handles database interactions involving the User model, across shards.
+
+    A lookup by UUID goes straight to the shard that the UUID hashes to, and one by
+    username to the shard found in the directory. Users that are not on the shard
+    their UUID hashes to, such as those not yet moved by a rebalance, are found
+    through the directory instead.
+    """
+
+    def __init__(
+        self,
+        connector: ShardedConnector,
+        cache: UserCache | None = None,
+        username_filter: UsernameFilter | None = None,
+    ) -> None:
+        self.connector = connector
+        self.cache = cache
+        self.username_filter = username_filter
+
+    def _shard_of_username(self, username: str) -> int | None:
+        with self.connector.directory_session() as directory:
+            result = directory.execute(_shard_by_username, {"username": username})
+            return result.scalar()
+
+    def _directory_entries(self, uuids: list[uuid_lib.UUID]) -> list[Row]:
+        with self.connector.directory_session() as directory:
+            return directory.execute(
+                _directory_entries_by_uuids,
+                {"uuids": uuids},
+            ).all()
+
+    def _read(
+        self,
+        shard: int,
+        statement: Executable,
+        params: dict | None = None,
+    ) -> list[Row]:
+        with self.connector.shard_sessions[shard]() as session:
+            return session.execute(statement, params).all()
+
+    def _read_user(self, shard: int, statement: Select) -> User | None:
+        with self.connector.shard_sessions[shard]() as session:
+            return session.execute(statement).scalars().first()
+
+    def _read_each(self, reads: dict[int, tuple[Executable, dict | None]]) -> list[Row]:
+        """Run a read on each of the given shards in parallel, and return every row."""
+        if len(reads) == 1:
+            [(shard, (statement, params))] = reads.items()
+            return self._read(shard, statement, params)
+
+        # Each read runs in a copy of this request's context, so that its deadline
+        # holds on the executor's threads too.
+        results = self.connector.executor.map(
+            lambda read: read[0].run(self._read, read[1], *read[2]),
+            [(contextvars.copy_context(), *read) for read in reads.items()],
+        )
+        return [row for rows in results for row in rows]
+
+    def get_by_username(self, username: str) -> User:
+        logging.info("Retrieving user %s", username)
+
+        shard = self._shard_of_username(username)
+        user = None
+        if shard is not None:
+            user = self._read_user(shard, _user_by_username(username))
+
+        if user is None:
+            logging.info("User %s does not exist", username)
+        else:
+            logging.info("Retrieved user %s from shard %s", username, shard)
+
+        return user
+
+    def get_by_uuid(self, uuid: str) -> User:
+        logging.info("Retrieving user by UUID: %s", uuid)
+
+        shard = self.connector.shard_of(uuid)
+        user = self._read_user(shard, _user_by_uuid(uuid))
+        if user is None:
+            for entry in self._directory_entries(_as_uuids([uuid])):
+                if entry.shard != shard:
+                    user = self._read_user(entry.shard, _user_by_uuid(uuid))
+
+        if user is None:
+            logging.info("User with UUID %s does not exist", uuid)
+        else:
+            logging.info("Retrieved user with UUID %s", uuid)
 
         return user
 
+    def get_username_and_version(self, uuid: str) -> tuple[str, datetime] | None:
+        """Return the username and version of the user with the given UUID, if any."""
+        generations = None
+        if self.cache is not None:
+            username_and_version = self.cache.get_username_and_version(uuid)
+            if username_and_version is not MISSING:
+                return username_and_version
+            generations = self.cache.generations()
+
+        logging.info("Retrieving username and version of user with UUID %s", uuid)
+        shard = self.connector.shard_of(uuid)
+        statement = _username_and_version_by_uuid
+        rows = self._read(shard, statement, {"uuid": uuid})
+        if not rows:
+            for entry in self._directory_entries(_as_uuids([uuid])):
+                if entry.shard != shard:
+                    rows = self._read(entry.shard, statement, {"uuid": uuid})
+        username_and_version = _to_username_and_version(rows[0] if rows else None)
+
+        if self.cache is not None:
+            self.cache.set_username_and_version(uuid, username_and_version, generations)
+        return username_and_version
+
+    def get_auth_data_and_version(
+        self,
+        username: str,
+    ) -> tuple[UserAuthData, datetime] | None:
+        """Return the auth data and version of the given user, if they exist."""
+        if not _might_exist(self.username_filter, username):
+            logging.info("User %s does not exist", username)
+            return None
+
+        generation = None
+        if self.cache is not None:
+            auth_data_and_version = self.cache.get_auth_data_and_version(username)
+            if auth_data_and_version is not MISSING:
+                return auth_data_and_version
+            generation = self.cache.versions.generation
+
+        logging.info("Retrieving auth data and version of user %s", username)
+        shard = self._shard_of_username(username)
+        rows = []
+        if shard is not None:
+            rows = self._read(
+                shard,
+                _auth_data_and_version_by_username,
+                {"username": username},
+            )
+        auth_data_and_version = _to_auth_data_and_version(rows[0] if rows else None)
+
+        if self.cache is not None:
+            self.cache.set_auth_data_and_version(
+                username,
+                auth_data_and_version,
+                generation,
+            )
+        return auth_data_and_version
+
+    def get_version_by_uuid(self, uuid: str) -> datetime | None:
+        """Return the version of the user with the given UUID, if there is one."""
+        username_and_version = self.get_username_and_version(uuid)
+        return None if username_and_version is None else username_and_version[1]
+
+    def get_usernames_by_uuids(self, uuids: Iterable[str]) -> dict[str, str]:
+        """Map each of the given UUIDs that belongs to a user to that user's name.
+
+        The UUIDs are grouped by shard, and every shard involved is queried at once.
+        """
+        usernames, uncached = _cached_usernames(self.cache, _as_uuids(uuids))
+        if not uncached:
+            return usernames
+
+        by_shard = defaultdict(list)
+        for uuid in uncached:
+            by_shard[self.connector.shard_of(uuid)].append(uuid)
+        logging.info(
+            "Retrieving usernames for %s UUIDs from %s shards",
+            len(uncached),
+            len(by_shard),
+        )
+
+        generation = None if self.cache is None else self.cache.usernames.generation
+        rows = self._read_each(
+            {
+                shard: (_usernames_by_uuids, {"uuids": shard_uuids})
+                for shard, shard_uuids in by_shard.items()
+            },
+        )
+        found = {str(uuid): username for uuid, username in rows}
+        if missing := [uuid for uuid in uncached if str(uuid) not in found]:
+            entries = self._directory_entries(missing)
+            found |= {str(entry.uuid): entry.username for entry in entries}
+        _cache_usernames(self.cache, uncached, found, generation)
+
+        return usernames | found
+
+    def list_users(self, limit: int, after: Cursor | None = None) -> list[Row]:
+        """Return up to `limit` users in creation order, starting after `after`."""
+        logging.info("Listing %s users after %s", limit, after)
+        statement = _users_after(after, limit)
+        rows = self._read_each(
+            {shard: (statement, None) for shard in range(len(self.connector.shards))},
+        )
+        return heapq.nsmallest(limit, rows, key=_listing_order)
+
+    def list_changes(self, limit: int, after: ChangeCursor | None = None) -> list[Row]:
+        """Return up to `limit` created or changed users in feed order, after `after`.
+
+        Each shard has a feed of its own, ordered by its own transactions, and the
+        cursor holds a position in each. The changes of every shard are merged by
+        their position in their own feed, so those returned from each shard always
+        follow on from its position.
+
+        Raises:
+            InvalidCursorError: If `after` has positions in more shards than there are.
+        """
+        logging.info("Listing %s user changes after %s", limit, after)
+        positions = _change_positions(after, len(self.connector.shards))
+        rows = self._read_each(
+            {
+                shard: (_changes_after(position, limit, shard), None)
+                for shard, position in enumerate(positions)
+            },
+        )
+        return heapq.nsmallest(limit, rows, key=_feed_order)
+
+    def export_users(self, batch_size: int) -> Iterator[Sequence[Row]]:
+        """Stream every user in creation order, `batch_size` rows at a time.
+
+        Each shard is read through its own server-side cursor, and their users are
+        merged into a single stream in creation order.
+        """
+        logging.info("Exporting users")
+        with contextlib.ExitStack() as stack:
+            shard_results = [
+                stack.enter_context(sessions()).execute(
+                    _listed_users,
+                    execution_options={"yield_per": batch_size},
+                )
+                for sessions in self.connector.shard_sessions
+            ]
+            users = heapq.merge(*shard_results, key=_listing_order)
+            while batch := list(itertools.islice(users, batch_size)):
+                yield batch
+
+    def search_usernames(self, prefix: str, limit: int) -> list[str]:
+        """Return up to `limit` usernames starting with `prefix`, in code point order.
+
+        Results are cached briefly, so users created since may be missing from them.
+        """
+        logging.info("Searching for usernames starting with %s", prefix)
+        if self.cache is not None:
+            usernames = self.cache.get_search(prefix, limit)
+            if usernames is not MISSING:
+                return usernames
+
+        statement = _usernames_starting_with(prefix, limit)
+        rows = self._read_each(
+            {shard: (statement, None) for shard in range(len(self.connector.shards))},
+        )
+        usernames = heapq.nsmallest(limit, (row.username for row in rows))
+        if self.cache is not None:
+            self.cache.set_search(prefix, limit, usernames)
+        return usernames
+
+    def is_username_available(self, username: str) -> bool:
+        """Check whether a username is free, without a query for most free names."""
+        return self.get_auth_data_and_version(username) is None
+
+    def create_user(self, user_in: CreateUserRequest) -> User:
+        logging.info("Creating user %s", user_in.username)
+
+        uuid = new_user_key()
+        shard = self.connector.shard_of(uuid)
+        # Reserving the username in the directory is what keeps it unique across
+        # shards, so it comes first.
+        with self.connector.directory_session.begin() as directory:
+            reserved = directory.execute(
+                _reserve_username,
+                {"username": user_in.username, "uuid": uuid, "shard": shard},
+            ).first()
+        if reserved is None:
+            logging.error("User %s already exists", user_in.username)
+            raise UserAlreadyExistsError
+
+        try:
+            with self.connector.shard_sessions[shard].begin() as session:
+                created = session.execute(
+                    _insert_user,
+                    {"uuid": uuid, **user_in.model_dump()},
+                ).first()
+        except exc.SQLAlchemyError:
+            logging.exception("Error creating user %s", user_in.username)
+            created = None
+
+        if created is None:
+            with self.connector.directory_session.begin() as directory:
+                directory.execute(_release_username, {"username": user_in.username})
+            raise UserCreationError
+        logging.info("User %s created on shard %s", user_in.username, shard)
+
+        if self.cache is not None:
+            self.cache.invalidate(created.uuid, [user_in.username])
+        if self.username_filter is not None:
+            self.username_filter.add(user_in.username)
+
+        return _created_user(user_in, created)
+
+    def _replace_password_hash_on(
+        self,
+        shard: int,
+        uuid: str,
+        hashes: UpdatePasswordHashRequest,
+    ) -> str | None:
+        with self.connector.shard_sessions[shard].begin() as session:
+            return session.execute(
+                _replace_password_hash,
+                _password_hash_replacement(uuid, hashes),
+            ).scalar()
+
+    def replace_password_hash(
+        self,
+        uuid: str,
+        hashes: UpdatePasswordHashRequest,
+    ) -> bool:
+        """Replace a user's password hash, if it is still the previous one.
+
+        Returns whether it was replaced, which it is not if there is no such user or
+        their password hash has changed.
+        """
+        logging.info("Replacing password hash of user %s", uuid)
 
-def get_user_handler(
-    db_session: Session = Depends(create_database_session),
-) -> UserHandler:
-    logging.info("Creating user handler")
-    return UserHandler(db_session)
+        shard = self.connector.shard_of(uuid)
+        username = self._replace_password_hash_on(shard, uuid, hashes)
+        if username is None:
+            for entry in self._directory_entries(_as_uuids([uuid])):
+                if entry.shard != shard:
+                    username = self._replace_password_hash_on(entry.shard, uuid, hashes)
+        if username is None:
+            logging.info("Password hash of user %s was not replaced", uuid)
+            return False
+
+        if self.cache is not None:
+            self.cache.invalidate(uuid, [username])
+        return True
+
+
+class ThreadedUserHandler:
+    """Exposes a synchronous `UserHandler` through the `AsyncUserHandler` interface.
+
+    Every method call is run on the threadpool, so async routes can use the psycopg2
+    engine without blocking the event loop.
+    """
+
+    def __init__(self, handler: UserHandler | ShardedUserHandler) -> None:
+        self.handler = handler
+
+    def __getattr__(self, name: str) -> Callable[..., Awaitable[Any]]:
+        """Wrap the handler's method so that it runs on the threadpool."""
+        method = getattr(self.handler, name)
+
+        @functools.wraps(method)
+        async def run(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+            return await run_in_threadpool(method, *args, **kwargs)
+
+        return run
+
+
+async def get_user_handler() -> (
+    AsyncGenerator[AsyncUserHandler | ThreadedUserHandler, None]
+):
+    """Provide a user handler whose methods can be awaited by the routes.
+
+    The handler runs on the shared async engine when `DB_ASYNC` is enabled, and on the
+    psycopg2 engines via the threadpool otherwise.
+    """
+    connector = get_database_connector()
+
+    if isinstance(connector, ShardedConnector):
+        logging.info("Creating sharded user handler")
+        yield ThreadedUserHandler(
+            ShardedUserHandler(connector, get_user_cache(), get_username_filter()),
+        )
+        return
+
+    if isinstance(connector, AsyncSQLAlchemyConnector):
+        async with asynccontextmanager(connector.create_session)() as db_session:
+            logging.info("Creating async user handler")
+            yield AsyncUserHandler(
+                db_session,
+                get_user_cache(),
+                get_username_filter(),
+                get_group_committer(),
+            )
+        return
+
+    sessions = contextmanager(connector.create_session)()
+    async with contextmanager_in_threadpool(sessions) as db_session:
+        logging.info("Creating user handler")
+        yield ThreadedUserHandler(
+            UserHandler(
+                db_session,
+                get_user_cache(),
+                get_username_filter(),
+                get_group_committer(),
+            ),
+        )
@@ -1,11 +1,28 @@
+import uuid
+
 import pytest
 from common.api.exceptions.user import (
     UserAlreadyExistsError,
 )
-from common.api.schemas.user import CreateUserRequest
+from common.api.schemas.user import CreateUserRequest, UpdatePasswordHashRequest
+from sqlalchemy import delete, event, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from service.database.user_handler import UserHandler
+from service.config import CacheConfig
+from service.database import session as session_module
+from service.database.cache import UserCache
+from service.database.models import User
+from service.database.pagination import advance_change_cursor
+from service.database.session import AsyncSQLAlchemyConnector
+from service.database.user_handler import (
+    AsyncUserHandler,
+    ThreadedUserHandler,
+    UserHandler,
+    _changes_after,
+    _prefix_upper_bound,
+    get_user_handler,
+)
 
 
 def test_user_creation_succeeds_with_valid_data(
@@ -73,3 +90,459 @@ def test_user_creation_fails_with_duplicate_username(
 
     with pytest.raises(UserAlreadyExistsError):
         user_handler.create_user(create_user_payload)
+
+
+def test_user_creation_takes_a_single_statement(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = UserHandler(db)
+    statements = []
+    event.listen(
+        db.get_bind(),
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+
+    user = user_handler.create_user(create_user_payload)
+    identity = user.to_identity()
+
+    assert len(statements) == 1
+    assert "ON CONFLICT" in statements[0]
+    assert identity.uuid == str(user.uuid)
+    assert user.created_at is not None
+
+
+def test_duplicate_username_leaves_the_session_usable(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = UserHandler(db)
+    user = user_handler.create_user(create_user_payload)
+
+    with pytest.raises(UserAlreadyExistsError):
+        user_handler.create_user(create_user_payload)
+
+    other = user_handler.create_user(
+        CreateUserRequest(username="other", hashed_password="hash"),  # noqa: S106
+    )
+    assert other.uuid != user.uuid
+
+
+def test_hot_path_lookups_select_only_the_columns_they_return(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = UserHandler(db)
+    user = user_handler.create_user(create_user_payload)
+    statements = []
+    event.listen(
+        db.get_bind(),
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+
+    auth_data, _ = user_handler.get_auth_data_and_version(create_user_payload.username)
+    username, _ = user_handler.get_username_and_version(str(user.uuid))
+
+    assert auth_data == user.to_auth_data()
+    assert username == create_user_payload.username
+    assert not any("change_xid" in statement for statement in statements)
+    assert len(db.identity_map) == 0
+
+
+@pytest.mark.asyncio
+async def test_async_user_creation_succeeds_with_valid_data(
+    async_db: AsyncSession,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = AsyncUserHandler(async_db)
+
+    user = await user_handler.create_user(create_user_payload)
+
+    assert user is not None
+    assert user.username == create_user_payload.username
+    assert user.hashed_password == create_user_payload.hashed_password
+
+
+@pytest.mark.asyncio
+async def test_async_user_creation_fails_with_duplicate_username(
+    async_db: AsyncSession,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = AsyncUserHandler(async_db)
+
+    await user_handler.create_user(create_user_payload)
+
+    with pytest.raises(UserAlreadyExistsError):
+        await user_handler.create_user(create_user_payload)
+
+
+@pytest.mark.asyncio
+async def test_async_retrieval_of_user_by_username_and_uuid_succeeds(
+    async_db: AsyncSession,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = AsyncUserHandler(async_db)
+    user = await user_handler.create_user(create_user_payload)
+
+    by_username = await user_handler.get_by_username(create_user_payload.username)
+    by_uuid = await user_handler.get_by_uuid(user.uuid)
+
+    assert by_username.uuid == user.uuid
+    assert by_uuid.username == create_user_payload.username
+    assert await user_handler.get_by_username("nobody") is None
+
+
+@pytest.mark.asyncio
+async def test_threaded_user_handler_awaits_sync_handler_methods(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = ThreadedUserHandler(UserHandler(db))
+
+    user = await user_handler.create_user(create_user_payload)
+    retrieved_user = await user_handler.get_by_uuid(user.uuid)
+
+    assert retrieved_user.username == create_user_payload.username
+
+
+@pytest.mark.asyncio
+async def test_user_handler_dependency_follows_the_configured_engine(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(session_module, "_connector", None)
+    monkeypatch.setenv("DB_ASYNC", "true")
+
+    handlers = get_user_handler()
+    handler = await anext(handlers)
+
+    assert isinstance(session_module._connector, AsyncSQLAlchemyConnector)
+    assert isinstance(handler, AsyncUserHandler)
+    await handlers.aclose()
+
+
+def test_usernames_are_resolved_for_a_batch_of_uuids(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = UserHandler(db)
+    user = user_handler.create_user(create_user_payload)
+    other = user_handler.create_user(
+        CreateUserRequest(
+            username="OtherUser",
+            hashed_password="password123",  # noqa: S106
+        ),
+    )
+    unknown = str(uuid.uuid4())
+
+    usernames = user_handler.get_usernames_by_uuids(
+        [str(user.uuid), str(other.uuid), unknown, str(user.uuid)],
+    )
+
+    assert usernames == {
+        str(user.uuid): create_user_payload.username,
+        str(other.uuid): "OtherUser",
+    }
+
+
+@pytest.mark.asyncio
+async def test_async_usernames_are_resolved_for_a_batch_of_uuids(
+    async_db: AsyncSession,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = AsyncUserHandler(async_db)
+    user = await user_handler.create_user(create_user_payload)
+
+    usernames = await user_handler.get_usernames_by_uuids(
+        [str(user.uuid), str(uuid.uuid4())],
+    )
+
+    assert usernames == {str(user.uuid): create_user_payload.username}
+
+
+def test_user_lookups_are_read_through_the_cache(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = UserHandler(db, UserCache(CacheConfig()))
+    user = user_handler.create_user(create_user_payload)
+    user_uuid = str(user.uuid)
+
+    username_and_version = user_handler.get_username_and_version(user_uuid)
+    assert username_and_version[0] == create_user_payload.username
+    assert user_handler.get_auth_data_and_version(user.username) is not None
+
+    # Served from the cache, even though the row is no longer there.
+    db.execute(delete(User))
+    assert user_handler.get_username_and_version(user_uuid) == username_and_version
+    assert user_handler.get_auth_data_and_version(user.username) is not None
+    assert user_handler.get_usernames_by_uuids([user_uuid]) == {
+        user_uuid: create_user_payload.username,
+    }
+    assert user_handler.cache.stats()["usernames"]["hits"] == 2  # noqa: PLR2004
+
+
+def test_user_creation_clears_cached_misses(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = UserHandler(db, UserCache(CacheConfig()))
+
+    assert user_handler.get_auth_data_and_version(create_user_payload.username) is None
+    user_handler.create_user(create_user_payload)
+
+    assert not user_handler.is_username_available(create_user_payload.username)
+
+
+def test_password_hashes_are_only_replaced_if_unchanged(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = UserHandler(db, UserCache(CacheConfig()))
+    user = user_handler.create_user(create_user_payload)
+    user_uuid = str(user.uuid)
+    assert user_handler.get_auth_data_and_version(user.username) is not None
+
+    rehash = UpdatePasswordHashRequest(
+        hashed_password="rehashed",  # noqa: S106
+        previous_hashed_password=create_user_payload.hashed_password,
+    )
+    replaced = user_handler.replace_password_hash(user_uuid, rehash)
+    # The hash it was computed from is gone, like that of a changed password.
+    replaced_again = user_handler.replace_password_hash(user_uuid, rehash)
+    unknown = user_handler.replace_password_hash(str(uuid.uuid4()), rehash)
+
+    assert replaced
+    assert not replaced_again
+    assert not unknown
+    # The cached auth data was dropped with the old hash.
+    auth_data, _ = user_handler.get_auth_data_and_version(user.username)
+    assert auth_data.hashed_password == "rehashed"  # noqa: S105
+    assert user_handler.get_version_by_uuid(user_uuid) > user.created_at
+
+
+@pytest.mark.asyncio
+async def test_async_password_hashes_are_only_replaced_if_unchanged(
+    async_db: AsyncSession,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = AsyncUserHandler(async_db, UserCache(CacheConfig()))
+    user = await user_handler.create_user(create_user_payload)
+    await user_handler.get_auth_data_and_version(user.username)
+
+    rehash = UpdatePasswordHashRequest(
+        hashed_password="rehashed",  # noqa: S106
+        previous_hashed_password=create_user_payload.hashed_password,
+    )
+
+    assert await user_handler.replace_password_hash(str(user.uuid), rehash)
+    assert not await user_handler.replace_password_hash(str(user.uuid), rehash)
+    auth_data, _ = await user_handler.get_auth_data_and_version(user.username)
+    assert auth_data.hashed_password == "rehashed"  # noqa: S105
+
+
+@pytest.mark.asyncio
+async def test_async_user_lookups_are_read_through_the_cache(
+    async_db: AsyncSession,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = AsyncUserHandler(async_db, UserCache(CacheConfig()))
+    user = await user_handler.create_user(create_user_payload)
+    user_uuid = str(user.uuid)
+
+    usernames = await user_handler.get_usernames_by_uuids([user_uuid])
+    assert await user_handler.get_usernames_by_uuids([user_uuid]) == usernames
+    assert await user_handler.get_auth_data_and_version("nobody") is None
+    assert await user_handler.get_auth_data_and_version("nobody") is None
+
+    stats = user_handler.cache.stats()
+    assert stats["usernames"]["hits"] == 1
+    assert stats["versions"]["hits"] == 1
+
+
+@pytest.mark.parametrize(
+    ("prefix", "upper"),
+    [
+        ("ali", "alj"),
+        ("z", "{"),
+        ("a\ud7ff", "a\ue000"),
+        (f"a{chr(0x10FFFF)}", "b"),
+        (chr(0x10FFFF), None),
+    ],
+)
+def test_prefix_upper_bound_follows_every_string_with_the_prefix(
+    prefix: str,
+    upper: str | None,
+) -> None:
+    assert _prefix_upper_bound(prefix) == upper
+
+
+def _create_users(db: Session, usernames: list[str]) -> None:
+    user_handler = UserHandler(db)
+    for username in usernames:
+        user_handler.create_user(
+            CreateUserRequest(username=username, hashed_password="hash"),  # noqa: S106
+        )
+
+
+def test_usernames_are_searched_by_prefix(db: Session) -> None:
+    _create_users(db, ["alice", "Alicia", "alicia", "alina", "al%ce", "bob", "alj"])
+    user_handler = UserHandler(db)
+
+    assert user_handler.search_usernames("ali", 10) == ["alice", "alicia", "alina"]
+    assert user_handler.search_usernames("ali", 2) == ["alice", "alicia"]
+    assert user_handler.search_usernames("al%", 10) == ["al%ce"]
+    assert user_handler.search_usernames("carol", 10) == []
+
+
+def test_username_search_is_an_index_range_scan(db: Session) -> None:
+    _create_users(db, ["alice"])
+    statement = select(User.username).where(User.username.collate("C") >= "a")
+    # Too few rows for the planner to prefer the index on its own.
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+
+    plan = db.execute(
+        text(f"EXPLAIN {statement.compile(compile_kwargs={'literal_binds': True})}"),
+    ).scalars()
+
+    assert "ix_users_username_prefix" in "\n".join(plan)
+
+
+def test_username_searches_are_cached(db: Session) -> None:
+    _create_users(db, ["alice"])
+    user_handler = UserHandler(db, UserCache(CacheConfig()))
+
+    assert user_handler.search_usernames("al", 5) == ["alice"]
+    _create_users(db, ["alina"])
+
+    assert user_handler.search_usernames("al", 5) == ["alice"]
+    assert user_handler.search_usernames("al", 6) == ["alice", "alina"]
+    assert user_handler.cache.stats()["searches"]["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_async_usernames_are_searched_by_prefix(async_db: AsyncSession) -> None:
+    user_handler = AsyncUserHandler(async_db)
+    for username in ("alice", "alina", "bob"):
+        await user_handler.create_user(
+            CreateUserRequest(username=username, hashed_password="hash"),  # noqa: S106
+        )
+
+    assert await user_handler.search_usernames("al", 10) == ["alice", "alina"]
+
+
+def test_user_versions_change_when_the_user_does(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = UserHandler(db)
+    user = user_handler.create_user(create_user_payload)
+
+    created = user_handler.get_version_by_uuid(str(user.uuid))
+    db.execute(update(User).values(hashed_password="new hash"))  # noqa: S106
+    _, updated = user_handler.get_auth_data_and_version(user.username)
+
+    assert created == user.created_at
+    assert updated > created
+    assert user_handler.get_version_by_uuid(str(uuid.uuid4())) is None
+    assert user_handler.get_auth_data_and_version("nobody") is None
+
+
+def test_user_lookups_return_the_version_they_read(
+    db: Session,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = UserHandler(db, UserCache(CacheConfig()))
+    user = user_handler.create_user(create_user_payload)
+
+    username, by_uuid = user_handler.get_username_and_version(str(user.uuid))
+    auth_data, by_username = user_handler.get_auth_data_and_version(user.username)
+    db.execute(update(User).values(hashed_password="new hash"))  # noqa: S106
+    user_handler.cache.invalidate(str(user.uuid), [user.username])
+    changed, updated = user_handler.get_auth_data_and_version(user.username)
+
+    assert username == user.username
+    assert auth_data.uuid == str(user.uuid)
+    assert by_uuid == by_username == user.created_at
+    assert changed.hashed_password == "new hash"  # noqa: S105
+    assert updated > by_username
+    assert user_handler.get_username_and_version(str(uuid.uuid4())) is None
+    assert user_handler.get_auth_data_and_version("nobody") is None
+
+
+@pytest.mark.asyncio
+async def test_async_user_versions_are_read_through_the_cache(
+    async_db: AsyncSession,
+    create_user_payload: CreateUserRequest,
+) -> None:
+    user_handler = AsyncUserHandler(async_db, UserCache(CacheConfig()))
+    user = await user_handler.create_user(create_user_payload)
+
+    by_uuid = await user_handler.get_version_by_uuid(str(user.uuid))
+    _, by_username = await user_handler.get_auth_data_and_version(user.username)
+
+    assert by_uuid == by_username == user.created_at
+    assert await user_handler.get_version_by_uuid(str(user.uuid)) == by_uuid
+    assert user_handler.cache.stats()["versions"]["hits"] == 1
+
+
+def test_changes_are_listed_in_the_order_they_were_made(db: Session) -> None:
+    _create_users(db, ["alice", "bob", "carol"])
+    user_handler = UserHandler(db)
+
+    changes = user_handler.list_changes(10)
+    cursor = advance_change_cursor(None, changes)
+    db.execute(update(User).where(User.username == "alice").values(username="alicia"))
+    db.commit()
+    changed = user_handler.list_changes(10, cursor)
+
+    assert [change.username for change in changes] == ["alice", "bob", "carol"]
+    assert [change.username for change in changed] == ["alicia"]
+    assert changed[0].version > changes[0].version
+    assert user_handler.list_changes(10, advance_change_cursor(cursor, changed)) == []
+
+
+def test_changes_wait_for_older_transactions_to_finish(db: Session) -> None:
+    user_handler = UserHandler(db)
+    with db.get_bind().connect() as slow:
+        slow.execute(
+            insert(User).values(username="slow", hashed_password="hash"),  # noqa: S106
+        )
+        _create_users(db, ["fast"])
+
+        # "fast" committed first, but "slow" could still commit ahead of it in the
+        # feed, so neither is listed until it has.
+        assert user_handler.list_changes(10) == []
+        slow.commit()
+
+    assert [change.username for change in user_handler.list_changes(10)] == [
+        "slow",
+        "fast",
+    ]
+
+
+def test_change_feed_is_an_index_range_scan(db: Session) -> None:
+    _create_users(db, ["alice"])
+    statement = _changes_after((0, uuid.uuid4()), 10)
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+
+    plan = db.execute(
+        text(f"EXPLAIN {statement.compile(compile_kwargs={'literal_binds': True})}"),
+    ).scalars()
+
+    assert "Index Scan using ix_users_change_xid_uuid" in "\n".join(plan)
+
+
+@pytest.mark.asyncio
+async def test_async_changes_are_listed_page_by_page(async_db: AsyncSession) -> None:
+    user_handler = AsyncUserHandler(async_db)
+    for username in ("alice", "bob", "carol"):
+        await user_handler.create_user(
+            CreateUserRequest(username=username, hashed_password="hash"),  # noqa: S106
+        )
+
+    first = await user_handler.list_changes(2)
+    second = await user_handler.list_changes(2, advance_change_cursor(None, first))
+
+    assert [change.username for change in first + second] == ["alice", "bob", "carol"]
@@ -0,0 +1,422 @@
+import asyncio
+import bisect
+import contextlib
+import fcntl
+import heapq
+import logging
+import mmap
+import operator
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Iterable, Iterator
+from datetime import UTC, datetime, timedelta
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Engine, create_engine, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+from service.database.models import OLDEST_RUNNING_TRANSACTION_ID, User
+
+# Magic, number of users, size of the username arena, when every user was last read,
+# in microseconds since the epoch, and the number of databases read, each of whose
+# change feed position follows the header.
+_HEADER = struct.Struct("<8sQQqQ")
+_MAGIC = b"KLINKUD2"
+_POSITION_SIZE = 8
+_KEY_SIZE = 16
+# Every this many keys, one is copied into memory, to narrow each search of the
+# mapped keys down to a run of this length.
+_SAMPLE_INTERVAL = 64
+_OFFSET_SIZE = 4
+# The offsets of a username and of the one after it, which is where it ends.
+_BOUNDS = struct.Struct("<II")
+
+# Users are read from the database a server-side batch at a time.
+_REFRESH_BATCH_SIZE = 10_000
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+
+def _to_micros(version: datetime) -> int:
+    return (version - _EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+class _Keys:
+    """The sorted UUIDs of a table, indexed like a list."""
+
+    def __init__(self, buffer: mmap.mmap, start: int, count: int) -> None:
+        self._buffer = buffer
+        self._start = start
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> bytes:
+        position = self._start + index * _KEY_SIZE
+        return self._buffer[position : position + _KEY_SIZE]
+
+
+class _Table:
+    """A read-only view of a directory file.
+
+    The file is a header, followed by the change feed position of each database, the
+    users' 16-byte UUIDs in ascending order, the offsets of their usernames (one more
+    than there are users, so that each username ends where the next starts), and the
+    UTF-8 encoded usernames back to back.
+    """
+
+    def __init__(
+        self,
+        buffer: mmap.mmap | None = None,
+        inode: int | None = None,
+    ) -> None:
+        self.inode = inode
+        self._buffer = buffer
+        self.count = 0
+        self.built_at: datetime | None = None
+        self.positions: list[int] = []
+        if buffer is None:
+            return
+
+        magic, count, _, built_at, databases = _HEADER.unpack_from(buffer)
+        if magic != _MAGIC:
+            msg = "Not a username directory"
+            raise ValueError(msg)
+        self.count = count
+        self.built_at = _from_micros(built_at)
+        self.positions = list(
+            struct.unpack_from(f"<{databases}q", buffer, _HEADER.size),
+        )
+        self._keys_at = _HEADER.size + databases * _POSITION_SIZE
+        self._keys = _Keys(buffer, self._keys_at, count)
+        self._samples = [
+            self._keys[index] for index in range(0, count, _SAMPLE_INTERVAL)
+        ]
+        self._offsets_at = self._keys_at + count * _KEY_SIZE
+        self._arena_at = self._offsets_at + (count + 1) * _OFFSET_SIZE
+
+    def _username_at(self, index: int) -> str:
+        start, end = _BOUNDS.unpack_from(
+            self._buffer,
+            self._offsets_at + index * _OFFSET_SIZE,
+        )
+        return self._buffer[self._arena_at + start : self._arena_at + end].decode()
+
+    def get(self, key: bytes) -> str | None:
+        if not self.count:
+            return None
+        sample = bisect.bisect_right(self._samples, key)
+        if not sample:
+            return None
+        # The key can only be in the run that starts with the sample before it, which
+        # is short enough to search for the key as a substring.
+        start = self._keys_at + (sample - 1) * _SAMPLE_INTERVAL * _KEY_SIZE
+        end = min(start + _SAMPLE_INTERVAL * _KEY_SIZE, self._offsets_at)
+        position = self._buffer.find(key, start, end)
+        while position != -1 and (position - self._keys_at) % _KEY_SIZE:
+            position = self._buffer.find(key, position + 1, end)
+        if position == -1:
+            return None
+        return self._username_at((position - self._keys_at) // _KEY_SIZE)
+
+    def items(self) -> Iterator[tuple[bytes, str]]:
+        for index in range(self.count):
+            yield self._keys[index], self._username_at(index)
+
+
+def _latest(entries: Iterable[tuple[bytes, str]]) -> Iterator[tuple[bytes, str]]:
+    """Drop all but the last of each run of entries with the same UUID."""
+    previous = None
+    for entry in entries:
+        if previous is not None and previous[0] != entry[0]:
+            yield previous
+        previous = entry
+    if previous is not None:
+        yield previous
+
+
+class _Packed:
+    """Entries, in ascending UUID order, packed as they are laid out in the file."""
+
+    def __init__(self, entries: Iterable[tuple[bytes, str]]) -> None:
+        self.keys = bytearray()
+        self.arena = bytearray()
+        self.offsets = array("I", [0])
+        for key, username in entries:
+            self.keys += key
+            self.arena += username.encode()
+            self.offsets.append(len(self.arena))
+        if sys.byteorder != "little":
+            self.offsets.byteswap()
+        self.count = len(self.offsets) - 1
+
+    def write(self, path: str, positions: list[int], built_at: datetime) -> None:
+        """Write the entries to a new directory file at `path`.
+
+        The file is written next to `path` and renamed over it, so readers only ever
+        see a complete directory.
+        """
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(
+                _HEADER.pack(
+                    _MAGIC,
+                    self.count,
+                    len(self.arena),
+                    _to_micros(built_at),
+                    len(positions),
+                ),
+            )
+            file.write(struct.pack(f"<{len(positions)}q", *positions))
+            file.write(self.keys)
+            file.write(self.offsets.tobytes())
+            file.write(self.arena)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+
+
+def write_directory(
+    path: str,
+    entries: Iterable[tuple[bytes, str]],
+    positions: list[int],
+    built_at: datetime,
+) -> None:
+    """Write entries, in ascending UUID order, to a new directory file at `path`."""
+    _Packed(entries).write(path, positions, built_at)
+
+
+class UsernameDirectory:
+    """A uuid -> username table shared by every worker on a host through one file.
+
+    Workers map the file read-only, so the pages holding it are shared rather than
+    each worker caching usernames of its own, and a restarted worker starts with a
+    full directory. Whichever worker holds the file's lock when refreshing reads the
+    users changed since the last refresh, from the change feed of each database, and
+    writes a new file, which the others map on their next refresh.
+
+    The directory never says that a user does not exist: users created since the last
+    refresh are simply not in it yet. The change feed has no deletions, so deleted
+    users stay in it until it is next rebuilt from every user.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._table = _Table()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock_file = open(f"{path}.lock", "a+b")  # noqa: SIM115
+        self.reload()
+
+    def __len__(self) -> int:
+        """Return the number of users in the directory."""
+        return self._table.count
+
+    @property
+    def built_at(self) -> datetime | None:
+        """When the directory was last rebuilt from every user, if it ever was."""
+        return self._table.built_at
+
+    @property
+    def positions(self) -> list[int]:
+        """Where the directory is in the change feed of each database it was read from.
+
+        Every change made by a transaction with a lower ID than a database's position
+        is in the directory.
+        """
+        return self._table.positions
+
+    def get(self, user_uuid: str) -> str | None:
+        """Return the username of the user with the given UUID, if it is known."""
+        try:
+            key = bytes.fromhex(str(user_uuid).replace("-", ""))
+        except ValueError:
+            return None
+        if len(key) != _KEY_SIZE:
+            return None
+        return self._table.get(key)
+
+    def reload(self) -> bool:
+        """Map the directory file if it has been replaced, and return whether it was."""
+        try:
+            with open(self.path, "rb") as file:
+                inode = os.fstat(file.fileno()).st_ino
+                if inode == self._table.inode:
+                    return False
+                # The mapping outlives the file being replaced, and is unmapped once
+                # no lookup uses it any more.
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return False
+        except ValueError:
+            logging.warning("Ignoring empty username directory %s", self.path)
+            return False
+
+        try:
+            self._table = _Table(buffer, inode)
+        except (ValueError, struct.error):
+            logging.warning("Ignoring invalid username directory %s", self.path)
+            return False
+        logging.info(
+            "Mapped username directory %s: %s users",
+            self.path,
+            self._table.count,
+        )
+        return True
+
+    @contextlib.contextmanager
+    def _writer(self) -> Iterator[bool]:
+        """Try to become the only worker writing the directory, without waiting."""
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def refresh(
+        self,
+        engines: list[Engine],
+        rebuild_interval: timedelta | None = None,
+    ) -> None:
+        """Bring the directory up to date with the users tables behind `engines`.
+
+        Only users changed since the directory's positions in the change feeds are
+        read. Every user is read instead if there is no directory yet, if it was read
+        from other databases, or if it was last rebuilt more than `rebuild_interval`
+        ago. If another worker is refreshing the directory, the file it writes is
+        mapped on the next refresh instead.
+        """
+        with self._writer() as writing:
+            self.reload()
+            if not writing:
+                return
+
+            table = self._table
+            now = datetime.now(UTC)
+            rebuild = (
+                table.built_at is None
+                or len(table.positions) != len(engines)
+                or (
+                    rebuild_interval is not None
+                    and now - table.built_at >= rebuild_interval
+                )
+            )
+            positions = [None] * len(engines) if rebuild else table.positions
+            changes = [
+                _ChangedUsers(engine, position)
+                for engine, position in zip(engines, positions, strict=True)
+            ]
+            with contextlib.ExitStack() as stack:
+                sources = [stack.enter_context(change) for change in changes]
+                changed = heapq.merge(*sources, key=operator.itemgetter(0))
+                if rebuild:
+                    packed = _Packed(_latest(changed))
+                else:
+                    # Users whose names did not change, such as those re-read because
+                    # their transaction was still running at the last refresh, are no
+                    # reason to rewrite the directory.
+                    changed = [
+                        (key, username)
+                        for key, username in changed
+                        if table.get(key) != username
+                    ]
+                    if not changed:
+                        return
+                    # Later entries win, so changed users replace their old usernames.
+                    packed = _Packed(
+                        _latest(
+                            heapq.merge(
+                                table.items(),
+                                changed,
+                                key=operator.itemgetter(0),
+                            ),
+                        ),
+                    )
+            packed.write(
+                self.path,
+                [change.position for change in changes],
+                now if rebuild else table.built_at,
+            )
+            logging.info(
+                "Username directory %s: %s users",
+                "rebuilt" if rebuild else "refreshed",
+                packed.count,
+            )
+            self.reload()
+
+
+class _ChangedUsers:
+    """The users changed since a change feed position, in ascending UUID order.
+
+    The users are read lazily, once entered. `position` is where the next read of
+    the change feed starts.
+    """
+
+    def __init__(self, engine: Engine, since: int | None) -> None:
+        self.engine = engine
+        self.since = since
+        self.position: int | None = None
+
+    def __enter__(self) -> Iterator[tuple[bytes, str]]:
+        self._connection = self.engine.connect()
+        # Every transaction with a lower ID has finished before the users are read, so
+        # they include its changes. Those of the transactions still running, and of
+        # any started since, are stamped with this ID or a higher one.
+        self.position = self._connection.execute(
+            select(OLDEST_RUNNING_TRANSACTION_ID),
+        ).scalar()
+        statement = select(User.uuid, User.username).order_by(User.uuid)
+        if self.since is not None:
+            statement = statement.where(User.change_xid >= self.since)
+        result = self._connection.execution_options(
+            yield_per=_REFRESH_BATCH_SIZE,
+        ).execute(statement)
+        return ((user_uuid.bytes, username) for user_uuid, username in result)
+
+    def __exit__(self, *_: object) -> None:
+        self._connection.close()
+
+
+def _refresh_engine(url: str) -> Engine:
+    # Refreshes are infrequent reads on a thread of their own, so they connect with
+    # psycopg2 whichever driver serves the requests, and keep no connections open.
+    libpq_url = make_url(url).set(drivername="postgresql")
+    return create_engine(libpq_url, poolclass=NullPool)
+
+
+async def maintain_username_directory(
+    directory: UsernameDirectory,
+    urls: list[str],
+    interval: float,
+    rebuild_interval: float,
+) -> None:
+    """Refresh the directory from the given databases every `interval` seconds.
+
+    Every `rebuild_interval` seconds, it is rebuilt from every user instead.
+    """
+    engines = [_refresh_engine(url) for url in urls]
+    try:
+        while True:
+            try:
+                await run_in_threadpool(
+                    directory.refresh,
+                    engines,
+                    timedelta(seconds=rebuild_interval),
+                )
+            except Exception:
+                logging.exception("Could not refresh the username directory")
+            await asyncio.sleep(interval)
+    finally:
+        for engine in engines:
+            engine.dispose()
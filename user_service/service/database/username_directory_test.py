@@ -0,0 +1,228 @@
+import uuid
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+from common.api.schemas.user import CreateUserRequest
+from sqlalchemy import delete, insert, update
+from sqlalchemy.orm import Session
+
+from service.config import CacheConfig
+from service.database.cache import UserCache
+from service.database.models import User
+from service.database.session import ShardedConnector
+from service.database.user_handler import ShardedUserHandler
+from service.database.username_directory import UsernameDirectory, write_directory
+
+_BUILT_AT = datetime(2024, 1, 1, tzinfo=UTC)
+
+
+def _entries(count: int) -> list[tuple[uuid.UUID, str]]:
+    return sorted((uuid.uuid4(), f"user{i}") for i in range(count))
+
+
+def test_directory_looks_up_usernames_by_uuid(tmp_path: Path) -> None:
+    entries = _entries(1000)
+    path = str(tmp_path / "usernames")
+    write_directory(path, ((key.bytes, name) for key, name in entries), [], _BUILT_AT)
+
+    directory = UsernameDirectory(path)
+
+    assert len(directory) == len(entries)
+    assert all(directory.get(str(key)) == name for key, name in entries)
+    assert directory.get(str(uuid.uuid4())) is None
+    assert directory.get("not-a-uuid") is None
+
+
+def test_directory_without_a_file_is_empty(tmp_path: Path) -> None:
+    directory = UsernameDirectory(str(tmp_path / "missing" / "usernames"))
+
+    assert len(directory) == 0
+    assert directory.built_at is None
+    assert directory.positions == []
+    assert directory.get(str(uuid.uuid4())) is None
+
+
+def test_directory_ignores_an_invalid_file(tmp_path: Path) -> None:
+    path = tmp_path / "usernames"
+    path.write_bytes(b"not a directory at all")
+
+    assert len(UsernameDirectory(str(path))) == 0
+
+
+def test_directory_maps_files_written_by_other_workers(tmp_path: Path) -> None:
+    path = str(tmp_path / "usernames")
+    directory = UsernameDirectory(path)
+    key = uuid.uuid4()
+
+    write_directory(path, [(key.bytes, "alice")], [42, 7], _BUILT_AT)
+
+    assert directory.get(str(key)) is None
+    assert directory.reload()
+    assert not directory.reload()
+    assert directory.get(str(key)) == "alice"
+    assert directory.positions == [42, 7]
+    assert directory.built_at == _BUILT_AT
+
+
+def _add_user(db: Session, username: str) -> User:
+    user = User(username=username, hashed_password="hash")  # noqa: S106
+    db.add(user)
+    db.commit()
+    return user
+
+
+def test_directory_is_built_and_refreshed_from_the_database(
+    tmp_path: Path,
+    db: Session,
+) -> None:
+    path = str(tmp_path / "usernames")
+    directory = UsernameDirectory(path)
+    engine = db.get_bind()
+    alice = _add_user(db, "alice")
+
+    directory.refresh([engine])
+
+    assert len(directory) == 1
+    assert directory.get(str(alice.uuid)) == "alice"
+    built_at = directory.built_at
+    [first_position] = directory.positions
+
+    db.execute(update(User).where(User.username == "alice").values(username="carol"))
+    bob = _add_user(db, "bob")
+
+    # A worker that starts up now maps the same file before refreshing it.
+    restarted = UsernameDirectory(path)
+    assert restarted.get(str(alice.uuid)) == "alice"
+
+    directory.refresh([engine])
+
+    assert len(directory) == 2  # noqa: PLR2004
+    assert directory.get(str(alice.uuid)) == "carol"
+    assert directory.get(str(bob.uuid)) == "bob"
+    assert directory.positions[0] > first_position
+    assert directory.built_at == built_at
+    restarted.reload()
+    assert restarted.get(str(bob.uuid)) == "bob"
+
+
+def test_refresh_reads_users_committed_after_the_last_one(
+    tmp_path: Path,
+    db: Session,
+) -> None:
+    directory = UsernameDirectory(str(tmp_path / "usernames"))
+    engine = db.get_bind()
+    slow_uuid = uuid.uuid4()
+
+    with engine.connect() as slow:
+        # The slow transaction writes the user before the fast one, but commits after
+        # the directory is refreshed.
+        slow.execute(
+            insert(User).values(
+                uuid=slow_uuid,
+                username="slow",
+                hashed_password="hash",  # noqa: S106
+            ),
+        )
+        fast = _add_user(db, "fast")
+        directory.refresh([engine])
+        slow.commit()
+
+    assert directory.get(str(fast.uuid)) == "fast"
+    assert directory.get(str(slow_uuid)) is None
+
+    directory.refresh([engine])
+
+    assert directory.get(str(slow_uuid)) == "slow"
+
+
+def test_deleted_users_are_dropped_when_the_directory_is_rebuilt(
+    tmp_path: Path,
+    db: Session,
+) -> None:
+    directory = UsernameDirectory(str(tmp_path / "usernames"))
+    engine = db.get_bind()
+    alice = str(_add_user(db, "alice").uuid)
+    directory.refresh([engine])
+    db.execute(delete(User))
+    bob = _add_user(db, "bob")
+
+    directory.refresh([engine], rebuild_interval=timedelta(hours=1))
+
+    assert directory.get(alice) == "alice"
+    assert directory.get(str(bob.uuid)) == "bob"
+
+    directory.refresh([engine], rebuild_interval=timedelta(0))
+
+    assert directory.get(alice) is None
+    assert directory.get(str(bob.uuid)) == "bob"
+
+
+def test_refresh_without_changes_keeps_the_file(tmp_path: Path, db: Session) -> None:
+    path = tmp_path / "usernames"
+    directory = UsernameDirectory(str(path))
+    _add_user(db, "alice")
+    directory.refresh([db.get_bind()])
+    inode = path.stat().st_ino
+
+    directory.refresh([db.get_bind()])
+
+    assert path.stat().st_ino == inode
+
+
+def test_directory_is_refreshed_from_every_shard(
+    tmp_path: Path,
+    shard_urls: list[str],
+) -> None:
+    connector = ShardedConnector(shard_urls[0], shard_urls)
+    connector.create_schema()
+    handler = ShardedUserHandler(connector)
+    created = [
+        handler.create_user(
+            CreateUserRequest(username=f"user{i}", hashed_password=f"hash{i}"),
+        )
+        for i in range(20)
+    ]
+    directory = UsernameDirectory(str(tmp_path / "usernames"))
+
+    try:
+        directory.refresh(connector.shards)
+    finally:
+        connector.dispose()
+
+    assert len(directory) == len(created)
+    assert all(directory.get(str(user.uuid)) == user.username for user in created)
+    assert len(directory.positions) == len(shard_urls)
+
+
+def test_user_cache_reads_usernames_from_the_directory(tmp_path: Path) -> None:
+    path = str(tmp_path / "usernames")
+    key = str(uuid.uuid4())
+    write_directory(path, [(uuid.UUID(key).bytes, "alice")], [], _BUILT_AT)
+    cache = UserCache(CacheConfig(), UsernameDirectory(path))
+
+    assert cache.get_username(key.upper()) == "alice"
+    assert cache.stats()["directory"] == {"size": 1}
+
+    # Until the directory is refreshed, changed users are looked up elsewhere.
+    cache.invalidate(key)
+    cache.set_username(key, "carol")
+
+    assert cache.get_username(key) == "carol"
+
+
+def test_user_versions_are_cached_next_to_the_directory(tmp_path: Path) -> None:
+    path = str(tmp_path / "usernames")
+    key = str(uuid.uuid4())
+    write_directory(path, [(uuid.UUID(key).bytes, "alice")], [], _BUILT_AT)
+    cache = UserCache(CacheConfig(), UsernameDirectory(path))
+
+    cache.set_username_and_version(key, ("alice", _BUILT_AT), cache.generations())
+
+    assert cache.get_username_and_version(key) == ("alice", _BUILT_AT)
+    # The username is only held by the directory.
+    assert len(cache.usernames) == 0
+
+    cache.invalidate(key)
+    cache.set_username_and_version(key, ("carol", _BUILT_AT), cache.generations())
+
+    assert cache.get_username_and_version(key) == ("carol", _BUILT_AT)
@@ -0,0 +1,120 @@
+import logging
+from collections.abc import Sequence
+from typing import Protocol
+
+import pika
+from common.api.schemas.user import UserEvent
+from pika.adapters.blocking_connection import BlockingChannel
+
+from service.config import UserEventsConfig
+
+
+class EventPublisher(Protocol):
+    def publish(self, events: Sequence[UserEvent]) -> None:
+        """Publish events in order, returning once the broker has accepted them all.
+
+        Raises an exception if any may not have been accepted, in which case they are
+        all published again later.
+        """
+
+    def keep_alive(self) -> None:
+        """Service the connection to the broker while there is nothing to publish."""
+
+    def close(self) -> None:
+        """Close the connection to the broker, to be reopened on the next publish."""
+
+
+class RabbitMQPublisher:
+    """Publishes user events to a durable topic exchange, with publisher confirms.
+
+    Each event is routed by its type, so consumers bind a queue of their own to
+    `user.*`, or to only the events they need. Messages are persistent and carry
+    the event's id as their message id, for consumers to recognise redeliveries.
+
+    A publisher holds a single blocking connection, so it must only be used from one
+    thread.
+    """
+
+    def __init__(self, config: UserEventsConfig | None = None) -> None:
+        config = config or UserEventsConfig()
+        self.exchange = config.rabbitmq_user_exchange
+        self.parameters = pika.ConnectionParameters(
+            host=config.rabbitmq_host,
+            port=config.rabbitmq_port,
+            credentials=pika.PlainCredentials(
+                config.rabbitmq_user,
+                config.rabbitmq_pass,
+            ),
+        )
+        self._connection: pika.BlockingConnection | None = None
+        self._channel: BlockingChannel | None = None
+
+    def _open_channel(self) -> BlockingChannel:
+        if self._channel is not None and self._channel.is_open:
+            return self._channel
+
+        self.close()
+        logging.info("Connecting to RabbitMQ at %s", self.parameters.host)
+        self._connection = pika.BlockingConnection(self.parameters)
+        channel = self._connection.channel()
+        channel.exchange_declare(
+            exchange=self.exchange,
+            exchange_type="topic",
+            durable=True,
+        )
+        # Every publish now waits for the broker to take responsibility for the
+        # message, and raises if it refuses to.
+        channel.confirm_delivery()
+        self._channel = channel
+        return channel
+
+    def publish(self, events: Sequence[UserEvent]) -> None:
+        channel = self._open_channel()
+        try:
+            for user_event in events:
+                channel.basic_publish(
+                    exchange=self.exchange,
+                    routing_key=user_event.event_type,
+                    body=user_event.model_dump_json().encode(),
+                    properties=pika.BasicProperties(
+                        content_type="application/json",
+                        delivery_mode=pika.DeliveryMode.Persistent,
+                        message_id=str(user_event.event_id),
+                    ),
+                )
+        except pika.exceptions.AMQPError:
+            self.close()
+            raise
+
+    def keep_alive(self) -> None:
+        # Heartbeats are only answered while the blocking connection processes events.
+        if self._connection is not None and self._connection.is_open:
+            try:
+                self._connection.process_data_events()
+            except pika.exceptions.AMQPError:
+                logging.warning("Lost the connection to RabbitMQ while idle")
+                self.close()
+
+    def close(self) -> None:
+        connection, self._connection, self._channel = self._connection, None, None
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except pika.exceptions.AMQPError:
+                logging.debug("Could not close the connection to RabbitMQ cleanly")
+
+
+class InMemoryPublisher:
+    """Keeps the events it is given, as a stand-in for the broker in tests."""
+
+    def __init__(self) -> None:
+        self.published: list[UserEvent] = []
+
+    def publish(self, events: Sequence[UserEvent]) -> None:
+        self.published.extend(events)
+
+    def keep_alive(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
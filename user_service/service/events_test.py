@@ -0,0 +1,64 @@
+import json
+import uuid
+from datetime import UTC, datetime
+
+import pika
+import pytest
+from common.api.schemas.user import USER_CREATED, UserEvent
+from pytest_mock import MockerFixture
+
+from service.config import UserEventsConfig
+from service.events import RabbitMQPublisher
+
+
+def _event(event_id: int) -> UserEvent:
+    return UserEvent(
+        event_id=event_id,
+        event_type=USER_CREATED,
+        uuid=str(uuid.uuid4()),
+        username=f"user{event_id}",
+        version=datetime.now(tz=UTC),
+    )
+
+
+def test_events_are_published_persistently_with_confirms(
+    mocker: MockerFixture,
+) -> None:
+    connection = mocker.patch("pika.BlockingConnection").return_value
+    channel = connection.channel.return_value
+    publisher = RabbitMQPublisher(UserEventsConfig(rabbitmq_user_exchange="users"))
+    events = [_event(1), _event(2)]
+
+    publisher.publish(events)
+    publisher.publish([_event(3)])
+
+    # The connection is opened once, and kept for later batches.
+    connection.channel.assert_called_once()
+    channel.exchange_declare.assert_called_once_with(
+        exchange="users",
+        exchange_type="topic",
+        durable=True,
+    )
+    channel.confirm_delivery.assert_called_once()
+    first = channel.basic_publish.call_args_list[0].kwargs
+    assert first["exchange"] == "users"
+    assert first["routing_key"] == USER_CREATED
+    assert json.loads(first["body"])["username"] == "user1"
+    assert first["properties"].delivery_mode == pika.DeliveryMode.Persistent.value
+    assert first["properties"].message_id == "1"
+    assert channel.basic_publish.call_count == 3  # noqa: PLR2004
+
+
+def test_connection_is_reopened_after_a_failed_publish(mocker: MockerFixture) -> None:
+    connect = mocker.patch("pika.BlockingConnection")
+    channel = connect.return_value.channel.return_value
+    channel.basic_publish.side_effect = pika.exceptions.NackError([])
+    publisher = RabbitMQPublisher()
+
+    with pytest.raises(pika.exceptions.NackError):
+        publisher.publish([_event(1)])
+    channel.basic_publish.side_effect = None
+    publisher.publish([_event(1)])
+
+    assert connect.call_count == 2  # noqa: PLR2004
+    connect.return_value.close.assert_called_once()
@@ -1,14 +1,32 @@
+import asyncio
+import contextlib
 import logging
 import os
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 
 import uvicorn
+from common.api.deadlines import DeadlineMiddleware
 from common.api.exceptions.user import ManagedException
 from common.service_logging import LOGGING_CONFIG, configure_logging
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 
+from service.api.admin import router as admin_router
 from service.api.router import router
+from service.config import (
+    get_database_config,
+    get_user_events_config,
+    get_username_directory_config,
+)
+from service.database.bloom import get_username_filter, maintain_username_filter
+from service.database.cache import get_user_cache
+from service.database.notifications import UserChangeListener
+from service.database.outbox import OutboxRelay
+from service.database.session import close_database, init_database
+from service.database.username_directory import maintain_username_directory
+from service.events import RabbitMQPublisher
 
 
 async def handle_user_already_exists_error(
@@ -21,16 +39,100 @@ async def handle_user_already_exists_error(
     )
 
 
+def _start_outbox_relays() -> list[OutboxRelay]:
+    config = get_user_events_config()
+    if not config.user_events_enabled:
+        return []
+
+    # Each database holding users has an outbox of its own.
+    database_config = get_database_config()
+    relays = [
+        OutboxRelay(
+            url,
+            RabbitMQPublisher(config),
+            batch_size=config.user_events_batch_size,
+            poll_interval=config.user_events_poll_interval,
+        )
+        for url in database_config.db_shard_urls or [database_config.url]
+    ]
+    for relay in relays:
+        relay.start()
+    return relays
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    connector = await init_database()
+
+    cache = get_user_cache()
+    username_filter = get_username_filter()
+    listeners = []
+    if cache is not None or username_filter is not None:
+        # Users are changed on the shards they live on, so each shard is listened to.
+        config = get_database_config()
+        listeners = [
+            UserChangeListener(url, cache, username_filter=username_filter)
+            for url in config.db_shard_urls or [config.url]
+        ]
+        for listener in listeners:
+            listener.start()
+
+    filter_maintenance = None
+    if username_filter is not None:
+        # Built in the background, so startup does not wait on a full table scan.
+        filter_maintenance = asyncio.create_task(
+            maintain_username_filter(
+                username_filter,
+                connector,
+                can_build=lambda: all(listener.listening for listener in listeners),
+            ),
+        )
+
+    relays = _start_outbox_relays()
+
+    directory_maintenance = None
+    if cache is not None and cache.directory is not None:
+        config = get_database_config()
+        directory_config = get_username_directory_config()
+        directory_maintenance = asyncio.create_task(
+            maintain_username_directory(
+                cache.directory,
+                config.db_shard_urls or [config.url],
+                directory_config.username_directory_refresh_interval,
+                directory_config.username_directory_rebuild_interval,
+            ),
+        )
+
+    yield
+
+    if directory_maintenance is not None:
+        directory_maintenance.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await directory_maintenance
+    if filter_maintenance is not None:
+        filter_maintenance.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await filter_maintenance
+    for listener in listeners:
+        listener.stop()
+    for relay in relays:
+        relay.stop()
+    await close_database()
+
+
 def main() -> None:
     load_dotenv()
 
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
     app.add_exception_handler(ManagedException, handle_user_already_exists_error)
+    # Callers pass on how long they will wait, which bounds the database's work too.
+    app.add_middleware(DeadlineMiddleware)
     host = os.getenv("HOST_IP")
     port = int(os.getenv("HOST_PORT"))
 
     configure_logging()
     app.include_router(router)
+    app.include_router(admin_router)
 
     logging.info("Starting service at http://%s:%s", host, port)
 
@@ -0,0 +1,235 @@
+import argparse
+import logging
+import uuid as uuid_lib
+from collections import defaultdict
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass
+
+from common.service_logging import configure_logging
+from dotenv import load_dotenv
+from sqlalchemy import (
+    UUID,
+    Engine,
+    Row,
+    any_,
+    bindparam,
+    create_engine,
+    delete,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+
+from service.config import get_database_config
+from service.database.models import SKIP_USER_EVENTS_SETTING, User, UserShard
+from service.database.session import Base, DirectoryBase
+from service.database.sharding import shard_of
+
+DEFAULT_BATCH_SIZE = 1000
+
+_uuids = bindparam("uuids", type_=ARRAY(UUID(as_uuid=True)))
+
+# Each shard is scanned in UUID order, a batch at a time.
+_users_by_uuid = select(User.uuid, User.username).order_by(User.uuid)
+
+# The users being moved are locked on their old shard until they have been deleted
+# from it, so they cannot change while they are copied. They are not copied with
+# their `change_xid`, so they take a new one and appear in the change feed of their
+# new shard.
+_users_to_move = (
+    select(*(column for column in User.__table__.c if column.name != "change_xid"))
+    .where(User.uuid == any_(_uuids))
+    .with_for_update()
+)
+
+# An interrupted run may already have copied some of the users. The copies are not
+# new users, so no events are recorded for them.
+_copy_users = insert(User).on_conflict_do_nothing()
+_skip_user_events = text(f"SET LOCAL {SKIP_USER_EVENTS_SETTING} = on")
+
+_delete_users = delete(User).where(User.uuid == any_(_uuids))
+
+_move_in_directory = (
+    update(UserShard)
+    .where(UserShard.uuid == any_(_uuids))
+    .values(shard=bindparam("shard"))
+)
+
+_add_to_directory = (
+    insert(UserShard).on_conflict_do_nothing().returning(UserShard.username)
+)
+
+
+@dataclass
+class RebalanceReport:
+    scanned: int = 0
+    moved: int = 0
+    added_to_directory: int = 0
+
+
+def _batches(shard: Engine, batch_size: int) -> Iterator[Sequence[Row]]:
+    after = None
+    while True:
+        statement = _users_by_uuid.limit(batch_size)
+        if after is not None:
+            statement = statement.where(User.uuid > after)
+        with shard.connect() as connection:
+            users = connection.execute(statement).all()
+        if not users:
+            return
+        yield users
+        after = users[-1].uuid
+
+
+def fill_directory(
+    directory: Engine,
+    shards: Sequence[Engine],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    report: RebalanceReport | None = None,
+) -> RebalanceReport:
+    """Add every user missing from the directory, on the shard they are found on.
+
+    This brings in the users of a database that predates sharding.
+    """
+    report = report or RebalanceReport()
+    for index, shard in enumerate(shards):
+        for users in _batches(shard, batch_size):
+            with directory.begin() as connection:
+                added = connection.execute(
+                    _add_to_directory,
+                    [
+                        {"username": user.username, "uuid": user.uuid, "shard": index}
+                        for user in users
+                    ],
+                ).all()
+            report.added_to_directory += len(added)
+    return report
+
+
+def _move_users(
+    source: Engine,
+    target: Engine,
+    target_index: int,
+    directory: Engine,
+    uuids: list[uuid_lib.UUID],
+) -> int:
+    with source.begin() as source_connection:
+        users = source_connection.execute(_users_to_move, {"uuids": uuids}).all()
+        if not users:
+            return 0
+        moved = [user.uuid for user in users]
+
+        # While a user is on both shards, lookups by username follow the directory
+        # and lookups by UUID try the new shard first, so every lookup finds them.
+        with target.begin() as target_connection:
+            target_connection.execute(_skip_user_events)
+            target_connection.execute(_copy_users, [user._asdict() for user in users])
+        with directory.begin() as directory_connection:
+            directory_connection.execute(
+                _move_in_directory,
+                {"uuids": moved, "shard": target_index},
+            )
+        source_connection.execute(_delete_users, {"uuids": moved})
+    return len(moved)
+
+
+def rebalance(
+    directory: Engine,
+    shards: Sequence[Engine],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    *,
+    dry_run: bool = False,
+) -> RebalanceReport:
+    """Move every user that is not on the shard their UUID hashes to onto it.
+
+    Shards are added by appending them to `DB_SHARD_URLS`, deploying the service with
+    the new list and then running this, while the service keeps serving requests.
+    New users are placed on the new shards straight away, and about 1 / N of the
+    existing users are moved to each new shard, in batches of `batch_size`.
+    """
+    report = RebalanceReport()
+    if not dry_run:
+        fill_directory(directory, shards, batch_size, report)
+
+    for index, shard in enumerate(shards):
+        for users in _batches(shard, batch_size):
+            report.scanned += len(users)
+            misplaced = defaultdict(list)
+            for user in users:
+                target_index = shard_of(user.uuid, len(shards))
+                if target_index != index:
+                    misplaced[target_index].append(user.uuid)
+
+            for target_index, uuids in misplaced.items():
+                if dry_run:
+                    report.moved += len(uuids)
+                    continue
+                report.moved += _move_users(
+                    shard,
+                    shards[target_index],
+                    target_index,
+                    directory,
+                    uuids,
+                )
+
+        logging.info(
+            "Rebalanced shard %s: %s users scanned, %s moved so far",
+            index,
+            report.scanned,
+            report.moved,
+        )
+    return report
+
+
+def _parse_args(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Move users onto the shards their UUIDs hash to.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="users to scan per query and to move per transaction",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only count the users that would be moved",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    load_dotenv()
+    configure_logging()
+    args = _parse_args(argv)
+
+    config = get_database_config()
+    if not config.db_shard_urls:
+        msg = "DB_SHARD_URLS must list the shards to rebalance."
+        raise SystemExit(msg)
+
+    directory = create_engine(config.url)
+    shards = [create_engine(url) for url in config.db_shard_urls]
+    try:
+        DirectoryBase.metadata.create_all(directory)
+        for shard in shards:
+            Base.metadata.create_all(shard)
+        report = rebalance(directory, shards, args.batch_size, dry_run=args.dry_run)
+    finally:
+        directory.dispose()
+        for shard in shards:
+            shard.dispose()
+
+    logging.info(
+        "Rebalance finished: %s users scanned, %s %s, %s added to the directory",
+        report.scanned,
+        report.moved,
+        "to move" if args.dry_run else "moved",
+        report.added_to_directory,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+from collections.abc import Generator
+
+import pytest
+from common.api.schemas.user import CreateUserRequest
+from sqlalchemy import Engine, create_engine, func, select
+from sqlalchemy.orm import Session
+
+from service.database.models import User, UserOutboxEvent, UserShard
+from service.database.session import Base, DirectoryBase
+from service.database.sharding import shard_of
+from service.database.user_handler import UserHandler
+from service.rebalance import rebalance
+
+
+@pytest.fixture
+def engines(shard_urls: list[str]) -> Generator[list[Engine], None, None]:
+    engines = [create_engine(url) for url in shard_urls]
+    DirectoryBase.metadata.create_all(engines[0])
+    for engine in engines:
+        Base.metadata.create_all(engine)
+    yield engines
+    for engine in engines:
+        engine.dispose()
+
+
+def _uuids(engine: Engine) -> set:
+    with engine.connect() as connection:
+        return set(connection.execute(select(User.uuid)).scalars())
+
+
+def _events(engine: Engine) -> int:
+    with engine.connect() as connection:
+        return connection.execute(
+            select(func.count()).select_from(UserOutboxEvent),
+        ).scalar()
+
+
+def test_users_of_an_unsharded_database_are_spread_over_the_shards(
+    db: Session,
+    engines: list[Engine],
+) -> None:
+    handler = UserHandler(db)
+    for i in range(50):
+        handler.create_user(
+            CreateUserRequest(username=f"user{i}", hashed_password=f"hash{i}"),
+        )
+    directory, *_ = engines
+
+    report = rebalance(directory, engines, batch_size=7)
+
+    placed = [_uuids(engine) for engine in engines]
+    assert report.added_to_directory == 50  # noqa: PLR2004
+    assert report.moved == len(placed[1]) > 0
+    assert sum(len(uuids) for uuids in placed) == 50  # noqa: PLR2004
+    for shard, uuids in enumerate(placed):
+        assert all(shard_of(uuid, len(engines)) == shard for uuid in uuids)
+    with directory.connect() as connection:
+        entries = connection.execute(select(UserShard.uuid, UserShard.shard)).all()
+    assert all(shard_of(uuid, len(engines)) == shard for uuid, shard in entries)
+
+
+def test_rebalancing_again_moves_nothing(
+    db: Session,
+    engines: list[Engine],
+) -> None:
+    handler = UserHandler(db)
+    for i in range(20):
+        handler.create_user(
+            CreateUserRequest(username=f"user{i}", hashed_password=f"hash{i}"),
+        )
+    directory, *_ = engines
+    rebalance(directory, engines)
+
+    report = rebalance(directory, engines)
+
+    assert report.moved == 0
+    assert report.added_to_directory == 0
+    assert report.scanned == 20  # noqa: PLR2004
+
+
+def test_moving_users_publishes_no_events(
+    db: Session,
+    engines: list[Engine],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("USER_EVENTS_ENABLED", "true")
+    for engine in engines:
+        Base.metadata.create_all(engine)
+    handler = UserHandler(db)
+    for i in range(20):
+        handler.create_user(
+            CreateUserRequest(username=f"user{i}", hashed_password=f"hash{i}"),
+        )
+    directory, *_ = engines
+
+    report = rebalance(directory, engines)
+
+    assert report.moved > 0
+    assert [_events(engine) for engine in engines] == [20, 0]
+
+
+def test_dry_run_only_counts_the_users_to_move(
+    db: Session,
+    engines: list[Engine],
+) -> None:
+    handler = UserHandler(db)
+    for i in range(20):
+        handler.create_user(
+            CreateUserRequest(username=f"user{i}", hashed_password=f"hash{i}"),
+        )
+    directory, *_ = engines
+
+    report = rebalance(directory, engines, dry_run=True)
+
+    assert report.moved > 0
+    assert len(_uuids(engines[0])) == 20  # noqa: PLR2004
+    with directory.connect() as connection:
+        assert connection.execute(select(func.count(UserShard.uuid))).scalar() == 0